@@ -0,0 +1,94 @@
+"""Query latency of the in-process BM25 post index on a synthetic 100k-post corpus.
+
+Run from the backend directory:
+
+    python -m benchmarks.bench_post_search
+
+Term frequencies follow a Zipf-like curve, so the query mix covers both
+ends: rare terms with short postings, the most common terms (which
+appear in a large share of all posts) and search-as-you-type prefixes,
+including ones too short to be expanded. Posts have one of USERS authors
+and CATEGORIES categories, and the filtered mixes search within one.
+"""
+import itertools
+import random
+import time
+from src.services.post_search import InvertedIndexSearchEngine
+
+POSTS = 100000
+WORDS_PER_POST = 80
+VOCABULARY = 50000
+QUERIES = 300
+WRITES = 600
+USERS = 2000
+CATEGORIES = 10
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return timings[len(timings) // 2] * 1e3, timings[min(int(len(timings) * 0.99), len(timings) - 1)] * 1e3
+
+def main():
+    rng = random.Random(42)
+    vocabulary = [f'word{i}' for i in range(VOCABULARY)]
+    # Zipf-like weights so a few terms are common and most are rare
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(VOCABULARY)))
+
+    def text(n):
+        return ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=n))
+
+    def facets():
+        return {'user_id': f'user{rng.randrange(USERS)}', 'category': f'category{rng.randrange(CATEGORIES)}'}
+
+    corpus = [(i, text(6), text(WORDS_PER_POST), facets()) for i in range(POSTS)]
+
+    engine = InvertedIndexSearchEngine()
+    started = time.perf_counter()
+    engine.rebuild(corpus)
+    print(f'index build          : {time.perf_counter() - started:8.2f} s for {len(engine)} posts')
+
+    common = vocabulary[:100]
+    query_mix = {
+        'rare pair': [' '.join(rng.choices(vocabulary[1000:], k=2)) for _ in range(QUERIES)],
+        'common term': [rng.choice(common) for _ in range(QUERIES)],
+        'common pair': [' '.join(rng.choices(common, k=2)) for _ in range(QUERIES)],
+        'mixed pair': [f'{rng.choice(common)} {rng.choice(vocabulary[1000:])}' for _ in range(QUERIES)],
+        'prefix': [rng.choice(common)[:rng.randint(1, 6)] for _ in range(QUERIES)],
+        'term + prefix': [f'{rng.choice(common)} {rng.choice(common)[:rng.randint(3, 6)]}' for _ in range(QUERIES)]
+    }
+    filter_mix = {
+        'pair, user': [(' '.join(rng.choices(common, k=2)), {'user_id': f'user{rng.randrange(USERS)}'}) for _ in range(QUERIES)],
+        'pair, category': [(' '.join(rng.choices(common, k=2)), {'category': f'category{rng.randrange(CATEGORIES)}'}) for _ in range(QUERIES)]
+    }
+    runs = [(name, [(query, None) for query in queries]) for name, queries in query_mix.items()]
+    for name, queries in runs + list(filter_mix.items()):
+        for limit in (9, 1000):
+            timings = []
+            for query, filters in queries:
+                started = time.perf_counter()
+                engine.search(query, limit=limit, filters=filters)
+                timings.append(time.perf_counter() - started)
+            p50, p99 = percentiles(timings)
+            print(f'{name:<14} top {limit:<4}: p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
+
+    # Sorted searches (explicit order) test membership instead of ranking
+    timings = []
+    for query, filters in filter_mix['pair, category']:
+        started = time.perf_counter()
+        matches = engine.matches(query, filters=filters)
+        sum(1 for post_id in range(2000) if post_id in matches)
+        timings.append(time.perf_counter() - started)
+    p50, p99 = percentiles(timings)
+    print(f'matches, 2000 tests  : p50 {p50:8.3f} ms   p99 {p99:8.3f} ms')
+
+    timings = []
+    for i in range(WRITES):
+        post_id = rng.randrange(POSTS)
+        started = time.perf_counter()
+        engine.index_post(post_id, text(6), text(WORDS_PER_POST), facets())
+        timings.append(time.perf_counter() - started)
+    p50, p99 = percentiles(timings)
+    # The slowest writes are the ones that merge the delta into the base segment
+    print(f'index_post           : p50 {p50:8.3f} ms   p99 {p99:8.3f} ms   max {max(timings) * 1e3:8.3f} ms')
+
+if __name__ == '__main__':
+    main()
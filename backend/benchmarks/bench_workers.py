@@ -0,0 +1,131 @@
+"""Request throughput of the production gunicorn profile at different worker counts.
+
+Starts gunicorn with gunicorn.conf.py once per worker count, drives it
+with keep-alive HTTP clients in separate processes (so the load generator
+is not limited by one GIL) and reports requests/s and latency. The app
+needs a reachable MongoDB, taken from MONGO_URI as usual. Run from the
+backend directory:
+
+    MONGO_URI=mongodb://localhost:27017/blog python -m benchmarks.bench_workers \\
+        --workers 1 2 4 8 --clients 32 --seconds 15 --path '/api/post/getposts/?view=summary'
+
+Throughput should grow roughly linearly with workers until they match the
+number of CPU cores, then flatten; past that point extra workers only add
+memory and Mongo connections. The load generator runs on the same host,
+so leave a core or two for it (or point --host at a remote server and
+pass --no-server). On a single-core machine the curve is flat by design.
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+
+def _client(host, port, path, seconds, results):
+    """Issue requests on one keep-alive connection until time runs out"""
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+    connection = http.client.HTTPConnection(host, port, timeout=10)
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=10)
+    connection.close()
+    results.put((latencies, errors))
+
+def run_load(host, port, path, clients, seconds):
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=_client, args=(host, port, path, seconds, results))
+        for _ in range(clients)
+    ]
+    for process in processes:
+        process.start()
+    latencies, errors = [], 0
+    for _ in processes:
+        client_latencies, client_errors = results.get()
+        latencies.extend(client_latencies)
+        errors += client_errors
+    for process in processes:
+        process.join()
+    latencies.sort()
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000 if latencies else 0.0
+
+    return {
+        'rps': len(latencies) / seconds,
+        'p50': percentile(0.50),
+        'p99': percentile(0.99),
+        'errors': errors
+    }
+
+def wait_until_ready(host, port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=2)
+            connection.request('GET', '/')
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise RuntimeError('gunicorn did not start in time')
+
+def start_server(workers, port, app):
+    env = dict(os.environ,
+               GUNICORN_WORKERS=str(workers),
+               GUNICORN_BIND=f'127.0.0.1:{port}',
+               GUNICORN_ACCESS_LOG='')
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', app],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=15)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--path', default='/api/post/getposts/?view=summary')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5055)
+    parser.add_argument('--app', default='src.server:flask_app')
+    parser.add_argument('--no-server', action='store_true', help='benchmark an already running server once')
+    args = parser.parse_args()
+
+    # cpu_count() reports the host; affinity (taskset, cpusets) is what this process may use
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    print(f"{cpus} usable CPUs, {args.clients} clients, {args.seconds:g}s per run, GET {args.path}")
+    if not args.no_server and max(args.workers) > cpus:
+        print(f"Warning: more workers than usable CPUs; rows above {cpus} workers show contention, not scaling")
+    print(f"{'workers':>8} {'req/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for workers in ([None] if args.no_server else args.workers):
+        server = None if args.no_server else start_server(workers, args.port, args.app)
+        try:
+            wait_until_ready(args.host, args.port)
+            run_load(args.host, args.port, args.path, args.clients, args.warmup)
+            result = run_load(args.host, args.port, args.path, args.clients, args.seconds)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+        print(f"{workers or '-':>8} {result['rps']:>10.0f} {result['p50']:>8.2f} {result['p99']:>8.2f} {result['errors']:>7}")
+
+if __name__ == '__main__':
+    main()
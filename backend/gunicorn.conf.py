@@ -0,0 +1,131 @@
+"""Production gunicorn profile.
+
+    gunicorn -c gunicorn.conf.py src.server:flask_app
+
+Everything is tunable from the environment:
+
+    SSE_ENABLED            live comment streams, default true
+    GUNICORN_WORKER_CLASS  gevent (default with SSE) or gthread (default without)
+    GUNICORN_WORKERS       worker processes, default 2 x CPUs + 1
+    GUNICORN_THREADS       threads per gthread worker, default 8
+    GUNICORN_CONNECTIONS   concurrent connections per gevent worker, default 1000
+    GUNICORN_BIND          default 0.0.0.0:5000
+    GUNICORN_TIMEOUT       default 30
+    GUNICORN_RELOAD        true for development (disables preload_app)
+    GUNICORN_ACCESS_LOG    path, '-' for stdout (default) or empty to disable
+    SSE_MAX_SUBSCRIBERS    comment streams per worker, default
+                           GUNICORN_CONNECTIONS // 2 for gevent, threads // 4
+                           for gthread (never more than threads - 1) and 0
+                           without SSE
+
+The app is preloaded in the master so indexes, caches and the search
+index are built once and shared copy-on-write by the workers. Each worker
+then keeps its copy current with the others' writes through the change
+feed (src/services/change_feed.py), starting with everything written
+since the master booted; workers recycled by max_requests do the same.
+That catch-up (or, past CHANGE_FEED_RETENTION, a rebuild) runs in the
+feed's background thread, so the worker heartbeats meanwhile; requests
+wait up to CHANGE_FEED_READY_WAIT seconds for it, then get a 503.
+
+Anything that must not cross fork is per process: the master closes its
+MongoClient before forking (when_ready) and every worker opens its own
+on first use, with the pool sized by MONGO_MAX_POOL_SIZE /
+MONGO_MIN_POOL_SIZE / MONGO_WAIT_QUEUE_TIMEOUT_MS. A gthread worker
+needs roughly GUNICORN_THREADS + JOB_WORKERS connections at peak.
+
+Indexes, migrations and the admin user are not created here: run
+`flask bootstrap` (or `flask db-init`) once per release before starting
+gunicorn, or set DB_AUTO_INIT=true in development.
+
+Metrics are aggregated across workers through PROMETHEUS_MULTIPROC_DIR
+(a fresh temporary directory unless set) and served at /metrics.
+
+A comment stream stays open for minutes. Under gevent it only holds a
+greenlet, so every reader of a post can have one; a gthread worker would
+give each stream one of its few threads, so gthread only serves a handful
+of streams per worker and the other readers fall back to polling.
+CPU-bound work (bcrypt, search index merges and rebuilds) runs on gevent's
+native thread pool, see src/utils/native_threads.py.
+
+See benchmarks/bench_workers.py for measuring throughput per worker count.
+"""
+import glob
+import multiprocessing
+import os
+import tempfile
+
+sse_enabled = os.environ.get('SSE_ENABLED', 'true') == 'true'
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent' if sse_enabled else 'gthread')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+worker_connections = int(os.environ.get('GUNICORN_CONNECTIONS', 1000))
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+reload = os.environ.get('GUNICORN_RELOAD', 'false') == 'true'
+preload_app = not reload
+
+# Recycle workers now and then to bound memory growth of the per-process caches
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+# Empty string turns the access log off
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+
+if worker_class == 'gevent':
+    # Patch before the app is preloaded, or its locks and sockets stay blocking
+    from gevent import monkey
+    monkey.patch_all()
+
+# A gevent stream only holds a greenlet, but every open comment stream (SSE)
+# holds a gthread worker thread until it ends. A gthread worker keeps most
+# of its threads for the API and streams beyond the cap get a 503, on which
+# the frontend polls instead.
+if not sse_enabled:
+    sse_limit = sse_default = 0
+elif worker_class == 'gthread':
+    sse_limit = max(0, threads - 1)
+    sse_default = threads // 4
+    print(f"Comment streams hold a gthread thread each; serving {sse_default} per worker, use the gevent worker for more")
+else:
+    sse_limit = sse_default = worker_connections // 2
+sse_max_subscribers = int(os.environ.get('SSE_MAX_SUBSCRIBERS', sse_default))
+if sse_max_subscribers > sse_limit:
+    print(f"SSE_MAX_SUBSCRIBERS={sse_max_subscribers} would leave no {worker_class} thread for the API, using {sse_limit}")
+    sse_max_subscribers = sse_limit
+os.environ['SSE_MAX_SUBSCRIBERS'] = str(sse_max_subscribers)
+
+# Every process writes its metrics to mmap'ed files here and /metrics sums them.
+# Must be set before prometheus_client is imported, i.e. before the app loads.
+metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='blog-metrics-'))
+os.makedirs(metrics_dir, exist_ok=True)
+for stale in glob.glob(os.path.join(metrics_dir, '*.db')):
+    os.remove(stale)  # left over from a previous run
+
+# Workers resume background jobs themselves, after fork (see post_fork)
+os.environ['RESUME_JOBS_ON_START'] = 'false'
+
+# Refuse to serve a database that `flask db-init` has not brought up to date
+os.environ.setdefault('SCHEMA_CHECK', 'strict')
+
+def when_ready(server):
+    if preload_app:
+        app = server.app.wsgi()
+        # Workers inherit the master's search index, so it is finished before they fork
+        app.post_model.wait_for_search_index()
+        # Connections opened while building the app must not be inherited by workers
+        app.mongo.close()
+
+def post_fork(server, worker):
+    app = worker.app.wsgi()
+    app.job_queue.resume()
+    # Catch up on writes made since the master built its indexes, then follow the other
+    # workers; in the background, so this returns before the first heartbeat is due
+    app.change_feed.start()
+
+def child_exit(server, worker):
+    # Drop the live gauges of a stopped worker; its counters keep counting in the totals
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
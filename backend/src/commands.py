@@ -0,0 +1,30 @@
+import click
+
+def register_commands(app):
+    """Maintenance commands, run with `flask <command>` (FLASK_APP=src.server:flask_app)"""
+    
+    @app.cli.command('db-init')
+    def db_init():
+        """Create indexes, run data migrations and stamp the schema version."""
+        _init_db(app)
+    
+    @app.cli.command('bootstrap')
+    def bootstrap():
+        """db-init, then create the default admin user from ADMIN_* variables."""
+        _init_db(app)
+        app.user_model.create_default_admin()
+    
+    @app.cli.command('repair-counters')
+    def repair_counters():
+        """Recompute comment_count and total_comment_likes on every post."""
+        commented = app.post_model.repair_comment_counters()
+        # The running workers hold the old counts in their cached pages
+        app.post_model.clear_cached_results()
+        click.echo(f'Comment counters repaired ({commented} posts with comments)')
+
+def _init_db(app):
+    from .services.schema import init_db
+    import time
+    started = time.perf_counter()
+    version = init_db(app.mongo.database(), app.user_model, app.post_model, app.comment_model, app.job_queue, app.change_feed)
+    click.echo(f'Database initialized at schema version {version} in {(time.perf_counter() - started) * 1000:.0f} ms')
@@ -1,6 +1,7 @@
-from flask import request, jsonify, make_response
-from ..models.user_model import User, bcrypt
+from flask import request, jsonify, make_response, current_app
+from ..models.user_model import User, PROFILE_PROJECTION
 from ..utils.utils import error_handler, generate_token
+from ..utils.password_hasher import HasherBusyError
 
 def signup(user_model):
     data = request.get_json()
@@ -13,14 +14,17 @@ def signup(user_model):
         return error_handler(400, 'All fields are required')
     
     # Check if user already exists
-    if user_model.find_by_email(email):
+    if user_model.exists_by_email(email):
         return error_handler(400, 'Email already exists')
     
-    if user_model.find_by_username(username):
+    if user_model.exists_by_username(username):
         return error_handler(400, 'Username already exists')
     
     # Hash password
-    hashed_password = bcrypt.generate_password_hash(password).decode('utf-8')
+    try:
+        hashed_password = current_app.password_hasher.hash_password(password)
+    except HasherBusyError:
+        return error_handler(503, 'Server is busy, please try again')
     
     # Create new user
     new_user = User(
@@ -52,10 +56,18 @@ def signin(user_model):
         if not valid_user:
             return error_handler(404, 'User not found')
         
-        if not bcrypt.check_password_hash(valid_user.password, password):
+        password_hasher = current_app.password_hasher
+        if not password_hasher.check_password(valid_user.password, password):
             return error_handler(400, 'Invalid password')
         
-        token = generate_token(valid_user._id, valid_user.is_admin)
+        # Upgrade hashes made with an outdated cost factor
+        if password_hasher.needs_rehash(valid_user.password):
+            try:
+                user_model.set_password_hash(valid_user._id, password_hasher.hash_password(password))
+            except HasherBusyError:
+                pass
+        
+        token = generate_token(valid_user._id, valid_user.is_admin, valid_user.token_version)
         
         user_data = valid_user.to_dict()
         
@@ -82,6 +94,8 @@ def signin(user_model):
         
         return response
         
+    except HasherBusyError:
+        return error_handler(503, 'Server is busy, please try again')
     except Exception as e:
         return error_handler(500, str(e))
 
@@ -93,10 +107,10 @@ def google_auth(user_model):
     google_photo_url = data.get('googlePhotoUrl')
     
     try:
-        user = user_model.find_by_email(email)
+        user = user_model.find_by_email(email, PROFILE_PROJECTION)
         
         if user:
-            token = generate_token(user._id, user.is_admin)
+            token = generate_token(user._id, user.is_admin, user.token_version)
             user_data = user.to_dict()
             
             ##response = make_response(jsonify({
@@ -126,14 +140,14 @@ def google_auth(user_model):
             import string
             
             generated_password = ''.join(random.choices(string.ascii_letters + string.digits, k=16))
-            hashed_password = bcrypt.generate_password_hash(generated_password).decode('utf-8')
+            hashed_password = current_app.password_hasher.hash_password(generated_password)
             
             # Generate username from name
             base_username = name.lower().replace(' ', '')
             username = f"{base_username}{random.randint(1000, 9999)}"
             
             # Ensure username is unique
-            while user_model.find_by_username(username):
+            while user_model.exists_by_username(username):
                 username = f"{base_username}{random.randint(1000, 9999)}"
             
             new_user = User(
@@ -145,7 +159,7 @@ def google_auth(user_model):
             
             user_model.create_user(new_user)
             
-            token = generate_token(new_user._id, new_user.is_admin)
+            token = generate_token(new_user._id, new_user.is_admin, new_user.token_version)
             user_data = new_user.to_dict()
             
             ##response = make_response(jsonify({
@@ -170,6 +184,8 @@ def google_auth(user_model):
             
             return response
             
+    except HasherBusyError:
+        return error_handler(503, 'Server is busy, please try again')
     except Exception as e:
         return error_handler(500, str(e))
 
@@ -1,7 +1,17 @@
-from flask import request, jsonify
-from ..models.comment_model import Comment, CommentModel
-from ..utils.utils import error_handler, token_required
-from datetime import datetime, timedelta
+from flask import request, jsonify, Response
+from ..models.comment_model import Comment, LIKES_COLLECTION
+from ..utils.utils import error_handler, token_required, token_claims_required, optional_user_id
+from ..utils.pagination import next_cursor
+from ..utils.fieldsets import parse_fields
+from ..services.event_hub import EventHub, HubFullError
+from ..utils.conditional import make_etag, timestamp_ms, is_not_modified, not_modified_response, add_validators
+import time
+
+def _publish(post_id, event, data):
+    """Push a comment change to the post's live subscribers in this and every other worker process"""
+    from flask import current_app
+    current_app.comment_events.publish(post_id, event, data)
+    current_app.change_feed.publish('comment', {'post_id': post_id, 'event': event, 'data': data})
 
 @token_required
 def create_comment(current_user):
@@ -18,7 +28,14 @@ def create_comment(current_user):
         if user_id != current_user.id:
             return error_handler(403, 'You are not allowed to create this comment')
         
-        comment_model = CommentModel(current_user._user_model.db)
+        comment_model = current_user._comment_model
+        
+        # Replies must stay within the parent's post
+        parent = None
+        if data.get('parentId'):
+            parent = comment_model.find_parent(data['parentId'])
+            if not parent or parent.post_id != post_id:
+                return error_handler(400, 'Parent comment not found on this post')
         
         new_comment = Comment(
             content=content,
@@ -26,48 +43,166 @@ def create_comment(current_user):
             user_id=user_id
         )
         
-        saved_comment = comment_model.create_comment(new_comment)
-        return jsonify(saved_comment.to_dict())
+        saved_comment = comment_model.create_comment(new_comment, parent=parent)
+        comment_data = saved_comment.to_dict()
+        comment_data['author'] = current_user._user_model.find_authors([user_id])[user_id]
+        _publish(post_id, 'comment.created', comment_data)
+        return jsonify(comment_data)
         
     except Exception as e:
         return error_handler(500, str(e))
 
+def _serialize_with_authors(comments):
+    """Comment dicts (with any loaded replies) carrying their authors, resolved in one query"""
+    from flask import current_app, g
+    
+    replies = [reply for comment in comments for reply in comment.replies or []]
+    authors = current_app.user_model.find_authors(
+        [comment.user_id for comment in comments + replies],
+        memo=g.setdefault('authors', {})
+    )
+    
+    def serialize(comment):
+        comment_data = comment.to_dict()
+        comment_data['author'] = authors.get(comment.user_id)
+        if comment.replies is not None:
+            comment_data['replies'] = [serialize(reply) for reply in comment.replies]
+            comment_data['hasMoreReplies'] = comment.has_more_replies
+        return comment_data
+    
+    return [serialize(comment) for comment in comments]
+
 def get_post_comments(post_id):
     try:
         from flask import current_app
         
-        comment_model = CommentModel(current_app.user_model.db)
-        comments = comment_model.find_by_post_id(post_id, sort_direction=-1)
+        comment_model = current_app.comment_model
+        
+        limit = max(min(int(request.args.get('limit', 20)), 100), 1)
+        cursor = request.args.get('cursor')
+        # ?threaded=true pages through top-level comments, each with its first replies
+        threaded = request.args.get('threaded') == 'true'
+        replies = max(min(int(request.args.get('replies', 3)), 20), 0)
+        
+        # With the collection likes store, likes reflects only the viewer's own like
+        viewer_id = optional_user_id() if comment_model.likes_store == LIKES_COLLECTION else None
+        
+        # Two indexed point reads validate the page: the post's comment counters
+        # (every comment write bumps its version) and the newest profile change,
+        # which covers the inlined authors
+        count, version, comments_updated = current_app.post_model.find_comment_validators(post_id)
+        authors_updated = current_app.user_model.latest_profile_change()
+        etag = make_etag('comments', post_id, count, version, timestamp_ms(authors_updated), request.query_string, viewer_id)
+        last_updated = max((value for value in (comments_updated, authors_updated) if value is not None), default=None)
+        if is_not_modified(etag, last_updated):
+            return not_modified_response(etag, last_updated)
+        
+        if threaded:
+            comments = comment_model.find_threads(post_id, limit=limit, replies=replies, cursor=cursor)
+            loaded = comments + [reply for comment in comments for reply in comment.replies]
+        else:
+            comments = comment_model.find_by_post_id(post_id, sort_direction=-1, cursor=cursor, limit=limit)
+            loaded = comments
+        comment_model.fill_viewer_likes(loaded, viewer_id)
+        
+        response_data = {
+            'comments': _serialize_with_authors(comments),
+            'nextCursor': next_cursor(comments, limit, 'created_at'),
+            'totalComments': count
+        }
+        return add_validators(jsonify(response_data), etag, last_updated)
+        
+    except ValueError as e:
+        return error_handler(400, str(e))
+    except Exception as e:
+        return error_handler(500, str(e))
+
+def get_comment_thread(comment_id):
+    """A comment and its whole reply subtree, in thread order"""
+    try:
+        from flask import current_app
+        
+        comment_model = current_app.comment_model
+        comments = comment_model.find_subtree(comment_id)
+        if not comments:
+            return error_handler(404, 'Comment not found')
         
-        comments_data = [comment.to_dict() for comment in comments]
-        return jsonify(comments_data)
+        viewer_id = optional_user_id() if comment_model.likes_store == LIKES_COLLECTION else None
+        comment_model.fill_viewer_likes(comments, viewer_id)
+        return jsonify({'comments': _serialize_with_authors(comments)})
         
     except Exception as e:
         return error_handler(500, str(e))
 
-@token_required
+def stream_post_comments(post_id):
+    """Server-Sent Events stream of a post's comment changes.
+
+    Streams end after SSE_MAX_STREAM_SECONDS so a connection never holds a
+    greenlet (or a gthread worker thread) indefinitely; EventSource
+    reconnects on its own. A client that falls behind is evicted and told
+    to reload. Beyond SSE_MAX_SUBSCRIBERS streams per process the answer
+    is 503, which the frontend takes as the cue to poll instead.
+    """
+    from flask import current_app
+    
+    hub = current_app.comment_events
+    heartbeat = current_app.config['SSE_HEARTBEAT']
+    max_age = current_app.config['SSE_MAX_STREAM_SECONDS']
+    retry_ms = current_app.config['SSE_RETRY_MS']
+    
+    try:
+        subscription = hub.subscribe(post_id)
+    except HubFullError:
+        # Past the cap clients poll the comment list instead
+        response = error_handler(503, 'Too many live connections, please retry later')
+        response.headers['Retry-After'] = str(max_age)
+        return response
+    
+    def events():
+        try:
+            yield f"retry: {retry_ms}\n\n"
+            deadline = time.monotonic() + max_age
+            while time.monotonic() < deadline:
+                message = subscription.get(timeout=heartbeat)
+                if subscription.evicted:
+                    yield EventHub.format_event('evicted', {})
+                    return
+                # A comment line keeps proxies from closing an idle stream
+                yield message if message is not None else ': heartbeat\n\n'
+        finally:
+            hub.unsubscribe(subscription)
+    
+    return Response(events(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+@token_claims_required
 def like_comment(current_user, comment_id):
     try:
-        comment_model = CommentModel(current_user._user_model.db)
+        comment_model = current_user._comment_model
         
-        comment = comment_model.find_by_id(comment_id)
-        if not comment:
-            return error_handler(404, 'Comment not found')
-        
-        # Toggle like using the model method
+        # One atomic update; None means the comment does not exist
         updated_comment = comment_model.toggle_like(comment_id, current_user.id)
+        if not updated_comment:
+            return error_handler(404, 'Comment not found')
         
+        # likes is per-viewer in the collection store, so only the count is broadcast
+        _publish(updated_comment.post_id, 'comment.liked', {'_id': updated_comment.id, 'numberOfLikes': updated_comment.number_of_likes})
         return jsonify(updated_comment.to_dict())
         
+    except ValueError:
+        return error_handler(404, 'Comment not found')
     except Exception as e:
         return error_handler(500, str(e))
 
 @token_required
 def edit_comment(current_user, comment_id):
     try:
-        comment_model = CommentModel(current_user._user_model.db)
+        comment_model = current_user._comment_model
         
-        comment = comment_model.find_by_id(comment_id)
+        # Only the owner is needed for the permission check
+        comment = comment_model.find_by_id(comment_id, {'user_id': 1})
         if not comment:
             return error_handler(404, 'Comment not found')
         
@@ -86,6 +221,11 @@ def edit_comment(current_user, comment_id):
             return error_handler(404, 'Comment not found')
         
         updated_comment = comment_model.find_by_id(comment_id)
+        _publish(updated_comment.post_id, 'comment.updated', {
+            '_id': updated_comment.id,
+            'content': updated_comment.content,
+            'updatedAt': updated_comment.to_dict(['updatedAt'])['updatedAt']
+        })
         return jsonify(updated_comment.to_dict())
         
     except Exception as e:
@@ -94,9 +234,10 @@ def edit_comment(current_user, comment_id):
 @token_required
 def delete_comment(current_user, comment_id):
     try:
-        comment_model = CommentModel(current_user._user_model.db)
+        comment_model = current_user._comment_model
         
-        comment = comment_model.find_by_id(comment_id)
+        # Only the owner (and the post, for live updates) is needed
+        comment = comment_model.find_by_id(comment_id, {'user_id': 1, 'post_id': 1})
         if not comment:
             return error_handler(404, 'Comment not found')
         
@@ -104,50 +245,60 @@ def delete_comment(current_user, comment_id):
         if comment.user_id != current_user.id and not current_user.is_admin:
             return error_handler(403, 'You are not allowed to delete this comment')
         
-        # Delete comment
-        result = comment_model.delete_comment(comment_id)
+        # Delete comment, with its replies
+        deleted_ids = comment_model.delete_comment(comment_id)
         
-        if not result:
+        if not deleted_ids:
             return error_handler(404, 'Comment not found')
         
-        return jsonify({'message': 'Comment has been deleted'})
+        # Readers drop the replies from their list and the whole subtree from the total
+        deleted = {'_id': comment_id, 'deletedIds': deleted_ids, 'deleted': len(deleted_ids)}
+        _publish(comment.post_id, 'comment.deleted', deleted)
+        return jsonify({'message': 'Comment has been deleted', **deleted})
         
     except Exception as e:
         return error_handler(500, str(e))
 
-@token_required
+@token_claims_required
 def get_comments(current_user):
     if not current_user.is_admin:
         return error_handler(403, 'You are not allowed to get all comments')
     
     try:
-        comment_model = CommentModel(current_user._user_model.db)
+        comment_model = current_user._comment_model
         
         start_index = int(request.args.get('startIndex', 0))
         limit = int(request.args.get('limit', 9))
         sort_direction = 1 if request.args.get('sort') == 'desc' else -1
+        cursor = request.args.get('cursor')
+        fields = parse_fields(request.args, Comment.FIELDS, Comment.SUMMARY_FIELDS)
         
         # Get comments with pagination and sorting
         comments = comment_model.get_all_comments(
             sort_direction=sort_direction,
             skip=start_index,
-            limit=limit
+            limit=limit,
+            cursor=cursor,
+            fields=fields
         )
         
-        comments_data = [comment.to_dict() for comment in comments]
-        total_comments = comment_model.count_comments()
-        
-        # Last month comments count
-        one_month_ago = datetime.utcnow() - timedelta(days=30)
-        last_month_comments = comment_model.count_comments({
-            'created_at': {'$gte': one_month_ago}
-        })
+        comments_data = [comment.to_dict(fields) for comment in comments]
         
-        return jsonify({
+        response_data = {
             'comments': comments_data,
-            'totalComments': total_comments,
-            'lastMonthComments': last_month_comments
-        })
+            'nextCursor': next_cursor(comments, limit, 'created_at')
+        }
+        
+        # Totals are only computed when asked for (?stats=true)
+        if request.args.get('stats') == 'true':
+            from flask import current_app
+            stats = current_app.stats.get('comments')
+            response_data['totalComments'] = stats['total']
+            response_data['lastMonthComments'] = stats['lastMonth']
+        
+        return jsonify(response_data)
         
+    except ValueError as e:
+        return error_handler(400, str(e))
     except Exception as e:
         return error_handler(500, str(e))
\ No newline at end of file
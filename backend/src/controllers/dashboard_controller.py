@@ -0,0 +1,42 @@
+from flask import jsonify, current_app
+from ..utils.utils import error_handler, token_claims_required
+from datetime import datetime, timedelta
+
+SUMMARY_CACHE_KEY = 'summary'
+
+def _build_summary(limit=5):
+    one_month_ago = datetime.utcnow() - timedelta(days=30)
+    
+    users, total_users, last_month_users = current_app.user_model.summarize(limit, one_month_ago)
+    posts, total_posts, last_month_posts = current_app.post_model.summarize(limit, one_month_ago)
+    comments, total_comments, last_month_comments = current_app.comment_model.summarize(limit, one_month_ago)
+    
+    return {
+        'users': [user.to_dict() for user in users],
+        'totalUsers': total_users,
+        'lastMonthUsers': last_month_users,
+        'posts': [post.to_dict() for post in posts],
+        'totalPosts': total_posts,
+        'lastMonthPosts': last_month_posts,
+        'comments': [comment.to_dict() for comment in comments],
+        'totalComments': total_comments,
+        'lastMonthComments': last_month_comments
+    }
+
+@token_claims_required
+def get_summary(current_user):
+    if not current_user.is_admin:
+        return error_handler(403, 'You are not allowed to see the dashboard')
+    
+    try:
+        # One short-lived summary is shared by every admin
+        summary_cache = current_app.dashboard_cache
+        summary = summary_cache.get(SUMMARY_CACHE_KEY)
+        if summary is None:
+            summary = _build_summary()
+            summary_cache.set(SUMMARY_CACHE_KEY, summary)
+        
+        return jsonify(summary)
+        
+    except Exception as e:
+        return error_handler(500, str(e))
@@ -0,0 +1,19 @@
+from flask import jsonify, current_app
+from ..services.job_queue import JobQueue
+from ..utils.utils import error_handler, token_claims_required
+
+@token_claims_required
+def get_job(current_user, job_id):
+    try:
+        job = current_app.job_queue.get(job_id)
+        if not job:
+            return error_handler(404, 'Job not found')
+        
+        # Admins see every job, other users only the ones they started
+        if not current_user.is_admin and job.get('requested_by') != current_user.id:
+            return error_handler(403, 'You are not allowed to see this job')
+        
+        return jsonify(JobQueue.to_dict(job))
+        
+    except Exception as e:
+        return error_handler(500, str(e))
@@ -0,0 +1,14 @@
+from flask import Response, current_app, request
+from prometheus_client import CONTENT_TYPE_LATEST
+from ..utils.metrics import render_metrics
+from ..utils.utils import error_handler
+import hmac
+
+def get_metrics():
+    # Scrapers authenticate with a static bearer token when METRICS_TOKEN is set
+    token = current_app.config['METRICS_TOKEN']
+    if token and not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return error_handler(401, 'Unauthorized')
+    
+    current_app.process_stats.sync()
+    return Response(render_metrics(), mimetype=CONTENT_TYPE_LATEST)
@@ -1,7 +1,11 @@
 from flask import request, jsonify
-from ..models.post_model import Post, PostModel
-from ..utils.utils import error_handler, token_required
-from datetime import datetime, timedelta
+from ..models.post_model import Post
+from ..services.post_search import SearchIndexNotReady
+from ..utils.utils import error_handler, token_required, token_claims_required
+from ..utils.pagination import next_cursor
+from ..utils.fieldsets import parse_fields
+from ..utils.conditional import make_etag, timestamp_ms, is_not_modified, not_modified_response, add_validators
+from datetime import datetime
 import re
 
 @token_required
@@ -35,8 +39,8 @@ def create_post(current_user):
             category=data.get('category')
         )
         
-        # Create PostModel instance and save
-        post_model_obj = PostModel(current_user._user_model.db)
+        # Save through the shared PostModel
+        post_model_obj = current_user._post_model
         saved_post = post_model_obj.create_post(new_post)
         
         return jsonify(saved_post.to_dict()), 201
@@ -60,12 +64,18 @@ def get_posts():
         start_index = int(request.args.get('startIndex', 0))
         limit = int(request.args.get('limit', 9))
         sort_direction = 1 if request.args.get('order') == 'asc' else -1
+        sort_by = request.args.get('sortBy')
+        if sort_by and sort_by not in Post.SORT_FIELDS:
+            return error_handler(400, f"sortBy must be one of: {', '.join(Post.SORT_FIELDS)}")
+        sort_field = Post.SORT_FIELDS[sort_by or 'updatedAt']
+        cursor = request.args.get('cursor')
         
         user_id = request.args.get('userId')
         category = request.args.get('category')
         slug = request.args.get('slug')
         post_id = request.args.get('postId')
         search_term = request.args.get('searchTerm')
+        fields = parse_fields(request.args, Post.FIELDS, Post.SUMMARY_FIELDS)
         
         # Build query filter
         query_filter = {}
@@ -83,36 +93,91 @@ def get_posts():
             except:
                 return error_handler(400, 'Invalid post ID')
         
-        if search_term:
-            query_filter['$or'] = [
-                {'title': {'$regex': search_term, '$options': 'i'}},
-                {'content': {'$regex': search_term, '$options': 'i'}}
-            ]
-
-        # Use post_model directly
-        posts = post_model.search_posts(
-            query_filter=query_filter,
-            sort_field='updated_at',
-            sort_direction=sort_direction,
-            skip=start_index,
-            limit=limit
-        )
+        # Single-post reads can be revalidated from updated_at and the comment counters without loading the post
+        etag = updated_at = None
+        if (slug or post_id) and request.args.get('stats') != 'true':
+            validators = post_model.find_validators(query_filter)
+            if validators is not None:
+                updated_at, comment_count, total_comment_likes = validators
+                etag = make_etag('post', timestamp_ms(updated_at), comment_count, total_comment_likes, request.query_string)
+                if is_not_modified(etag, updated_at):
+                    return not_modified_response(etag, updated_at)
+        
+        # Repeated parameter combinations are served from the result cache
+        order = request.args.get('order')
+        if order:
+            order = 'asc' if order == 'asc' else 'desc'
+        normalized_search = search_term.strip().lower() if search_term else None
+        cache_key = (user_id, category, slug, post_id, normalized_search, order, sort_by, start_index, limit, cursor, tuple(fields or ()))
+        result_cache = post_model.result_cache
+        cached, generation = result_cache.get(cache_key) if result_cache is not None else (None, None)
         
-        posts_data = [post.to_dict() for post in posts]
-        total_posts = post_model.count_posts()
+        if cached is not None:
+            posts_data, page_cursor = cached
+        else:
+            if search_term and not (order or sort_by):
+                # Relevance-ranked results from the in-process search index
+                posts = post_model.search_ranked(
+                    search_term,
+                    query_filter=query_filter,
+                    skip=start_index,
+                    limit=limit,
+                    fields=fields
+                )
+                page_cursor = None
+            elif search_term:
+                # An explicit order or sortBy sorts the matches instead of ranking them
+                posts = post_model.search_sorted(
+                    search_term,
+                    query_filter=query_filter,
+                    sort_field=sort_field,
+                    sort_direction=sort_direction,
+                    skip=start_index,
+                    limit=limit,
+                    cursor=cursor,
+                    fields=fields
+                )
+                page_cursor = next_cursor(posts, limit, sort_field)
+            else:
+                # Use post_model directly
+                posts = post_model.search_posts(
+                    query_filter=query_filter,
+                    sort_field=sort_field,
+                    sort_direction=sort_direction,
+                    skip=start_index,
+                    limit=limit,
+                    cursor=cursor,
+                    fields=fields
+                )
+                page_cursor = next_cursor(posts, limit, sort_field)
         
-        # Last month posts count
-        one_month_ago = datetime.utcnow() - timedelta(days=30)
-        last_month_posts = post_model.count_posts({
-            'created_at': {'$gte': one_month_ago}
-        })
+            posts_data = [post.to_dict(fields) for post in posts]
+            
+            if result_cache is not None:
+                result_cache.set(cache_key, (posts_data, page_cursor), result_cache.scope_for(slug, post_id), generation)
         
-        return jsonify({
+        response_data = {
             'posts': posts_data,
-            'totalPosts': total_posts,
-            'lastMonthPosts': last_month_posts
-        })
+            'nextCursor': page_cursor
+        }
         
+        # Totals are only computed when asked for (?stats=true)
+        if request.args.get('stats') == 'true':
+            stats = current_app.stats.get('posts')
+            response_data['totalPosts'] = stats['total']
+            response_data['lastMonthPosts'] = stats['lastMonth']
+        
+        if etag:
+            return add_validators(jsonify(response_data), etag, updated_at)
+        return jsonify(response_data)
+        
+    except SearchIndexNotReady:
+        # Only right after startup, while the index is first built
+        response = error_handler(503, 'Search is starting up, please retry shortly')
+        response.headers['Retry-After'] = '5'
+        return response
+    except ValueError as e:
+        return error_handler(400, str(e))
     except Exception as e:
         print(f"Error in get_posts: {str(e)}")  # Debugging အတွက်
         return error_handler(500, str(e))
@@ -123,13 +188,18 @@ def delete_post(current_user, post_id, user_id):
         return error_handler(403, 'You are not allowed to delete this post')
     
     try:
-        post_model = PostModel(current_user._user_model.db)
-        result = post_model.delete_post(post_id)
-        
-        if not result:
+        post_model = current_user._post_model
+        if not post_model.find_by_id(post_id, {'_id': 1}):
             return error_handler(404, 'Post not found')
         
-        return jsonify({'message': 'The post has been deleted'})
+        # Comments are removed in the background; the job id can be polled at /api/jobs/<id>.
+        # The job is recorded first, so that nothing is orphaned if this request stops halfway
+        from flask import current_app
+        job_queue = current_app.job_queue
+        job_id = job_queue.enqueue('delete_post', {'post_id': post_id}, requested_by=current_user.id, start=False)
+        post_model.delete_post(post_id)
+        job_queue.start(job_id)
+        return jsonify({'message': 'The post has been deleted', 'jobId': job_id}), 202
         
     except Exception as e:
         return error_handler(500, str(e))
@@ -152,7 +222,7 @@ def update_post(current_user, post_id, user_id):
         if 'image' in data:
             update_data['image'] = data['image']
         
-        post_model = PostModel(current_user._user_model.db)
+        post_model = current_user._post_model
         result = post_model.update_post(post_id, update_data)
         
         if not result:
@@ -162,4 +232,28 @@ def update_post(current_user, post_id, user_id):
         return jsonify(updated_post.to_dict())
         
     except Exception as e:
-        return error_handler(500, str(e))
\ No newline at end of file
+        return error_handler(500, str(e))
+
+def suggest_posts():
+    try:
+        from flask import current_app
+        
+        prefix = request.args.get('prefix', '')
+        limit = min(int(request.args.get('limit', 10)), 50)
+        
+        suggestions = current_app.post_model.suggest_titles(prefix, limit)
+        return jsonify({'suggestions': suggestions})
+        
+    except ValueError as e:
+        return error_handler(400, str(e))
+    except Exception as e:
+        return error_handler(500, str(e))
+
+
+@token_claims_required
+def get_post_cache_stats(current_user):
+    if not current_user.is_admin:
+        return error_handler(403, 'You are not allowed to see cache stats')
+    
+    from flask import current_app
+    return jsonify(current_app.post_model.result_cache.stats())
@@ -0,0 +1,24 @@
+from flask import jsonify, current_app, request
+from ..utils.utils import error_handler, token_claims_required
+
+@token_claims_required
+def get_profiles(current_user):
+    if not current_user.is_admin:
+        return error_handler(403, 'You are not allowed to see request profiles')
+    
+    if current_app.profiler is None:
+        return error_handler(404, 'Profiler is disabled; set PROFILER_ENABLED=true')
+    
+    # ?endpoint=post.get_posts_route narrows the result to one endpoint
+    return jsonify(current_app.profiler.snapshot(request.args.get('endpoint')))
+
+@token_claims_required
+def clear_profiles(current_user):
+    if not current_user.is_admin:
+        return error_handler(403, 'You are not allowed to clear request profiles')
+    
+    if current_app.profiler is None:
+        return error_handler(404, 'Profiler is disabled; set PROFILER_ENABLED=true')
+    
+    current_app.profiler.clear()
+    return jsonify({'message': 'Request profiles cleared'})
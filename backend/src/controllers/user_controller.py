@@ -1,8 +1,10 @@
-from flask import request, jsonify, make_response
-from ..models.user_model import User, UserModel
-from ..utils.utils import error_handler, token_required
-import bcrypt
-from datetime import datetime, timedelta
+from flask import request, jsonify, make_response, current_app
+from ..models.user_model import User, PROFILE_PROJECTION
+from ..utils.utils import error_handler, token_required, token_claims_required, generate_token
+from ..utils.password_hasher import HasherBusyError
+from ..utils.pagination import next_cursor
+from ..utils.fieldsets import parse_fields
+from ..utils.conditional import make_etag, timestamp_ms, is_not_modified, not_modified_response, add_validators
 
 def test():
     return jsonify({'message': 'API is working!'})
@@ -22,7 +24,10 @@ def update_user(current_user, user_id):
     if 'password' in data and data['password']:
         if len(data['password']) < 6:
             return error_handler(400, 'Password must be at least 6 characters')
-        data['password'] = bcrypt.hashpw(data['password'].encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        try:
+            data['password'] = current_app.password_hasher.hash_password(data['password'])
+        except HasherBusyError:
+            return error_handler(503, 'Server is busy, please try again')
     
     # Username validation
     if 'username' in data and data['username']:
@@ -51,10 +56,23 @@ def update_user(current_user, user_id):
             update_data['password'] = data['password']
         
         user_model.update_user(user_id, update_data)
-        updated_user = user_model.find_by_id(user_id)
+        updated_user = user_model.find_by_id(user_id, PROFILE_PROJECTION)
         
         user_data = updated_user.to_dict()
-        return jsonify(user_data)
+        response = make_response(jsonify(user_data))
+        
+        # A password change revokes older tokens, so hand out a fresh one
+        if 'password' in update_data:
+            token = generate_token(updated_user._id, updated_user.is_admin, updated_user.token_version)
+            response.set_cookie(
+                'access_token',
+                token,
+                httponly=True,
+                secure=False,
+                samesite='Lax'
+            )
+        
+        return response
         
     except Exception as e:
         return error_handler(500, str(e))
@@ -66,8 +84,16 @@ def delete_user(current_user, user_id):
     
     try:
         user_model = current_user._user_model
-        user_model.collection.delete_one({'_id': user_model._to_object_id(user_id)})
-        return jsonify({'message': 'User has been deleted'})
+        if not user_model.find_by_id(user_id, {'_id': 1}):
+            return error_handler(404, 'User not found')
+        
+        # Posts, comments and likes are removed in the background; poll /api/jobs/<id>.
+        # The job is recorded first, so that nothing is orphaned if this request stops halfway
+        job_queue = current_app.job_queue
+        job_id = job_queue.enqueue('delete_user', {'user_id': user_id}, requested_by=current_user.id, start=False)
+        user_model.delete_user(user_id)
+        job_queue.start(job_id)
+        return jsonify({'message': 'User has been deleted', 'jobId': job_id}), 202
     except Exception as e:
         return error_handler(500, str(e))
 
@@ -76,7 +102,7 @@ def signout():
     response.set_cookie('access_token', '', expires=0)
     return response
 
-@token_required
+@token_claims_required
 def get_users(current_user):
     if not current_user.is_admin:
         return error_handler(403, 'You are not allowed to see all users')
@@ -87,27 +113,60 @@ def get_users(current_user):
         start_index = int(request.args.get('startIndex', 0))
         limit = int(request.args.get('limit', 9))
         sort_direction = 1 if request.args.get('sort') == 'asc' else -1
+        cursor = request.args.get('cursor')
+        fields = parse_fields(request.args, User.FIELDS, User.SUMMARY_FIELDS)
         
         # Get users with pagination and sorting
-        users_cursor = user_model.collection.find().sort('created_at', sort_direction).skip(start_index).limit(limit)
-        users = [User.from_dict(user) for user in users_cursor]
+        users = user_model.get_all_users(
+            sort_direction=sort_direction,
+            skip=start_index,
+            limit=limit,
+            cursor=cursor,
+            fields=fields
+        )
         
-        users_without_password = [user.to_dict() for user in users]
+        users_without_password = [user.to_dict(fields) for user in users]
         
-        total_users = user_model.collection.count_documents({})
+        response_data = {
+            'users': users_without_password,
+            'nextCursor': next_cursor(users, limit, 'created_at')
+        }
         
-        # Last month users count
-        one_month_ago = datetime.utcnow() - timedelta(days=30)
-        last_month_users = user_model.collection.count_documents({
-            'created_at': {'$gte': one_month_ago}
-        })
+        # Totals are only computed when asked for (?stats=true)
+        if request.args.get('stats') == 'true':
+            stats = current_app.stats.get('users')
+            response_data['totalUsers'] = stats['total']
+            response_data['lastMonthUsers'] = stats['lastMonth']
         
-        return jsonify({
-            'users': users_without_password,
-            'totalUsers': total_users,
-            'lastMonthUsers': last_month_users
-        })
+        return jsonify(response_data)
+        
+    except ValueError as e:
+        return error_handler(400, str(e))
+    except Exception as e:
+        return error_handler(500, str(e))
+
+@token_required
+def get_user_cache_stats(current_user):
+    if not current_user.is_admin:
+        return error_handler(403, 'You are not allowed to see cache stats')
+    
+    from flask import current_app
+    return jsonify(current_app.user_cache.stats())
+
+@token_claims_required
+def suggest_users(current_user):
+    if not current_user.is_admin:
+        return error_handler(403, 'You are not allowed to search users')
+    
+    try:
+        prefix = request.args.get('prefix', '')
+        limit = min(int(request.args.get('limit', 10)), 50)
         
+        suggestions = current_user._user_model.suggest_usernames(prefix, limit)
+        return jsonify({'suggestions': suggestions})
+        
+    except ValueError as e:
+        return error_handler(400, str(e))
     except Exception as e:
         return error_handler(500, str(e))
 
@@ -115,13 +174,43 @@ def get_user(user_id):
     try:
         from flask import current_app
         user_model = current_app.user_model
-        user = user_model.find_by_id(user_id)
         
+        # Public profile, served from the shared profile cache when fresh
+        user = user_model.find_profile(user_id)
         if not user:
             return error_handler(404, 'User not found')
         
-        user_data = user.to_dict()
-        return jsonify(user_data)
+        etag = make_etag('user', user_id, timestamp_ms(user.updated_at))
+        if is_not_modified(etag, user.updated_at):
+            return not_modified_response(etag, user.updated_at)
+        
+        user_data = user.to_dict(User.PUBLIC_FIELDS)
+        return add_validators(jsonify(user_data), etag, user.updated_at)
+        
+    except Exception as e:
+        return error_handler(500, str(e))
+
+def get_users_batch():
+    """Public profiles for several ids: POST {"ids": [...]} or GET ?ids=a,b"""
+    try:
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            ids = data.get('ids')
+        else:
+            ids = [user_id for user_id in request.args.get('ids', '').split(',') if user_id]
+        
+        if not isinstance(ids, list) or not all(isinstance(user_id, str) for user_id in ids):
+            return error_handler(400, 'ids must be a list of user ids')
+        
+        ids = list(dict.fromkeys(ids))
+        max_ids = current_app.config['USER_BATCH_MAX']
+        if len(ids) > max_ids:
+            return error_handler(400, f'At most {max_ids} ids per request')
+        
+        # Unknown or malformed ids come back as null
+        profiles = current_app.user_model.find_profiles(ids)
+        users = {user_id: user.to_dict(User.PUBLIC_FIELDS) if user else None for user_id, user in profiles.items()}
+        return jsonify({'users': users})
         
     except Exception as e:
         return error_handler(500, str(e))
@@ -142,9 +231,10 @@ def update_user_admin(current_user, user_id):
             return error_handler(400, 'isAdmin field is required')
         
         user_model = current_user._user_model
+        # update_user drops the cached user in every worker
         user_model.update_user(user_id, {'is_admin': data['isAdmin']})
         
-        updated_user = user_model.find_by_id(user_id)
+        updated_user = user_model.find_by_id(user_id, PROFILE_PROJECTION)
         user_data = updated_user.to_dict()
         
         return jsonify(user_data)
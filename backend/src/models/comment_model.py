@@ -1,12 +1,39 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from ..utils.pagination import apply_cursor
+from ..utils.aggregation import summary_pipeline, unpack_summary
+from ..utils.fieldsets import projection_for, select_fields
 
 class Comment:
-    def __init__(self, content, post_id, user_id, likes=None, number_of_likes=0, _id=None, created_at=None, updated_at=None, comment_model=None):
+    # API field name -> document field
+    FIELDS = {
+        '_id': '_id',
+        'content': 'content',
+        'postId': 'post_id',
+        'userId': 'user_id',
+        'likes': 'likes',
+        'numberOfLikes': 'number_of_likes',
+        'parentId': 'parent_id',
+        'ancestors': 'ancestors',
+        'depth': 'depth',
+        'createdAt': 'created_at',
+        'updatedAt': 'updated_at'
+    }
+    SUMMARY_FIELDS = ['_id', 'content', 'postId', 'userId', 'numberOfLikes', 'parentId', 'depth', 'createdAt', 'updatedAt']
+    
+    def __init__(self, content, post_id, user_id, likes=None, number_of_likes=0, parent_id=None, ancestors=None, path=None, depth=0, _id=None, created_at=None, updated_at=None, comment_model=None):
         self._id = _id
         self.content = content
         self.post_id = post_id
         self.user_id = user_id
+        self.parent_id = parent_id  # Comment this one replies to, None for a top-level comment
+        self.ancestors = ancestors or []  # Ids from the thread root down to the parent
+        self.path = path  # Materialized path: ancestor ids and own id, each followed by PATH_SEPARATOR
+        self.depth = depth
+        self.replies = None  # First replies of a thread, loaded by find_threads
+        self.has_more_replies = False
         self.likes = likes or []
         self.number_of_likes = number_of_likes
         self.created_at = created_at or datetime.utcnow()
@@ -17,36 +44,61 @@ class Comment:
     def id(self):
         return str(self._id) if self._id else None
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             '_id': self.id,
             'content': self.content,
             'postId': self.post_id,
             'userId': self.user_id,
             'likes': self.likes,
             'numberOfLikes': self.number_of_likes,
+            'parentId': self.parent_id,
+            'ancestors': self.ancestors,
+            'depth': self.depth,
             'createdAt': self.created_at.isoformat() if isinstance(self.created_at, datetime) else self.created_at,
             'updatedAt': self.updated_at.isoformat() if isinstance(self.updated_at, datetime) else self.updated_at
-        }
+        }, fields)
     
     @staticmethod
     def from_dict(data, comment_model=None):
+        # Fields may be missing when the document was read with a projection
         return Comment(
             _id=data.get('_id'),
-            content=data['content'],
-            post_id=data['post_id'],
-            user_id=data['user_id'],
+            content=data.get('content'),
+            post_id=data.get('post_id'),
+            user_id=data.get('user_id'),
             likes=data.get('likes', []),
             number_of_likes=data.get('number_of_likes', 0),
+            parent_id=data.get('parent_id'),
+            ancestors=data.get('ancestors', []),
+            path=data.get('path'),
+            depth=data.get('depth', 0),
             created_at=data.get('created_at'),
             updated_at=data.get('updated_at'),
             comment_model=comment_model
         )
 
+# Ids in a materialized path are 24 hex characters, each followed by PATH_SEPARATOR, so
+# a path sorts parents before children and siblings oldest first. PATH_END sorts after
+# every character a path can contain, which makes a subtree one range: [path, path + PATH_END).
+PATH_SEPARATOR = ','
+PATH_END = '~'
+
+def subtree_range(path, include_root=False):
+    return {'$gte' if include_root else '$gt': path, '$lt': path + PATH_END}
+
+# Where likes are stored: an embedded array on the comment, or one document per like
+LIKES_EMBEDDED = 'embedded'
+LIKES_COLLECTION = 'collection'
+
 class CommentModel:
-    def __init__(self, db):
+    def __init__(self, db, stats=None, likes_store=LIKES_EMBEDDED, post_model=None):
         self.db = db
         self.collection = db.comments
+        self.likes_collection = db.comment_likes
+        self.stats = stats  # StatsService kept current on create/delete
+        self.likes_store = likes_store
+        self.post_model = post_model  # PostModel whose comment counters follow comment writes
     
     def _to_object_id(self, id_str):
         """Convert string ID to ObjectId"""
@@ -57,69 +109,285 @@ class CommentModel:
     
     def create_indexes(self):
         self.collection.create_index([('post_id', 1)])
+        self.collection.create_index([('post_id', 1), ('created_at', -1), ('_id', -1)])
+        self.collection.create_index([('post_id', 1), ('path', 1)])
+        # Top-level comments of a post, newest first, for the thread listing
+        self.collection.create_index([('post_id', 1), ('depth', 1), ('created_at', -1), ('_id', -1)])
         self.collection.create_index([('user_id', 1)])
         self.collection.create_index([('created_at', -1)])
+        self.collection.create_index([('created_at', -1), ('_id', -1)])
+        if self.likes_store == LIKES_COLLECTION:
+            self.likes_collection.create_index([('comment_id', 1), ('user_id', 1)], unique=True)
+            self.likes_collection.create_index([('user_id', 1)])
     
-    def find_by_id(self, comment_id):
+    def find_by_id(self, comment_id, projection=None):
         object_id = self._to_object_id(comment_id)
         if not object_id:
             return None
-        comment_data = self.collection.find_one({'_id': object_id})
+        comment_data = self.collection.find_one({'_id': object_id}, projection)
         if comment_data:
             return Comment.from_dict(comment_data, self)
         return None
     
-    def find_by_post_id(self, post_id, sort_field='created_at', sort_direction=-1):
-        """Find all comments for a post"""
-        comments_cursor = self.collection.find({'post_id': post_id}).sort(sort_field, sort_direction)
+    def find_by_post_id(self, post_id, sort_field='created_at', sort_direction=-1, projection=None, cursor=None, limit=0):
+        """Find a post's comments, one keyset page at a time when limit is given"""
+        query_filter = {'post_id': post_id}
+        if cursor:
+            query_filter = apply_cursor(query_filter, sort_field, sort_direction, cursor)
+        comments_cursor = self.collection.find(query_filter, projection).sort([(sort_field, sort_direction), ('_id', sort_direction)]).limit(limit)
         return [Comment.from_dict(comment, self) for comment in comments_cursor]
     
-    def find_by_user_id(self, user_id):
+    def exists(self, comment_id):
+        """Existence check that reads only the _id index"""
+        object_id = self._to_object_id(comment_id)
+        if not object_id:
+            return False
+        return self.collection.find_one({'_id': object_id}, {'_id': 1}) is not None
+    
+    def find_by_user_id(self, user_id, projection=None):
         """Find all comments by a user"""
-        comments_cursor = self.collection.find({'user_id': user_id})
+        comments_cursor = self.collection.find({'user_id': user_id}, projection)
         return [Comment.from_dict(comment, self) for comment in comments_cursor]
     
-    def create_comment(self, comment):
+    def find_parent(self, comment_id):
+        """Threading fields of a comment that is about to be replied to"""
+        return self.find_by_id(comment_id, {'post_id': 1, 'ancestors': 1, 'path': 1, 'depth': 1})
+    
+    def create_comment(self, comment, parent=None):
+        """Insert a comment, as a reply to parent (a Comment from find_parent) when given"""
+        # The id is chosen up front because it is the last segment of the path
+        comment._id = ObjectId()
+        if parent is not None:
+            if not parent.path:
+                self._backfill_path(parent)
+            comment.parent_id = parent.id
+            comment.ancestors = parent.ancestors + [parent.id]
+            comment.depth = parent.depth + 1
+            comment.path = parent.path + comment.id + PATH_SEPARATOR
+        else:
+            comment.path = comment.id + PATH_SEPARATOR
+        
         comment_data = {
+            '_id': comment._id,
             'content': comment.content,
             'post_id': comment.post_id,
             'user_id': comment.user_id,
             'likes': comment.likes,
             'number_of_likes': comment.number_of_likes,
+            'parent_id': comment.parent_id,
+            'ancestors': comment.ancestors,
+            'path': comment.path,
+            'depth': comment.depth,
             'created_at': comment.created_at,
             'updated_at': comment.updated_at
         }
         
-        result = self.collection.insert_one(comment_data)
-        comment._id = result.inserted_id
+        self.collection.insert_one(comment_data)
+        if self.stats is not None:
+            self.stats.record_create('comments', comment.created_at)
+        if self.post_model is not None:
+            self.post_model.increment_comment_counters(comment.post_id, comments=1, likes=comment.number_of_likes)
         comment._comment_model = self
         return comment
     
+    def _backfill_path(self, comment):
+        """Give a comment from before threading its top-level path, as backfill_paths would"""
+        comment.path = comment.id + PATH_SEPARATOR
+        comment.ancestors = []
+        comment.depth = 0
+        self.collection.update_one(
+            {'_id': comment._id, 'path': {'$exists': False}},
+            {'$set': {'path': comment.path, 'depth': 0, 'ancestors': [], 'parent_id': None}}
+        )
+    
     def update_comment(self, comment_id, update_data):
         object_id = self._to_object_id(comment_id)
         if not object_id:
             raise ValueError("Invalid comment ID")
         
         update_data['updated_at'] = datetime.utcnow()
-        result = self.collection.update_one(
+        comment_data = self.collection.find_one_and_update(
             {'_id': object_id},
-            {'$set': update_data}
+            {'$set': update_data},
+            projection={'post_id': 1}
         )
-        return result.modified_count > 0
+        if not comment_data:
+            return False
+        if self.post_model is not None:
+            # Invalidates the post's cached comment lists
+            self.post_model.touch_comments(comment_data.get('post_id'))
+        return True
     
     def delete_comment(self, comment_id):
+        """Delete a comment together with its replies; returns the ids deleted, empty when it was not found"""
         object_id = self._to_object_id(comment_id)
         if not object_id:
             raise ValueError("Invalid comment ID")
         
-        result = self.collection.delete_one({'_id': object_id})
-        return result.deleted_count > 0
+        comment_data = self.collection.find_one({'_id': object_id}, {'post_id': 1, 'path': 1})
+        if not comment_data:
+            return []
+        subtree = list(self.collection.find(self._subtree_filter(comment_data), {'post_id': 1, 'number_of_likes': 1}))
+        if not self._delete_batch([comment['_id'] for comment in subtree]):
+            return []
+        self._decrement_counters(subtree)
+        return [str(comment['_id']) for comment in subtree]
+    
+    @staticmethod
+    def _subtree_filter(comment_data):
+        # Comments from before threading have no path, and no replies either
+        if not comment_data.get('path'):
+            return {'_id': comment_data['_id']}
+        return {'post_id': comment_data['post_id'], 'path': subtree_range(comment_data['path'], include_root=True)}
+    
+    def _decrement_counters(self, comments):
+        """Take deleted comments (with post_id and number_of_likes) off their posts' counters"""
+        if self.post_model is None:
+            return
+        per_post = {}
+        for comment in comments:
+            counts = per_post.setdefault(comment.get('post_id'), [0, 0])
+            counts[0] -= 1
+            counts[1] -= comment.get('number_of_likes', 0)
+        for post_id, (comments_delta, likes_delta) in per_post.items():
+            self.post_model.increment_comment_counters(post_id, comments=comments_delta, likes=likes_delta)
+    
+    def find_subtree(self, comment_id):
+        """A comment and all of its replies in thread order, from one range query on (post_id, path)"""
+        root = self.find_by_id(comment_id, {'post_id': 1, 'path': 1})
+        if not root or not root.path:
+            return []
+        comments_cursor = self.collection.find(
+            {'post_id': root.post_id, 'path': subtree_range(root.path, include_root=True)}
+        ).sort('path', 1)
+        return [Comment.from_dict(comment, self) for comment in comments_cursor]
+    
+    def find_threads(self, post_id, limit=10, replies=3, cursor=None):
+        """Newest top-level comments of a post, each with its first replies, in one aggregation.
+
+        Each returned top-level Comment carries up to ``replies`` replies in
+        thread order, and has_more_replies when the thread has further ones.
+        """
+        root_filter = {'post_id': post_id, 'depth': 0}
+        if cursor:
+            root_filter = apply_cursor(root_filter, 'created_at', -1, cursor)
+        pipeline = [
+            {'$match': root_filter},
+            {'$sort': {'created_at': -1, '_id': -1}},
+            {'$limit': limit},
+            {'$lookup': {
+                'from': self.collection.name,
+                'let': {'post_id': '$post_id', 'path': '$path'},
+                'pipeline': [
+                    {'$match': {'$expr': {'$and': [
+                        {'$eq': ['$post_id', '$$post_id']},
+                        {'$gt': ['$path', '$$path']},
+                        {'$lt': ['$path', {'$concat': ['$$path', PATH_END]}]}
+                    ]}}},
+                    {'$sort': {'path': 1}},
+                    {'$limit': replies + 1}
+                ],
+                'as': 'replies'
+            }}
+        ]
+        threads = []
+        for thread_data in self.collection.aggregate(pipeline):
+            reply_data = thread_data.pop('replies', [])
+            thread = Comment.from_dict(thread_data, self)
+            thread.replies = [Comment.from_dict(reply, self) for reply in reply_data[:replies]]
+            thread.has_more_replies = len(reply_data) > replies
+            threads.append(thread)
+        return threads
     
-    def get_all_comments(self, sort_field='created_at', sort_direction=-1, skip=0, limit=9):
-        """Get all comments with pagination and sorting"""
-        comments_cursor = self.collection.find().sort(sort_field, sort_direction).skip(skip).limit(limit)
+    def backfill_paths(self):
+        """Make comments created before threading top-level comments with a path"""
+        comments_cursor = self.collection.find({'path': {'$exists': False}}, {'_id': 1})
+        for comment in comments_cursor:
+            self.collection.update_one(
+                {'_id': comment['_id']},
+                {'$set': {'path': str(comment['_id']) + PATH_SEPARATOR, 'depth': 0, 'ancestors': [], 'parent_id': None}}
+            )
+    
+    def delete_post_comments_batch(self, post_id, batch_size=500):
+        """Delete up to batch_size comments of a post; returns how many were deleted"""
+        comments_cursor = self.collection.find({'post_id': post_id}, {'_id': 1}).limit(batch_size)
+        return self._delete_batch([comment['_id'] for comment in comments_cursor])
+    
+    def delete_user_comments_batch(self, user_id, batch_size=500):
+        """Delete up to batch_size comments by a user with their replies, keeping post counters in step.
+
+        Replies by other users go too, as with delete_comment, rather than
+        being left under an ancestor that no longer exists. Returns how many
+        comments were deleted, replies included.
+        """
+        roots = list(self.collection.find({'user_id': user_id}, {'post_id': 1, 'path': 1}).limit(batch_size))
+        if not roots:
+            return 0
+        subtrees = self.collection.find({'$or': [self._subtree_filter(root) for root in roots]}, {'post_id': 1, 'number_of_likes': 1})
+        comments = list({comment['_id']: comment for comment in subtrees}.values())  # A user's reply to their own comment is in both
+        deleted = self._delete_batch([comment['_id'] for comment in comments])
+        self._decrement_counters(comments)
+        return deleted
+    
+    def remove_user_likes_batch(self, user_id, batch_size=500):
+        """Withdraw up to batch_size likes given by a user; returns how many were removed"""
+        if self.likes_store == LIKES_COLLECTION:
+            likes = list(self.likes_collection.find({'user_id': user_id}, {'comment_id': 1}).limit(batch_size))
+            if not likes:
+                return 0
+            self.likes_collection.delete_many({'_id': {'$in': [like['_id'] for like in likes]}})
+            comment_ids = [like['comment_id'] for like in likes]
+            self.collection.update_many({'_id': {'$in': comment_ids}}, {'$inc': {'number_of_likes': -1}})
+        else:
+            comment_ids = [comment['_id'] for comment in self.collection.find({'likes': user_id}, {'_id': 1}).limit(batch_size)]
+            if not comment_ids:
+                return 0
+            self.collection.update_many(
+                {'_id': {'$in': comment_ids}, 'likes': user_id},
+                {'$pull': {'likes': user_id}, '$inc': {'number_of_likes': -1}}
+            )
+        if self.post_model is not None:
+            per_post = {}
+            for comment in self.collection.find({'_id': {'$in': comment_ids}}, {'post_id': 1}):
+                per_post[comment.get('post_id')] = per_post.get(comment.get('post_id'), 0) - 1
+            for post_id, likes_delta in per_post.items():
+                self.post_model.increment_comment_counters(post_id, likes=likes_delta)
+        return len(comment_ids)
+    
+    def _delete_batch(self, object_ids):
+        if not object_ids:
+            return 0
+        result = self.collection.delete_many({'_id': {'$in': object_ids}})
+        if self.likes_store == LIKES_COLLECTION:
+            self.likes_collection.delete_many({'comment_id': {'$in': object_ids}})
+        if self.stats is not None:
+            if result.deleted_count == len(object_ids):
+                for object_id in object_ids:
+                    self.stats.record_delete('comments', object_id)
+            elif result.deleted_count:
+                # Some were deleted meanwhile by another request, and delete_many does not say which
+                self.stats.expire('comments')
+        return result.deleted_count
+    
+    def get_all_comments(self, sort_field='created_at', sort_direction=-1, skip=0, limit=9, cursor=None, fields=None):
+        """Get all comments with pagination and sorting (keyset when a cursor is given).
+
+        fields (API names) is pushed down to a Mongo projection.
+        """
+        query_filter = {}
+        if cursor:
+            query_filter = apply_cursor(query_filter, sort_field, sort_direction, cursor)
+            skip = 0
+        projection = projection_for(fields, Comment.FIELDS, always=(sort_field,))
+        comments_cursor = self.collection.find(query_filter, projection).sort([(sort_field, sort_direction), ('_id', sort_direction)]).skip(skip).limit(limit)
         return [Comment.from_dict(comment, self) for comment in comments_cursor]
     
+    def summarize(self, limit=5, since=None):
+        """Latest comments, total and count created since a date, in one $facet aggregation"""
+        result = self.collection.aggregate(summary_pipeline('created_at', limit, since))
+        latest, total, recent = unpack_summary(result)
+        return [Comment.from_dict(comment, self) for comment in latest], total, recent
+    
     def count_comments(self, query_filter=None):
         """Count comments with optional filter"""
         if query_filter:
@@ -127,34 +395,92 @@ class CommentModel:
         return self.collection.count_documents({})
     
     def toggle_like(self, comment_id, user_id):
-        """Toggle like for a comment"""
+        """Like or unlike a comment atomically; returns the updated comment, or None if it does not exist"""
         object_id = self._to_object_id(comment_id)
         if not object_id:
             raise ValueError("Invalid comment ID")
         
-        comment = self.find_by_id(comment_id)
-        if not comment:
-            raise ValueError("Comment not found")
-        
-        if user_id in comment.likes:
-            # Unlike
-            comment.likes.remove(user_id)
-            comment.number_of_likes -= 1
-        else:
-            # Like
-            comment.likes.append(user_id)
-            comment.number_of_likes += 1
+        if self.likes_store == LIKES_COLLECTION:
+            return self._toggle_like_document(object_id, user_id)
         
-        # Update in database
-        self.collection.update_one(
+        # $addToSet / $pull + $inc as one pipeline update, so the server picks
+        # the direction and concurrent likes cannot overwrite each other
+        likes = {'$ifNull': ['$likes', []]}
+        liked = {'$in': [user_id, likes]}
+        comment_data = self.collection.find_one_and_update(
             {'_id': object_id},
-            {
-                '$set': {
-                    'likes': comment.likes,
-                    'number_of_likes': comment.number_of_likes,
-                    'updated_at': datetime.utcnow()
-                }
-            }
+            [{'$set': {
+                'likes': {'$cond': [
+                    liked,
+                    {'$filter': {'input': likes, 'cond': {'$ne': ['$$this', user_id]}}},
+                    {'$concatArrays': [likes, [user_id]]}
+                ]},
+                'number_of_likes': {'$add': [{'$ifNull': ['$number_of_likes', 0]}, {'$cond': [liked, -1, 1]}]},
+                'updated_at': datetime.utcnow()
+            }}],
+            return_document=ReturnDocument.AFTER
         )
+        if not comment_data:
+            return None
+        if self.post_model is not None:
+            delta = 1 if user_id in comment_data['likes'] else -1
+            self.post_model.increment_comment_counters(comment_data.get('post_id'), likes=delta)
+        return Comment.from_dict(comment_data, self)
+    
+    def _toggle_like_document(self, object_id, user_id):
+        """Toggle a like stored in comment_likes and adjust the comment's counter.
+
+        The returned comment's likes holds only user_id when it is liked, which
+        is all a client needs to render its own like state.
+        """
+        like = {'comment_id': object_id, 'user_id': user_id}
+        try:
+            self.likes_collection.insert_one(dict(like, created_at=datetime.utcnow()))
+            delta = 1
+        except DuplicateKeyError:
+            # Already liked; a concurrent unlike may have removed it first
+            delta = -self.likes_collection.delete_one(like).deleted_count
         
-        return comment
\ No newline at end of file
+        comment_data = self.collection.find_one_and_update(
+            {'_id': object_id},
+            {'$inc': {'number_of_likes': delta}, '$set': {'updated_at': datetime.utcnow()}},
+            projection={'likes': 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if not comment_data:
+            if delta > 0:
+                self.likes_collection.delete_one(like)
+            return None
+        if self.post_model is not None:
+            self.post_model.increment_comment_counters(comment_data.get('post_id'), likes=delta)
+        comment_data['likes'] = [user_id] if delta > 0 else []
+        return Comment.from_dict(comment_data, self)
+    
+    def fill_viewer_likes(self, comments, user_id):
+        """Set each comment's likes to [user_id] or [] from comment_likes (collection store only)"""
+        if self.likes_store != LIKES_COLLECTION or not comments:
+            return comments
+        liked = set()
+        if user_id:
+            liked = {like['comment_id'] for like in self.likes_collection.find(
+                {'comment_id': {'$in': [comment._id for comment in comments]}, 'user_id': user_id},
+                {'comment_id': 1, '_id': 0}
+            )}
+        for comment in comments:
+            comment.likes = [user_id] if comment._id in liked else []
+        return comments
+    
+    def migrate_embedded_likes(self):
+        """Move embedded likes arrays into comment_likes when the collection store is enabled"""
+        if self.likes_store != LIKES_COLLECTION:
+            return
+        comments_cursor = self.collection.find({'likes.0': {'$exists': True}}, {'likes': 1})
+        for comment in comments_cursor:
+            try:
+                self.likes_collection.insert_many(
+                    [{'comment_id': comment['_id'], 'user_id': user_id, 'created_at': datetime.utcnow()} for user_id in set(comment['likes'])],
+                    ordered=False
+                )
+            except BulkWriteError:
+                pass  # Likes already moved by an earlier, interrupted run
+            self.collection.update_one({'_id': comment['_id']}, {'$set': {'likes': []}})
@@ -1,16 +1,63 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne
 import re
+from ..utils.pagination import apply_cursor
+from ..utils.aggregation import summary_pipeline, unpack_summary
+from ..utils.fieldsets import projection_for, select_fields
+
+EXCERPT_LENGTH = 200
+# Post fields the search index can filter on, as PostSearchEngine facets
+SEARCH_FACETS = ('user_id', 'category')
+_TAG_RE = re.compile(r'<[^>]+>')
+
+def make_excerpt(content, length=EXCERPT_LENGTH):
+    """Plain-text excerpt of a post body, stored so listings never need the full content"""
+    text = ' '.join(_TAG_RE.sub(' ', content or '').split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '...'
+
+def count_words(content):
+    return len(_TAG_RE.sub(' ', content or '').split())
 
 class Post:
-    def __init__(self, user_id, content, title, slug, image=None, category=None, _id=None, created_at=None, updated_at=None, post_model=None):
+    # API field name -> document field
+    FIELDS = {
+        '_id': '_id',
+        'userId': 'user_id',
+        'content': 'content',
+        'excerpt': 'excerpt',
+        'wordCount': 'word_count',
+        'title': 'title',
+        'image': 'image',
+        'category': 'category',
+        'slug': 'slug',
+        'commentCount': 'comment_count',
+        'totalCommentLikes': 'total_comment_likes',
+        'createdAt': 'created_at',
+        'updatedAt': 'updated_at'
+    }
+    SUMMARY_FIELDS = ['_id', 'userId', 'title', 'excerpt', 'wordCount', 'image', 'category', 'slug', 'commentCount', 'totalCommentLikes', 'createdAt', 'updatedAt']
+    # sortBy values accepted by getposts -> document field
+    SORT_FIELDS = {
+        'updatedAt': 'updated_at',
+        'commentCount': 'comment_count',
+        'totalCommentLikes': 'total_comment_likes'
+    }
+    
+    def __init__(self, user_id, content, title, slug, image=None, category=None, excerpt=None, word_count=None, comment_count=0, total_comment_likes=0, _id=None, created_at=None, updated_at=None, post_model=None):
         self._id = _id
         self.user_id = user_id
         self.content = content
+        self.excerpt = excerpt if excerpt is not None else make_excerpt(content)
+        self.word_count = word_count if word_count is not None else count_words(content)
         self.title = title
         self.image = image or 'https://www.hostinger.com/tutorials/wp-content/uploads/sites/2/2021/09/how-to-write-a-blog-post.png'
         self.category = category or 'uncategorized'
         self.slug = slug
+        self.comment_count = comment_count  # Maintained by CommentModel writes
+        self.total_comment_likes = total_comment_likes
         self.created_at = created_at or datetime.utcnow()
         self.updated_at = updated_at or datetime.utcnow()
         self._post_model = post_model  # Reference to PostModel for database operations
@@ -19,38 +66,55 @@ class Post:
     def id(self):
         return str(self._id) if self._id else None
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             '_id': self.id,
             'userId': self.user_id,
             'content': self.content,
+            'excerpt': self.excerpt,
+            'wordCount': self.word_count,
             'title': self.title,
             'image': self.image,
             'category': self.category,
             'slug': self.slug,
+            'commentCount': self.comment_count,
+            'totalCommentLikes': self.total_comment_likes,
             'createdAt': self.created_at.isoformat() if isinstance(self.created_at, datetime) else self.created_at,
             'updatedAt': self.updated_at.isoformat() if isinstance(self.updated_at, datetime) else self.updated_at
-        }
+        }, fields)
     
     @staticmethod
     def from_dict(data, post_model=None):
+        # Fields may be missing when the document was read with a projection
         return Post(
             _id=data.get('_id'),
-            user_id=data['user_id'],
-            content=data['content'],
-            title=data['title'],
+            user_id=data.get('user_id'),
+            content=data.get('content'),
+            title=data.get('title'),
             image=data.get('image'),
             category=data.get('category'),
-            slug=data['slug'],
+            excerpt=data.get('excerpt'),
+            word_count=data.get('word_count'),
+            slug=data.get('slug'),
+            comment_count=data.get('comment_count', 0),
+            total_comment_likes=data.get('total_comment_likes', 0),
             created_at=data.get('created_at'),
             updated_at=data.get('updated_at'),
             post_model=post_model
         )
 
 class PostModel:
-    def __init__(self, db):
+    def __init__(self, db, stats=None, search_engine=None, title_index=None, result_cache=None, change_feed=None, search_wait=10, max_search_ids=2000):
         self.db = db
         self.collection = db.posts
+        self.stats = stats  # StatsService kept current on create/delete
+        self.search_engine = search_engine  # PostSearchEngine kept current on create/update/delete
+        self.title_index = title_index  # PrefixIndex of titles for autocomplete
+        self.result_cache = result_cache  # QueryResultCache in front of getposts
+        self.change_feed = change_feed  # ChangeFeed that repeats the above in the other worker processes
+        self.search_wait = search_wait  # seconds a search waits for the first index build
+        self.max_search_ids = max_search_ids  # sorted searches with more matches scan in sort order instead of $in
+        self._search_build = None  # the background thread building the search index
     
     def _to_object_id(self, id_str):
         """Convert string ID to ObjectId"""
@@ -66,40 +130,95 @@ class PostModel:
         self.collection.create_index([('category', 1)])
         self.collection.create_index([('created_at', -1)])
         self.collection.create_index([('updated_at', -1)])
+        self.collection.create_index([('updated_at', -1), ('_id', -1)])
+        self.collection.create_index([('comment_count', -1), ('_id', -1)])
+        self.collection.create_index([('total_comment_likes', -1), ('_id', -1)])
     
-    def find_by_slug(self, slug):
-        post_data = self.collection.find_one({'slug': slug})
+    def find_by_slug(self, slug, projection=None):
+        post_data = self.collection.find_one({'slug': slug}, projection)
         if post_data:
             return Post.from_dict(post_data, self)
         return None
     
-    def find_by_id(self, post_id):
+    def find_by_id(self, post_id, projection=None):
         object_id = self._to_object_id(post_id)
         if not object_id:
             return None
-        post_data = self.collection.find_one({'_id': object_id})
+        post_data = self.collection.find_one({'_id': object_id}, projection)
         if post_data:
             return Post.from_dict(post_data, self)
         return None
     
-    def find_by_user_id(self, user_id):
-        posts_cursor = self.collection.find({'user_id': user_id})
+    def find_validators(self, query_filter):
+        """(last_modified, comment_count, total_comment_likes) of the first post matching
+        query_filter, without hydrating it; None when nothing matches.
+
+        The counters change without touching updated_at, so they go into the
+        ETag, and counters_updated_at moves last_modified forward.
+        """
+        post_data = self.collection.find_one(
+            query_filter,
+            {'updated_at': 1, 'counters_updated_at': 1, 'comment_count': 1, 'total_comment_likes': 1}
+        )
+        if not post_data:
+            return None
+        timestamps = [post_data.get('updated_at'), post_data.get('counters_updated_at')]
+        last_modified = max((value for value in timestamps if value is not None), default=None)
+        return last_modified, post_data.get('comment_count', 0), post_data.get('total_comment_likes', 0)
+    
+    def find_comment_validators(self, post_id):
+        """(comment_count, comments_version, comments_updated_at) of a post, from one point read.
+
+        Every comment write on the post bumps comments_version, through
+        increment_comment_counters or touch_comments, so together they
+        validate any cached list of its comments. (0, 0, None) when the post
+        does not exist.
+        """
+        object_id = self._to_object_id(post_id)
+        post_data = self.collection.find_one(
+            {'_id': object_id},
+            {'comment_count': 1, 'comments_version': 1, 'comments_updated_at': 1}
+        ) if object_id else None
+        if not post_data:
+            return 0, 0, None
+        return post_data.get('comment_count', 0), post_data.get('comments_version', 0), post_data.get('comments_updated_at')
+    
+    def find_by_user_id(self, user_id, projection=None):
+        posts_cursor = self.collection.find({'user_id': user_id}, projection)
         return [Post.from_dict(post, self) for post in posts_cursor]
     
+    def find_ids_by_user(self, user_id, limit=500):
+        """Ids of up to limit posts by a user, read from the user_id index"""
+        posts_cursor = self.collection.find({'user_id': user_id}, {'_id': 1}).limit(limit)
+        return [post['_id'] for post in posts_cursor]
+    
     def create_post(self, post):
         post_data = {
             'user_id': post.user_id,
             'content': post.content,
+            'excerpt': post.excerpt,
+            'word_count': post.word_count,
             'title': post.title,
             'image': post.image,
             'category': post.category,
             'slug': post.slug,
+            'comment_count': post.comment_count,
+            'total_comment_likes': post.total_comment_likes,
             'created_at': post.created_at,
             'updated_at': post.updated_at
         }
         
         result = self.collection.insert_one(post_data)
         post._id = result.inserted_id
+        if self.stats is not None:
+            self.stats.record_create('posts', post.created_at)
+        if self.search_engine is not None:
+            self.search_engine.index_post(post._id, post.title, post.content, self._search_facets(post_data))
+        if self.title_index is not None:
+            self.title_index.add(post._id, post.title, self._suggestion(post_data))
+        if self.result_cache is not None:
+            self.result_cache.invalidate(post._id, post.slug)
+        self._notify(post._id, post.slug, reindex=True)
         post._post_model = self
         return post
     
@@ -108,26 +227,331 @@ class PostModel:
         if not object_id:
             raise ValueError("Invalid post ID")
         
+        if 'content' in update_data:
+            update_data['excerpt'] = make_excerpt(update_data['content'])
+            update_data['word_count'] = count_words(update_data['content'])
+        
         update_data['updated_at'] = datetime.utcnow()
-        result = self.collection.update_one(
+        post_data = self.collection.find_one_and_update(
             {'_id': object_id},
-            {'$set': update_data}
+            {'$set': update_data},
+            projection={'title': 1, 'content': 1, 'slug': 1, 'user_id': 1, 'category': 1},
+            return_document=ReturnDocument.AFTER
         )
-        return result.modified_count > 0
+        if not post_data:
+            return False
+        reindex = any(field in update_data for field in ('title', 'content', 'category'))
+        if reindex:
+            self._reindex(post_data)
+        if self.result_cache is not None:
+            self.result_cache.invalidate(object_id, post_data['slug'])
+        self._notify(object_id, post_data['slug'], reindex)
+        return True
+    
+    @staticmethod
+    def _search_facets(post_data):
+        return {field: post_data.get(field) for field in SEARCH_FACETS}
+    
+    def _reindex(self, post_data):
+        """Refresh the search and title indexes after a post's text or category changed"""
+        if self.search_engine is not None:
+            self.search_engine.index_post(post_data['_id'], post_data['title'], post_data['content'], self._search_facets(post_data))
+        if self.title_index is not None:
+            self.title_index.add(post_data['_id'], post_data['title'], self._suggestion(post_data))
     
     def delete_post(self, post_id):
         object_id = self._to_object_id(post_id)
         if not object_id:
             raise ValueError("Invalid post ID")
         
-        result = self.collection.delete_one({'_id': object_id})
-        return result.deleted_count > 0
+        post_data = self.collection.find_one_and_delete({'_id': object_id}, projection={'slug': 1})
+        if not post_data:
+            return False
+        if self.stats is not None:
+            self.stats.record_delete('posts', object_id)
+        if self.search_engine is not None:
+            self.search_engine.remove_post(object_id)
+        if self.title_index is not None:
+            self.title_index.remove(object_id)
+        if self.result_cache is not None:
+            self.result_cache.invalidate(object_id, post_data['slug'])
+        self._notify(object_id, post_data['slug'], reindex=True)
+        return True
+    
+    def _notify(self, object_id, slug, reindex):
+        """Have the other worker processes refresh their copy of this post"""
+        if self.change_feed is not None:
+            self.change_feed.publish('post', {'id': str(object_id), 'slug': slug, 'reindex': reindex})
+    
+    def clear_cached_results(self):
+        """Drop every cached getposts result, in every worker, after a bulk write"""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        if self.change_feed is not None:
+            self.change_feed.publish('post', {'all': True})
+    
+    def apply_changes(self, changes):
+        """Refresh the indexes and cached pages after other processes wrote posts, with one read for the lot"""
+        reindex = set()
+        for data in changes:
+            if data.get('all'):
+                if self.result_cache is not None:
+                    self.result_cache.clear()
+                continue
+            object_id = self._to_object_id(data.get('id'))
+            if not object_id:
+                continue
+            if self.result_cache is not None:
+                self.result_cache.invalidate(object_id, data.get('slug'))
+            if data.get('reindex'):
+                reindex.add(object_id)
+        if not reindex:
+            return
+        posts_cursor = self.collection.find({'_id': {'$in': list(reindex)}}, {'title': 1, 'content': 1, 'slug': 1, 'user_id': 1, 'category': 1})
+        for post_data in posts_cursor:
+            self._reindex(post_data)
+            reindex.discard(post_data['_id'])
+        for object_id in reindex:  # Deleted since
+            if self.search_engine is not None:
+                self.search_engine.remove_post(object_id)
+            if self.title_index is not None:
+                self.title_index.remove(object_id)
     
-    def search_posts(self, query_filter, sort_field='updated_at', sort_direction=-1, skip=0, limit=9):
-        """Search posts with filters, sorting and pagination"""
-        posts_cursor = self.collection.find(query_filter).sort(sort_field, sort_direction).skip(skip).limit(limit)
+    def resync(self):
+        """Rebuild everything kept in memory, for a process that missed changes.
+
+        The search index is rebuilt in the background: it takes seconds per
+        100k posts, and meanwhile the current one keeps answering.
+        """
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        self.rebuild_title_index()
+        self.rebuild_search_index(background=True)
+    
+    def search_posts(self, query_filter, sort_field='updated_at', sort_direction=-1, skip=0, limit=9, cursor=None, fields=None):
+        """Search posts with filters, sorting and pagination.
+
+        When a cursor is given the page starts right after it (keyset
+        pagination) and skip is ignored. fields (API names) is pushed down
+        to a Mongo projection.
+        """
+        if cursor:
+            query_filter = apply_cursor(query_filter, sort_field, sort_direction, cursor)
+            skip = 0
+        projection = projection_for(fields, Post.FIELDS, always=(sort_field,))
+        posts_cursor = self.collection.find(query_filter, projection).sort([(sort_field, sort_direction), ('_id', sort_direction)]).skip(skip).limit(limit)
         return [Post.from_dict(post, self) for post in posts_cursor]
     
+    def rebuild_search_index(self, background=False):
+        """Load every post's title, content and facets into the search engine.
+
+        In the background the engine keeps serving its current index, or
+        answers SearchIndexNotReady if it has none yet, until the build
+        finishes; wait_for_search_index() waits for it.
+        """
+        if self.search_engine is None:
+            return
+        if not background:
+            self._build_search_index()
+            return
+        import threading
+        # A greenlet under gevent: the build yields between posts and its reads stay on the hub
+        self._search_build = threading.Thread(target=self._build_search_index, name='search-index', daemon=True)
+        self._search_build.start()
+    
+    def _build_search_index(self):
+        import time
+        started = time.perf_counter()
+        posts_cursor = self.collection.find({}, {'title': 1, 'content': 1, 'user_id': 1, 'category': 1})
+        self.search_engine.rebuild(
+            (post['_id'], post.get('title', ''), post.get('content', ''), self._search_facets(post)) for post in posts_cursor
+        )
+        print(f"Search index built in {(time.perf_counter() - started) * 1000:.0f} ms for {len(self.search_engine)} posts")
+    
+    def wait_for_search_index(self, timeout=None):
+        """Wait for a background rebuild_search_index; True when the index is ready"""
+        if self._search_build is not None:
+            self._search_build.join(timeout)
+        return self.search_engine is None or self.search_engine.ready
+    
+    def _require_search_index(self):
+        from ..services.post_search import SearchIndexNotReady
+        if self.search_engine.ready:
+            return
+        # Only a build still running is worth waiting for; a failed one already printed why
+        if self._search_build is not None and self._search_build.is_alive():
+            self.search_engine.wait_ready(self.search_wait)
+        if not self.search_engine.ready:
+            raise SearchIndexNotReady()
+    
+    @staticmethod
+    def _suggestion(post_data):
+        return {'_id': str(post_data['_id']), 'title': post_data['title'], 'slug': post_data['slug']}
+    
+    def rebuild_title_index(self):
+        """Load every title into the autocomplete index, reading the unique title index"""
+        if self.title_index is None:
+            return
+        posts_cursor = self.collection.find({}, {'title': 1, 'slug': 1}).hint([('title', 1)])
+        self.title_index.rebuild(
+            (post['_id'], post['title'], self._suggestion(post)) for post in posts_cursor
+        )
+    
+    def suggest_titles(self, prefix, limit=10):
+        """Posts whose title starts with prefix, for autocomplete"""
+        if self.title_index is None:
+            return []
+        return self.title_index.suggest(prefix, limit)
+    
+    def backfill_excerpts(self):
+        """Store excerpt and word_count on posts created before they existed"""
+        posts_cursor = self.collection.find({'excerpt': {'$exists': False}}, {'content': 1})
+        for post in posts_cursor:
+            self.collection.update_one(
+                {'_id': post['_id']},
+                {'$set': {'excerpt': make_excerpt(post.get('content')), 'word_count': count_words(post.get('content'))}}
+            )
+    
+    def increment_comment_counters(self, post_id, comments=0, likes=0):
+        """Atomically adjust a post's comment_count and total_comment_likes"""
+        object_id = self._to_object_id(post_id)
+        if not object_id:
+            return
+        inc = {}
+        if comments:
+            inc['comment_count'] = comments
+        if likes:
+            inc['total_comment_likes'] = likes
+        if not inc:
+            return
+        now = datetime.utcnow()
+        inc['comments_version'] = 1
+        post_data = self.collection.find_one_and_update(
+            {'_id': object_id},
+            {'$inc': inc, '$set': {'counters_updated_at': now, 'comments_updated_at': now}},
+            projection={'slug': 1}
+        )
+        # The post's own pages show the new counts at once. Lists, and other
+        # workers' copies, lag by up to POST_CACHE_TTL rather than being
+        # dropped in every worker on every like
+        if post_data and self.result_cache is not None:
+            self.result_cache.invalidate(object_id, post_data.get('slug'), lists=False)
+    
+    def touch_comments(self, post_id):
+        """Record a comment write that leaves the counters alone (an edit) for find_comment_validators"""
+        object_id = self._to_object_id(post_id)
+        if object_id:
+            self.collection.update_one(
+                {'_id': object_id},
+                {'$inc': {'comments_version': 1}, '$set': {'comments_updated_at': datetime.utcnow()}}
+            )
+    
+    def repair_comment_counters(self):
+        """Recompute every post's comment counters from one aggregation over comments.
+
+        Returns the number of posts that have comments.
+        """
+        totals = self.db.comments.aggregate([
+            {'$group': {'_id': '$post_id', 'count': {'$sum': 1}, 'likes': {'$sum': '$number_of_likes'}}}
+        ])
+        now = datetime.utcnow()
+        updates = []
+        commented = []
+        for total in totals:
+            object_id = self._to_object_id(total['_id'])
+            if not object_id:
+                continue
+            commented.append(object_id)
+            updates.append(UpdateOne(
+                {'_id': object_id},
+                {'$set': {'comment_count': total['count'], 'total_comment_likes': total['likes'], 'counters_updated_at': now}}
+            ))
+        if updates:
+            self.collection.bulk_write(updates, ordered=False)
+        # Posts with no comments left
+        self.collection.update_many(
+            {'_id': {'$nin': commented}, '$or': [{'comment_count': {'$ne': 0}}, {'total_comment_likes': {'$ne': 0}}]},
+            {'$set': {'comment_count': 0, 'total_comment_likes': 0, 'counters_updated_at': now}}
+        )
+        return len(commented)
+    
+    def backfill_comment_counters(self):
+        """Compute comment counters once for posts created before they existed"""
+        if self.collection.find_one({'comment_count': {'$exists': False}}, {'_id': 1}):
+            self.repair_comment_counters()
+    
+    def _search_scope(self, query_filter):
+        """(facets, allowed post ids) restricting a search to the posts matching query_filter"""
+        query_filter = query_filter or {}
+        filters = {field: value for field, value in query_filter.items() if field in SEARCH_FACETS}
+        rest = {field: value for field, value in query_filter.items() if field not in SEARCH_FACETS}
+        allowed = None
+        if rest:
+            # slug and postId, which name at most one post
+            allowed = {str(post['_id']) for post in self.collection.find(rest, {'_id': 1})}
+        return filters, allowed
+    
+    def search_ranked(self, search_term, query_filter=None, skip=0, limit=9, fields=None):
+        """Full-text search ordered by relevance, with optional extra filters.
+
+        user_id and category are applied inside the search engine, so every
+        matching post can be ranked, not only the globally most relevant ones.
+        """
+        self._require_search_index()
+        filters, allowed = self._search_scope(query_filter)
+        ranked_ids = self.search_engine.search(search_term, limit=skip + limit, filters=filters, allowed=allowed)
+        page_ids = [ObjectId(post_id) for post_id in ranked_ids[skip:skip + limit]]
+        if not page_ids:
+            return []
+        return self._fetch_in_order(page_ids, projection_for(fields, Post.FIELDS))
+    
+    def search_sorted(self, search_term, query_filter=None, sort_field='updated_at', sort_direction=-1, skip=0, limit=9, cursor=None, fields=None):
+        """Full-text search in sort_field order (an explicit order or sortBy), paged like search_posts.
+
+        Up to max_search_ids matches go to MongoDB as an $in filter.
+        Beyond that the posts are read in sort order, ids only, and
+        checked against the index until the page is full.
+        """
+        self._require_search_index()
+        filters, allowed = self._search_scope(query_filter)
+        matches = self.search_engine.matches(search_term, filters=filters)
+        if matches.estimate <= self.max_search_ids:
+            ids = [ObjectId(post_id) for post_id in matches.ids() if allowed is None or post_id in allowed]
+            id_filter = {'_id': {'$in': ids}}
+            return self.search_posts({'$and': [query_filter, id_filter]} if query_filter else id_filter, sort_field, sort_direction, skip, limit, cursor, fields)
+        
+        scan_filter = query_filter or {}
+        if cursor:
+            scan_filter = apply_cursor(scan_filter, sort_field, sort_direction, cursor)
+            skip = 0
+        scan = self.collection.find(scan_filter, {'_id': 1}).sort([(sort_field, sort_direction), ('_id', sort_direction)])
+        page_ids = []
+        for post in scan:
+            if post['_id'] not in matches:
+                continue
+            if skip:
+                skip -= 1
+                continue
+            page_ids.append(post['_id'])
+            if len(page_ids) == limit:
+                break
+        scan.close()
+        if not page_ids:
+            return []
+        return self._fetch_in_order(page_ids, projection_for(fields, Post.FIELDS, always=(sort_field,)))
+    
+    def _fetch_in_order(self, page_ids, projection):
+        rank = {post_id: position for position, post_id in enumerate(page_ids)}
+        posts_cursor = self.collection.find({'_id': {'$in': page_ids}}, projection)
+        posts = sorted(posts_cursor, key=lambda post: rank[post['_id']])
+        return [Post.from_dict(post, self) for post in posts]
+    
+    def summarize(self, limit=5, since=None):
+        """Latest posts, total and count created since a date, in one $facet aggregation"""
+        result = self.collection.aggregate(summary_pipeline('updated_at', limit, since))
+        latest, total, recent = unpack_summary(result)
+        return [Post.from_dict(post, self) for post in latest], total, recent
+    
     def count_posts(self, query_filter=None):
         """Count posts with optional filter"""
         if query_filter:
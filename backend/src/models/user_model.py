@@ -1,20 +1,34 @@
 from flask import current_app
-from flask_bcrypt import Bcrypt
 from datetime import datetime
-import jwt
 import os
 from bson import ObjectId
-
-bcrypt = Bcrypt()
+from ..utils.pagination import apply_cursor
+from ..utils.aggregation import summary_pipeline, unpack_summary
+from ..utils.fieldsets import projection_for, select_fields
 
 class User:
-    def __init__(self, username, email, password, profile_picture=None, is_admin=False, _id=None, created_at=None, updated_at=None, user_model=None):
+    # API field name -> document field (the password hash is never exposed)
+    FIELDS = {
+        '_id': '_id',
+        'username': 'username',
+        'email': 'email',
+        'profilePicture': 'profile_picture',
+        'isAdmin': 'is_admin',
+        'createdAt': 'created_at',
+        'updatedAt': 'updated_at'
+    }
+    SUMMARY_FIELDS = ['_id', 'username', 'profilePicture', 'isAdmin', 'createdAt']
+    # What anyone may see about a user: no email, no role
+    PUBLIC_FIELDS = ['_id', 'username', 'profilePicture', 'createdAt', 'updatedAt']
+    
+    def __init__(self, username, email, password, profile_picture=None, is_admin=False, token_version=0, _id=None, created_at=None, updated_at=None, user_model=None):
         self._id = _id
         self.username = username
         self.email = email
         self.password = password
         self.profile_picture = profile_picture or 'https://cdn.pixabay.com/photo/2015/10/05/22/37/blank-profile-picture-973460_960_720.png'
         self.is_admin = is_admin
+        self.token_version = token_version  # Bumped to revoke previously issued tokens
         self.created_at = created_at or datetime.utcnow()
         self.updated_at = updated_at or datetime.utcnow()
         self._user_model = user_model  # Reference to UserModel for database operations
@@ -23,8 +37,8 @@ class User:
     def id(self):
         return str(self._id) if self._id else None
     
-    def to_dict(self):
-        return {
+    def to_dict(self, fields=None):
+        return select_fields({
             '_id': self.id,
             'username': self.username,
             'email': self.email,
@@ -32,26 +46,41 @@ class User:
             'isAdmin': self.is_admin,
             'createdAt': self.created_at.isoformat() if isinstance(self.created_at, datetime) else self.created_at,
             'updatedAt': self.updated_at.isoformat() if isinstance(self.updated_at, datetime) else self.updated_at
-        }
+        }, fields)
     
     @staticmethod
     def from_dict(data, user_model=None):
+        # Fields may be missing when the document was read with a projection
         return User(
             _id=data.get('_id'),
-            username=data['username'],
-            email=data['email'],
-            password=data['password'],
+            username=data.get('username'),
+            email=data.get('email'),
+            password=data.get('password'),
             profile_picture=data.get('profile_picture'),
             is_admin=data.get('is_admin', False),
+            token_version=data.get('token_version', 0),
             created_at=data.get('created_at'),
             updated_at=data.get('updated_at'),
             user_model=user_model
         )
 
+# Fields token_required needs to authorize a request
+AUTH_PROJECTION = {'is_admin': 1, 'token_version': 1}
+# Everything except the password hash, for profile reads
+PROFILE_PROJECTION = {'password': 0}
+# Only User.PUBLIC_FIELDS, for the unauthenticated profile reads
+PUBLIC_PROJECTION = projection_for(User.PUBLIC_FIELDS, User.FIELDS)
+
 class UserModel:
-    def __init__(self, db):
+    def __init__(self, db, user_cache=None, token_versions=None, stats=None, username_index=None, profile_cache=None, change_feed=None):
         self.db = db
         self.collection = db.users
+        self.stats = stats  # StatsService kept current on create/delete
+        self.username_index = username_index  # PrefixIndex of usernames for autocomplete
+        self.user_cache = user_cache  # Cache of authenticated users used by token_required
+        self.token_versions = token_versions  # user id -> current token version for claims-only auth
+        self.profile_cache = profile_cache  # Short-lived public profiles shared by get_user and batch lookups
+        self.change_feed = change_feed  # ChangeFeed that repeats cache and username index changes in the other worker processes
     
     def _to_object_id(self, id_str):
         """Convert string ID to ObjectId"""
@@ -64,28 +93,144 @@ class UserModel:
         self.collection.create_index([('username', 1)], unique=True)
         self.collection.create_index([('email', 1)], unique=True)
         self.collection.create_index([('created_at', -1)])
+        self.collection.create_index([('created_at', -1), ('_id', -1)])
+        # latest_profile_change reads the newest entry
+        self.collection.create_index([('updated_at', -1)])
     
-    def find_by_email(self, email):
-        user_data = self.collection.find_one({'email': email})
+    def find_by_email(self, email, projection=None):
+        user_data = self.collection.find_one({'email': email}, projection)
         if user_data:
             return User.from_dict(user_data, self)
         return None
     
-    def find_by_username(self, username):
-        user_data = self.collection.find_one({'username': username})
+    def find_by_username(self, username, projection=None):
+        user_data = self.collection.find_one({'username': username}, projection)
         if user_data:
             return User.from_dict(user_data, self)
         return None
     
-    def find_by_id(self, user_id):
+    def find_by_id(self, user_id, projection=None):
         object_id = self._to_object_id(user_id)
         if not object_id:
             return None
-        user_data = self.collection.find_one({'_id': object_id})
+        user_data = self.collection.find_one({'_id': object_id}, projection)
         if user_data:
             return User.from_dict(user_data, self)
         return None
     
+    def exists_by_email(self, email):
+        """Existence check answered from the unique email index"""
+        return self.collection.find_one({'email': email}, {'_id': 1}) is not None
+    
+    def exists_by_username(self, username):
+        """Existence check answered from the unique username index"""
+        return self.collection.find_one({'username': username}, {'_id': 1}) is not None
+    
+    def invalidate_cached_user(self, user_id):
+        """Drop a user from the authenticated-user caches of every worker so changes apply immediately.
+
+        Other processes drop theirs within CHANGE_FEED_INTERVAL, so a demoted
+        admin or deleted user loses access everywhere in about a second.
+        """
+        self._drop_cached_user(user_id)
+        self._notify(user_id)
+    
+    def _drop_cached_user(self, user_id):
+        if self.user_cache is not None:
+            self.user_cache.invalidate(str(user_id))
+        if self.token_versions is not None:
+            self.token_versions.invalidate(str(user_id))
+        if self.profile_cache is not None:
+            self.profile_cache.invalidate(str(user_id))
+    
+    def find_profiles(self, user_ids):
+        """Public profile User per id, or None for unknown ids, in at most one $in query.
+
+        Profiles are served from profile_cache when present; only the misses
+        are read, with PUBLIC_PROJECTION.
+        """
+        keys = list(dict.fromkeys(str(user_id) for user_id in user_ids))
+        profiles = {}
+        missing = []
+        for key in keys:
+            user = self.profile_cache.get(key) if self.profile_cache is not None else None
+            if user is not None:
+                profiles[key] = user
+            else:
+                missing.append(key)
+        
+        object_ids = [object_id for object_id in map(self._to_object_id, missing) if object_id]
+        if object_ids:
+            generations = {}
+            if self.profile_cache is not None:
+                generations = {key: self.profile_cache.generation(key) for key in missing}
+            for user_data in self.collection.find({'_id': {'$in': object_ids}}, PUBLIC_PROJECTION):
+                user = User.from_dict(user_data, self)
+                profiles[user.id] = user
+                if self.profile_cache is not None:
+                    self.profile_cache.set(user.id, user, generation=generations.get(user.id))
+        return {key: profiles.get(key) for key in keys}
+    
+    def find_profile(self, user_id):
+        return self.find_profiles([user_id])[str(user_id)]
+    
+    def find_authors(self, user_ids, memo=None):
+        """Author summary (username, profilePicture) per user id, None for unknown ids.
+
+        memo is a dict reused across calls in a request; ids already in it are
+        not looked up again.
+        """
+        memo = {} if memo is None else memo
+        missing = [str(user_id) for user_id in user_ids if user_id and str(user_id) not in memo]
+        if missing:
+            for key, user in self.find_profiles(missing).items():
+                memo[key] = user.to_dict(['username', 'profilePicture']) if user else None
+        return {str(user_id): memo.get(str(user_id)) for user_id in user_ids}
+    
+    def latest_profile_change(self):
+        """updated_at of the most recently updated user, or None; validates responses that inline authors"""
+        user_data = self.collection.find_one({}, {'updated_at': 1}, sort=[('updated_at', -1)])
+        return user_data.get('updated_at') if user_data else None
+    
+    @staticmethod
+    def _suggestion(user_data):
+        return {'_id': str(user_data['_id']), 'username': user_data['username']}
+    
+    def rebuild_username_index(self):
+        """Load every username into the autocomplete index, reading the unique username index"""
+        if self.username_index is None:
+            return
+        users_cursor = self.collection.find({}, {'username': 1}).hint([('username', 1)])
+        self.username_index.rebuild(
+            (user['_id'], user['username'], self._suggestion(user)) for user in users_cursor
+        )
+    
+    def suggest_usernames(self, prefix, limit=10):
+        """Users whose username starts with prefix, for autocomplete"""
+        if self.username_index is None:
+            return []
+        return self.username_index.suggest(prefix, limit)
+    
+    def get_all_users(self, sort_field='created_at', sort_direction=-1, skip=0, limit=9, cursor=None, fields=None):
+        """Get all users with pagination and sorting (keyset when a cursor is given).
+
+        Only the public fields (or the requested subset) are read; the
+        password hash never leaves the database.
+        """
+        query_filter = {}
+        if cursor:
+            query_filter = apply_cursor(query_filter, sort_field, sort_direction, cursor)
+            skip = 0
+        projection = projection_for(fields or list(User.FIELDS), User.FIELDS, always=(sort_field,))
+        users_cursor = self.collection.find(query_filter, projection).sort([(sort_field, sort_direction), ('_id', sort_direction)]).skip(skip).limit(limit)
+        return [User.from_dict(user, self) for user in users_cursor]
+    
+    def summarize(self, limit=5, since=None):
+        """Latest users, total and count created since a date, in one $facet aggregation"""
+        result = self.collection.aggregate(summary_pipeline('created_at', limit, since))
+        latest, total, recent = unpack_summary(result)
+        return [User.from_dict(user, self) for user in latest], total, recent
+    
     def create_user(self, user):
         user_data = {
             'username': user.username,
@@ -93,12 +238,18 @@ class UserModel:
             'password': user.password,
             'profile_picture': user.profile_picture,
             'is_admin': user.is_admin,
+            'token_version': user.token_version,
             'created_at': user.created_at,
             'updated_at': user.updated_at
         }
         
         result = self.collection.insert_one(user_data)
         user._id = result.inserted_id
+        if self.stats is not None:
+            self.stats.record_create('users', user.created_at)
+        if self.username_index is not None:
+            self.username_index.add(user._id, user.username, self._suggestion(user_data))
+        self._notify(user._id)
         user._user_model = self
         return user
     
@@ -108,10 +259,29 @@ class UserModel:
             raise ValueError("Invalid user ID")
         
         update_data['updated_at'] = datetime.utcnow()
+        update = {'$set': update_data}
+        
+        # Password or role changes revoke every token issued before them
+        if 'password' in update_data or 'is_admin' in update_data:
+            update['$inc'] = {'token_version': 1}
+        
+        result = self.collection.update_one({'_id': object_id}, update)
+        if result.modified_count and self.username_index is not None and 'username' in update_data:
+            self.username_index.add(object_id, update_data['username'], self._suggestion({'_id': object_id, 'username': update_data['username']}))
+        self.invalidate_cached_user(user_id)
+        return result.modified_count > 0
+    
+    def set_password_hash(self, user_id, hashed_password):
+        """Replace a stored hash without touching updated_at (used for transparent rehashing)"""
+        object_id = self._to_object_id(user_id)
+        if not object_id:
+            raise ValueError("Invalid user ID")
+        
         result = self.collection.update_one(
             {'_id': object_id},
-            {'$set': update_data}
+            {'$set': {'password': hashed_password}}
         )
+        self.invalidate_cached_user(user_id)
         return result.modified_count > 0
     
     def delete_user(self, user_id):
@@ -120,8 +290,41 @@ class UserModel:
             raise ValueError("Invalid user ID")
         
         result = self.collection.delete_one({'_id': object_id})
+        self.invalidate_cached_user(user_id)
+        if result.deleted_count and self.stats is not None:
+            self.stats.record_delete('users', object_id)
+        if result.deleted_count and self.username_index is not None:
+            self.username_index.remove(object_id)
         return result.deleted_count > 0
     
+    def _notify(self, user_id):
+        """Have the other worker processes refresh their copy of this user"""
+        if self.change_feed is not None:
+            self.change_feed.publish('user', {'id': str(user_id)})
+    
+    def apply_changes(self, changes):
+        """Drop the cached users and refresh the username index after other processes wrote users"""
+        object_ids = set()
+        for data in changes:
+            object_id = self._to_object_id(data.get('id'))
+            if object_id:
+                self._drop_cached_user(object_id)
+                object_ids.add(object_id)
+        if self.username_index is None or not object_ids:
+            return
+        for user_data in self.collection.find({'_id': {'$in': list(object_ids)}}, {'username': 1}):
+            self.username_index.add(user_data['_id'], user_data['username'], self._suggestion(user_data))
+            object_ids.discard(user_data['_id'])
+        for object_id in object_ids:  # Deleted since
+            self.username_index.remove(object_id)
+    
+    def resync(self):
+        """Rebuild everything kept in memory, for a process that missed changes"""
+        for cache in (self.user_cache, self.token_versions, self.profile_cache):
+            if cache is not None:
+                cache.clear()
+        self.rebuild_username_index()
+    
 
     def create_default_admin(self):
         """Environment variables ကနေ admin details ယူပြီး ဖန်တီးခြင်း"""
@@ -129,12 +332,12 @@ class UserModel:
         admin_username = os.getenv('ADMIN_USERNAME', 'admin')
         admin_password = os.getenv('ADMIN_PASSWORD', 'admin123')
         
-        existing_admin = self.find_by_email(admin_email)
+        existing_admin = self.find_by_email(admin_email, PROFILE_PROJECTION)
         if existing_admin:
             print("Admin user already exists")
             return existing_admin
         
-        hashed_password = bcrypt.generate_password_hash(admin_password).decode('utf-8')
+        hashed_password = current_app.password_hasher.hash_password(admin_password)
         
         admin_user = User(
             username=admin_username,
@@ -1,7 +1,8 @@
 from flask import Blueprint
 from ..controllers.comment_controller import (
     create_comment, get_post_comments, like_comment, 
-    edit_comment, delete_comment, get_comments
+    edit_comment, delete_comment, get_comments, get_comment_thread,
+    stream_post_comments
 )
 
 def create_comment_blueprint():
@@ -15,6 +16,14 @@ def create_comment_blueprint():
     def get_post_comments_route(post_id):
         return get_post_comments(post_id)
     
+    @comment_bp.route('/stream/<string:post_id>', methods=['GET'])
+    def stream_post_comments_route(post_id):
+        return stream_post_comments(post_id)
+    
+    @comment_bp.route('/thread/<string:comment_id>', methods=['GET'])
+    def get_comment_thread_route(comment_id):
+        return get_comment_thread(comment_id)
+    
     @comment_bp.route('/likeComment/<string:comment_id>', methods=['PUT'])
     def like_comment_route(comment_id):
         return like_comment(comment_id)
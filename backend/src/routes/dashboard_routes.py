@@ -0,0 +1,11 @@
+from flask import Blueprint
+from ..controllers.dashboard_controller import get_summary
+
+def create_dashboard_blueprint():
+    dashboard_bp = Blueprint('dashboard', __name__)
+    
+    @dashboard_bp.route('/summary', methods=['GET'])
+    def summary_route():
+        return get_summary()
+    
+    return dashboard_bp
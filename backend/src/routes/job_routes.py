@@ -0,0 +1,11 @@
+from flask import Blueprint
+from ..controllers.job_controller import get_job
+
+def create_job_blueprint():
+    job_bp = Blueprint('job', __name__)
+    
+    @job_bp.route('/<string:job_id>', methods=['GET'])
+    def get_job_route(job_id):
+        return get_job(job_id)
+    
+    return job_bp
@@ -0,0 +1,11 @@
+from flask import Blueprint
+from ..controllers.metrics_controller import get_metrics
+
+def create_metrics_blueprint():
+    metrics_bp = Blueprint('metrics', __name__)
+    
+    @metrics_bp.route('/metrics', methods=['GET'])
+    def get_metrics_route():
+        return get_metrics()
+    
+    return metrics_bp
@@ -1,5 +1,8 @@
 from flask import Blueprint
-from ..controllers.post_controller import create_post, get_posts, delete_post, update_post
+from ..controllers.post_controller import (
+    create_post, get_posts, delete_post, update_post, suggest_posts,
+    get_post_cache_stats
+)
 
 def create_post_blueprint():
     post_bp = Blueprint('post', __name__)
@@ -12,6 +15,14 @@ def create_post_blueprint():
     def get_posts_route():
         return get_posts()
     
+    @post_bp.route('/suggest', methods=['GET'])
+    def suggest_posts_route():
+        return suggest_posts()
+    
+    @post_bp.route('/cache-stats', methods=['GET'])
+    def post_cache_stats_route():
+        return get_post_cache_stats()
+    
     @post_bp.route('/deletepost/<string:post_id>/<string:user_id>', methods=['DELETE'])
     def delete_post_route(post_id, user_id):
         return delete_post(post_id, user_id)
@@ -0,0 +1,15 @@
+from flask import Blueprint
+from ..controllers.profiler_controller import get_profiles, clear_profiles
+
+def create_profiler_blueprint():
+    profiler_bp = Blueprint('profiler', __name__)
+    
+    @profiler_bp.route('/', methods=['GET'])
+    def get_profiles_route():
+        return get_profiles()
+    
+    @profiler_bp.route('/', methods=['DELETE'])
+    def clear_profiles_route():
+        return clear_profiles()
+    
+    return profiler_bp
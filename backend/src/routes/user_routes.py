@@ -1,7 +1,8 @@
 from flask import Blueprint
 from ..controllers.user_controller import (
     test, update_user, delete_user, signout, 
-    get_users, get_user, update_user_admin
+    get_users, get_user, update_user_admin, get_user_cache_stats,
+    suggest_users, get_users_batch
 )
 
 def create_user_blueprint(user_model):
@@ -30,6 +31,18 @@ def create_user_blueprint(user_model):
     def get_users_route():
         return get_users()
     
+    @user_bp.route('/cache-stats', methods=['GET'])
+    def user_cache_stats_route():
+        return get_user_cache_stats()
+    
+    @user_bp.route('/suggest', methods=['GET'])
+    def suggest_users_route():
+        return suggest_users()
+    
+    @user_bp.route('/batch', methods=['GET', 'POST'])
+    def get_users_batch_route():
+        return get_users_batch()
+    
     @user_bp.route('/<string:user_id>', methods=['GET'])
     def get_user_route(user_id):
         return get_user(user_id)
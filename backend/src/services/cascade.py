@@ -0,0 +1,42 @@
+def _drain(delete_batch, report, counter):
+    """Call delete_batch until it reports an empty batch, recording progress"""
+    while True:
+        deleted = delete_batch()
+        if not deleted:
+            return
+        report(**{counter: deleted})
+
+def register_cascade_jobs(job_queue, user_model, post_model, comment_model, batch_size=500):
+    """Jobs that remove what a deleted post or user leaves behind, in bounded batches.
+
+    The controllers enqueue them held, before deleting the post or user,
+    so a request that stops in between leaves a job that refuses to run
+    rather than orphans that nothing removes.
+    """
+    
+    def delete_post_comments(post_id, report):
+        _drain(lambda: comment_model.delete_post_comments_batch(post_id, batch_size), report, 'comments')
+    
+    def delete_post(params, report):
+        post_id = params['post_id']
+        if post_model.find_by_id(post_id, {'_id': 1}):
+            raise RuntimeError('The post was not deleted')
+        delete_post_comments(post_id, report)
+    
+    def delete_user(params, report):
+        user_id = params['user_id']
+        if user_model.find_by_id(user_id, {'_id': 1}):
+            raise RuntimeError('The user was not deleted')
+        _drain(lambda: comment_model.delete_user_comments_batch(user_id, batch_size), report, 'comments')
+        _drain(lambda: comment_model.remove_user_likes_batch(user_id, batch_size), report, 'likes')
+        while True:
+            post_ids = post_model.find_ids_by_user(user_id, batch_size)
+            if not post_ids:
+                return
+            for post_id in post_ids:
+                post_model.delete_post(post_id)
+                delete_post_comments(str(post_id), report)
+            report(posts=len(post_ids))
+    
+    job_queue.register('delete_post', delete_post)
+    job_queue.register('delete_user', delete_user)
@@ -0,0 +1,189 @@
+from datetime import datetime, timedelta
+from bson import ObjectId
+import os
+import threading
+import time
+import uuid
+
+class ChangeFeed:
+    """Tells every worker process about writes made in the others, through the changes collection.
+
+    The search and autocomplete indexes, the caches and the SSE
+    subscribers live in each process, and a write only updates the ones of
+    the process that made it. publish() records a small change (topic,
+    data, origin process) and every process polls the collection every
+    ``interval`` seconds from a background thread, passing the changes
+    made elsewhere to the handler registered for their topic. Handlers
+    re-read what they need from the database, so applying a change twice
+    or out of order is harmless.
+
+    Change ids come from the writers' clocks, so each poll re-reads the
+    last ``overlap`` seconds (skipping ids already seen) to pick up writes
+    that committed late. Changes expire after ``retention`` seconds; a
+    process that is further behind than that (a worker forked long after
+    the master booted, or one that lost the database for a while) runs the
+    resync handlers, which rebuild from scratch, instead.
+
+    Catching up runs on the polling thread, not in start(), so a worker
+    forked long after the master booted keeps heartbeating while it
+    replays or resyncs; wait_ready() tells when it is done. Topics
+    registered with ``batched=True`` get a poll's changes in lists of up
+    to ``batch_size``, so a long replay costs a few reads, not one per
+    change.
+    """
+
+    def __init__(self, db, interval=1.0, overlap=5.0, retention=6 * 3600, batch_size=1000):
+        self.collection = db.changes
+        self.interval = interval
+        self.overlap = overlap
+        self.retention = retention
+        self.batch_size = batch_size
+        self.published = 0
+        self.applied = 0
+        self.resyncs = 0
+        self._handlers = {}
+        self._resync_handlers = []
+        self._origin = None
+        self._origin_pid = None
+        # Everything written before this is already reflected in memory; a
+        # forked worker inherits the master's and catches up from there
+        self._watermark = datetime.utcnow()
+        self._seen = {}  # change id -> its timestamp, while it can come back in an overlap
+        self._poll_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread_pid = None
+        self._caught_up = threading.Event()
+
+    def create_indexes(self):
+        # Mongo removes changes once every process had time to see them
+        self.collection.create_index([('at', 1)], expireAfterSeconds=self.retention)
+
+    def register(self, topic, handler, batched=False):
+        """handler(data) applies a change another process published on topic, or handler([data, ...]) when batched"""
+        self._handlers[topic] = (handler, batched)
+
+    def on_resync(self, handler):
+        """handler() rebuilds from the database when changes may have been missed"""
+        self._resync_handlers.append(handler)
+
+    @property
+    def origin(self):
+        # Per process, so a forked worker does not skip the master's changes as its own
+        if self._origin_pid != os.getpid():
+            self._origin = uuid.uuid4().hex
+            self._origin_pid = os.getpid()
+        return self._origin
+
+    def publish(self, topic, data):
+        """Record a change for the other processes; the caller has applied it locally"""
+        try:
+            self.collection.insert_one({'topic': topic, 'data': data, 'origin': self.origin, 'at': datetime.utcnow()})
+            self.published += 1
+        except Exception as e:
+            # The write itself succeeded; other processes converge on their next resync or TTL
+            print(f"Change feed publish failed for {topic}: {e}")
+
+    def poll(self):
+        """Apply the changes other processes made since the last poll; returns how many"""
+        with self._poll_lock:
+            started = datetime.utcnow()
+            if started - self._watermark > timedelta(seconds=self.retention - self.overlap):
+                self._resync(started)
+                return 0
+            since = ObjectId.from_datetime(self._watermark - timedelta(seconds=self.overlap))
+            origin = self.origin
+            applied = 0
+            batches = {}
+            changes = self.collection.find({'_id': {'$gt': since}}, {'topic': 1, 'data': 1, 'origin': 1}).sort('_id', 1)
+            for change in changes.batch_size(self.batch_size):
+                if change['_id'] in self._seen:
+                    continue
+                self._seen[change['_id']] = change['_id'].generation_time.replace(tzinfo=None)
+                topic = change.get('topic')
+                if change.get('origin') == origin or topic not in self._handlers:
+                    continue
+                batch = batches.setdefault(topic, [])
+                batch.append(change.get('data') or {})
+                if len(batch) >= self.batch_size or not self._handlers[topic][1]:
+                    applied += self._apply(topic, batch)
+                    batches[topic] = []
+            for topic, batch in batches.items():
+                if batch:
+                    applied += self._apply(topic, batch)
+            self._advance(started)
+            self.applied += applied
+            return applied
+
+    def _apply(self, topic, batch):
+        handler, batched = self._handlers[topic]
+        try:
+            if batched:
+                handler(batch)
+            else:
+                for data in batch:
+                    handler(data)
+            return len(batch)
+        except Exception as e:
+            print(f"Change feed handler for {topic} failed: {e}")
+            return 0
+
+    def _advance(self, started):
+        self._watermark = started
+        # Ids older than the next poll's overlap cannot come back
+        cutoff = started - timedelta(seconds=self.overlap + 1)
+        self._seen = {change_id: at for change_id, at in self._seen.items() if at >= cutoff}
+
+    def _resync(self, started):
+        print("Change feed is too far behind, rebuilding in-memory state")
+        # Changes recorded before the rebuild reads the database are part of it
+        since = ObjectId.from_datetime(started - timedelta(seconds=self.overlap))
+        self._seen = {
+            change['_id']: change['_id'].generation_time.replace(tzinfo=None)
+            for change in self.collection.find({'_id': {'$gt': since}}, {'_id': 1})
+        }
+        for handler in self._resync_handlers:
+            handler()
+        self.resyncs += 1
+        self._advance(started)
+
+    def start(self):
+        """Catch up, then keep polling, in the background; once per process, again after fork"""
+        if self._thread_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._thread_pid == os.getpid():
+                return
+            self._thread_pid = os.getpid()
+            self._caught_up = threading.Event()
+            threading.Thread(target=self._run, name='change-feed', daemon=True).start()
+
+    @property
+    def ready(self):
+        return self._caught_up.is_set()
+
+    def wait_ready(self, timeout=None):
+        """Wait for the catch-up started by start(); True once it is done"""
+        return self._caught_up.wait(timeout)
+
+    def _run(self):
+        try:
+            self.poll()
+        except Exception as e:
+            print(f"Change feed catch-up failed: {e}")
+        # Even after a failed catch-up: serving stale data beats not serving, and polling retries
+        self._caught_up.set()
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.poll()
+            except Exception as e:
+                print(f"Change feed poll failed: {e}")
+
+    def stats(self):
+        return {
+            'published': self.published,
+            'applied': self.applied,
+            'resyncs': self.resyncs,
+            'ready': self.ready,
+            'lagSeconds': round((datetime.utcnow() - self._watermark).total_seconds(), 3)
+        }
@@ -0,0 +1,94 @@
+import json
+import queue
+import threading
+
+class HubFullError(Exception):
+    """Raised when the process already serves its maximum number of subscribers"""
+
+class Subscription:
+    def __init__(self, topic, queue_size):
+        self.topic = topic
+        self.evicted = False
+        self._queue = queue.Queue(maxsize=queue_size)
+
+    def get(self, timeout):
+        """Next formatted event, or None when nothing arrived within timeout"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+class EventHub:
+    """In-process pub/sub for Server-Sent Events, one topic per post.
+
+    publish() never blocks: each event is formatted once and offered to
+    every subscriber's bounded queue, and a subscriber whose queue is full
+    is evicted instead of slowing the writer down. The hub only sees
+    events published in its own process; the change feed republishes the
+    other workers' events here.
+    """
+
+    def __init__(self, queue_size=100, max_subscribers=500):
+        self.queue_size = queue_size
+        self.max_subscribers = max_subscribers
+        self.published = 0
+        self.evictions = 0
+        self._topics = {}  # topic -> set of Subscription
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise HubFullError()
+            subscription = Subscription(topic, self.queue_size)
+            self._topics.setdefault(topic, set()).add(subscription)
+            self._count += 1
+            return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._remove(subscription)
+
+    def _remove(self, subscription):
+        subscribers = self._topics.get(subscription.topic)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._topics[subscription.topic]
+        self._count -= 1
+
+    @staticmethod
+    def format_event(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+    def publish(self, topic, event, data):
+        """Offer an event to the topic's subscribers, evicting the ones that fell behind"""
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        if not subscribers:
+            return
+        message = self.format_event(event, data)
+        slow = []
+        for subscription in subscribers:
+            try:
+                subscription._queue.put_nowait(message)
+            except queue.Full:
+                slow.append(subscription)
+        with self._lock:
+            self.published += 1
+            for subscription in slow:
+                subscription.evicted = True
+                self._remove(subscription)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'subscribers': self._count,
+                'topics': len(self._topics),
+                'maxSubscribers': self.max_subscribers,
+                'published': self.published,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,168 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import ReturnDocument
+import os
+import threading
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+class LeaseLostError(Exception):
+    """Raised by report() when another worker has taken over the job"""
+
+class JobQueue:
+    """Background jobs run on a small thread pool, with their state kept in the jobs collection.
+
+    Each job is a record (type, params, status, progress) that any worker
+    process can read, so its status can be polled from anywhere. A job is
+    claimed atomically before it runs and heartbeats while it makes
+    progress; resume() picks up queued jobs and running jobs whose worker
+    stopped heartbeating for longer than ``lease`` seconds. Handlers may
+    therefore run more than once and must be idempotent. Each claim gets
+    its own lease id: a run whose job was taken over stops at its next
+    report() and never records the job's final status.
+    """
+
+    def __init__(self, db, max_workers=2, lease=300, retention=7 * 24 * 3600):
+        self.collection = db.jobs
+        self.lease = lease
+        self.retention = retention
+        self.max_workers = max_workers
+        self._handlers = {}
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        # Threads do not survive fork, so every process starts its own pool
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    def create_indexes(self):
+        self.collection.create_index([('status', 1), ('heartbeat_at', 1)])
+        # Finished jobs are removed by Mongo once retention has passed
+        self.collection.create_index([('finished_at', 1)], expireAfterSeconds=self.retention)
+
+    def register(self, job_type, handler):
+        """handler(params, report) runs the job; report(**counts) records progress"""
+        self._handlers[job_type] = handler
+
+    def enqueue(self, job_type, params, requested_by=None, start=True):
+        """Store a job record and schedule it; returns the job id.
+
+        With start=False the job is held until start(), so that it can be
+        recorded before the write it cleans up after. Should the process
+        stop before start(), resume() runs it once ``lease`` seconds have
+        passed; the handler must then check that the write was made.
+        """
+        if job_type not in self._handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        now = datetime.utcnow()
+        job = {
+            'type': job_type,
+            'params': params,
+            'status': QUEUED,
+            'progress': {},
+            'attempts': 0,
+            'requested_by': requested_by,
+            'created_at': now,
+            'updated_at': now
+        }
+        if not start:
+            job['held_until'] = now + timedelta(seconds=self.lease)
+        result = self.collection.insert_one(job)
+        if start:
+            self.executor.submit(self._run, result.inserted_id)
+        return str(result.inserted_id)
+
+    def start(self, job_id):
+        """Release a job enqueued with start=False and schedule it"""
+        job_id = ObjectId(job_id)
+        self.collection.update_one({'_id': job_id}, {'$unset': {'held_until': ''}})
+        self.executor.submit(self._run, job_id)
+
+    def get(self, job_id):
+        try:
+            return self.collection.find_one({'_id': ObjectId(job_id)})
+        except Exception:
+            return None
+
+    def resume(self):
+        """Schedule jobs left queued or abandoned by a stopped worker"""
+        jobs_cursor = self.collection.find(self._claimable(), {'_id': 1})
+        for job in jobs_cursor:
+            self.executor.submit(self._run, job['_id'])
+
+    def _claimable(self):
+        now = datetime.utcnow()
+        stale = now - timedelta(seconds=self.lease)
+        return {'$or': [
+            {'status': QUEUED, 'held_until': {'$not': {'$gt': now}}},
+            {'status': RUNNING, 'heartbeat_at': {'$lt': stale}}
+        ]}
+
+    def _claim(self, job_id):
+        now = datetime.utcnow()
+        return self.collection.find_one_and_update(
+            {'$and': [{'_id': job_id}, self._claimable()]},
+            {'$set': {'status': RUNNING, 'lease_id': ObjectId(), 'heartbeat_at': now, 'updated_at': now}, '$inc': {'attempts': 1}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _run(self, job_id):
+        job = self._claim(job_id)
+        if not job:
+            return  # Claimed by another worker, or already finished
+        # Every write below only applies while this run still holds the job
+        held = {'_id': job_id, 'status': RUNNING, 'lease_id': job['lease_id']}
+
+        def report(**counts):
+            now = datetime.utcnow()
+            result = self.collection.update_one(
+                held,
+                {'$inc': {f'progress.{key}': value for key, value in counts.items()},
+                 '$set': {'heartbeat_at': now, 'updated_at': now}}
+            )
+            if not result.matched_count:
+                raise LeaseLostError(f"Job {job_id} was taken over by another worker")
+
+        try:
+            handler = self._handlers[job['type']]
+            handler(job['params'], report)
+            status, error = DONE, None
+        except LeaseLostError as e:
+            print(e)
+            return
+        except Exception as e:
+            status, error = FAILED, str(e)
+        now = datetime.utcnow()
+        result = self.collection.update_one(
+            held,
+            {'$set': {'status': status, 'error': error, 'finished_at': now, 'updated_at': now}}
+        )
+        if not result.matched_count:
+            print(f"Job {job_id} was taken over by another worker; leaving its status to that run")
+
+    @staticmethod
+    def to_dict(job):
+        def iso(value):
+            return value.isoformat() if isinstance(value, datetime) else value
+        return {
+            '_id': str(job['_id']),
+            'type': job['type'],
+            'status': job['status'],
+            'progress': job.get('progress', {}),
+            'error': job.get('error'),
+            'attempts': job.get('attempts', 0),
+            'createdAt': iso(job.get('created_at')),
+            'updatedAt': iso(job.get('updated_at')),
+            'finishedAt': iso(job.get('finished_at'))
+        }
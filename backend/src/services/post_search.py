@@ -0,0 +1,707 @@
+from collections import Counter, defaultdict
+from itertools import repeat
+from operator import add, itemgetter, mul, truediv
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from ..utils.native_threads import start_thread
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_FACET = '\x00'
+
+def tokenize(text):
+    """Lowercased word tokens of a title or (HTML) post body"""
+    if not text:
+        return []
+    return _TOKEN_RE.findall(_TAG_RE.sub(' ', text).lower())
+
+def facet_term(field, value):
+    """Index term for a post attribute searches can filter on, e.g. its author.
+
+    Word tokens never contain the NUL character, so facet terms cannot
+    collide with them or show up in prefix expansion.
+    """
+    return f'{_FACET}{field}{_FACET}{value}'
+
+class SearchIndexNotReady(Exception):
+    """The search index is still being built for the first time"""
+
+class PostSearchEngine:
+    """Interface for full-text post search used by get_posts.
+
+    Posts are given as (post_id, title, content, facets), where facets
+    maps attribute names (user_id, category) to the values searches can
+    be filtered on.
+    """
+    ready = True
+
+    def rebuild(self, posts):
+        """Replace the index with posts, an iterable of (post_id, title, content, facets)"""
+        raise NotImplementedError
+
+    def index_post(self, post_id, title, content, facets=None):
+        raise NotImplementedError
+
+    def remove_post(self, post_id):
+        raise NotImplementedError
+
+    def update(self, upserts=(), removals=()):
+        """Apply several changes at once: upserts of (post_id, title, content, facets) and removed ids"""
+        for post_id in removals:
+            self.remove_post(post_id)
+        for post_id, title, content, facets in upserts:
+            self.index_post(post_id, title, content, facets)
+
+    def wait_ready(self, timeout=None):
+        """True once the first rebuild has finished, waiting up to timeout seconds for it"""
+        return self.ready
+
+    def search(self, query, limit=None, filters=None, allowed=None):
+        """Return post ids (as strings) ordered by relevance.
+
+        filters maps facet names to the value every result must have, and
+        allowed, when given, is the set of the only post ids to return.
+        """
+        raise NotImplementedError
+
+    def matches(self, query, filters=None):
+        """Every post search(query, filters=filters) would return, in no order.
+
+        The result supports ``in`` (post ids as strings or ObjectIds),
+        ``ids()`` and has ``estimate``, an upper bound of its size.
+        """
+        raise NotImplementedError
+
+class _Postings:
+    """One term's postings: frequency per post, and the posts by descending impact"""
+    __slots__ = ('tf', 'ranked')
+
+    def __init__(self, tf, ranked):
+        self.tf = tf
+        self.ranked = ranked
+
+class _Segment:
+    """The bulk of the index, ranked once and never mutated.
+
+    avg_len is the average document length the postings were ranked
+    with; scores use it too (through norms), so impact order and scores
+    always agree.
+    """
+    __slots__ = ('postings', 'doc_len', 'doc_terms', 'norms', 'total_len', 'avg_len', 'vocabulary')
+
+    def __init__(self, postings, doc_len, doc_terms, norms, total_len, avg_len, vocabulary):
+        self.postings = postings      # term -> _Postings
+        self.doc_len = doc_len        # post_id -> weighted length
+        self.doc_terms = doc_terms    # post_id -> tuple of its distinct terms
+        self.norms = norms            # post_id -> BM25 length normalisation
+        self.total_len = total_len
+        self.avg_len = avg_len
+        self.vocabulary = vocabulary  # sorted terms, for prefix expansion
+
+class _Snapshot:
+    """What a search sees: the base segment plus the posts written since it was built"""
+    __slots__ = ('base', 'delta', 'stale', 'df_delta', 'delta_vocabulary', 'doc_count', 'total_len')
+
+    def __init__(self, base, delta=None, stale=frozenset(), df_delta=None, delta_vocabulary=(), doc_count=None, total_len=None):
+        self.base = base
+        self.delta = delta or {}                   # post_id -> (term frequencies, length) of new versions
+        self.stale = stale                         # base post ids removed or replaced since
+        self.df_delta = df_delta or {}             # term -> document frequency change since base
+        self.delta_vocabulary = delta_vocabulary   # sorted delta terms missing from base
+        self.doc_count = len(base.doc_len) if doc_count is None else doc_count
+        self.total_len = base.total_len if total_len is None else total_len
+
+class _Clause:
+    """One query clause over the base segment: a post scores the best of its terms"""
+    __slots__ = ('terms', 'norms', 'stale')
+
+    def __init__(self, k1, snapshot, clause):
+        self.terms = [(idf * (k1 + 1), term_postings) for idf, _, term_postings in clause if term_postings]
+        self.norms = snapshot.base.norms
+        self.stale = snapshot.stale
+
+    def scores(self, post_ids=None):
+        """Scores of the posts among post_ids (live base posts), or of every live base post"""
+        norms = self.norms
+        scores = {}
+        for weight, term_postings in self.terms:
+            tf = term_postings.tf
+            for post_id in (tf if post_ids is None else tf.keys() & post_ids):
+                frequency = tf[post_id]
+                score = weight * frequency / (frequency + norms[post_id])
+                if score > scores.get(post_id, 0.0):
+                    scores[post_id] = score
+        if post_ids is None:
+            for post_id in self.stale:
+                scores.pop(post_id, None)
+        return scores
+
+    def ranked(self):
+        """(score, post_id) of every posting, best first; a post comes once per term it contains"""
+        norms = self.norms
+
+        def entries(weight, term_postings):
+            tf = term_postings.tf
+            for post_id in term_postings.ranked:
+                frequency = tf[post_id]
+                yield weight * frequency / (frequency + norms[post_id]), post_id
+
+        streams = [entries(weight, term_postings) for weight, term_postings in self.terms]
+        return streams[0] if len(streams) == 1 else heapq.merge(*streams, key=itemgetter(0), reverse=True)
+
+    def threshold(self, depth):
+        """Best score at position depth of the terms' postings, 0.0 when they are all shorter"""
+        norms = self.norms
+        best = 0.0
+        for weight, term_postings in self.terms:
+            if len(term_postings.ranked) > depth:
+                frequency = term_postings.tf[term_postings.ranked[depth]]
+                best = max(best, weight * frequency / (frequency + norms[term_postings.ranked[depth]]))
+        return best
+
+    def head(self, threshold):
+        """Scores of the posts scoring above threshold, read from the top of each term's postings.
+
+        A post's best term is among them, so these are its clause scores.
+        """
+        norms = self.norms
+        scores = {}
+        for weight, term_postings in self.terms:
+            tf, ranked = term_postings.tf, term_postings.ranked
+            if threshold > 0.0:
+                # ranked is in descending impact, so bisect on the negated score
+                ranked = ranked[:bisect.bisect_left(ranked, -threshold, key=lambda post_id: -weight * tf[post_id] / (tf[post_id] + norms[post_id]))]
+            frequencies = list(map(tf.__getitem__, ranked))
+            term_scores = dict(zip(ranked, map(truediv, map(mul, frequencies, repeat(weight)), map(add, frequencies, map(norms.__getitem__, ranked)))))
+            # Posts with several of the clause's terms keep the best
+            for post_id in term_scores.keys() & scores.keys():
+                if scores[post_id] > term_scores[post_id]:
+                    term_scores[post_id] = scores[post_id]
+            scores.update(term_scores)
+        return scores
+
+class _Matches:
+    """The posts containing any of terms in one snapshot, optionally among candidates"""
+
+    def __init__(self, snapshot, terms, candidates):
+        self.snapshot = snapshot
+        self.terms = terms
+        self.candidates = candidates
+        # Document frequencies add up to at least the number of matches
+        self.estimate = sum(max(InvertedIndexSearchEngine._document_frequency(snapshot, term), 0) for term in terms)
+        if candidates is not None:
+            self.estimate = min(self.estimate, len(candidates))
+
+    def __contains__(self, post_id):
+        post_id = str(post_id)
+        if self.candidates is not None and post_id not in self.candidates:
+            return False
+        snapshot = self.snapshot
+        entry = snapshot.delta.get(post_id)
+        if entry is not None:
+            return not self.terms.isdisjoint(entry[0])
+        if post_id in snapshot.stale:
+            return False
+        doc_terms = snapshot.base.doc_terms.get(post_id)
+        return doc_terms is not None and not self.terms.isdisjoint(doc_terms)
+
+    def ids(self):
+        """Set of the matching post ids (as strings)"""
+        if self.candidates is not None and len(self.candidates) <= self.estimate:
+            return {post_id for post_id in self.candidates if post_id in self}
+        snapshot = self.snapshot
+        ids = set()
+        for term in self.terms:
+            term_postings = snapshot.base.postings.get(term)
+            if term_postings:
+                ids.update(term_postings.tf)
+        ids.difference_update(snapshot.stale)
+        ids.update(post_id for post_id, (terms, _) in snapshot.delta.items() if not self.terms.isdisjoint(terms))
+        if self.candidates is not None:
+            ids.intersection_update(self.candidates)
+        return ids
+
+class InvertedIndexSearchEngine(PostSearchEngine):
+    """In-process inverted index over post titles and content, ranked with BM25.
+
+    Title terms count ``title_weight`` times towards term frequency. The last
+    query term is also matched as a prefix, once it is ``min_prefix_length``
+    characters long, so results follow the user while they type; a document
+    scores the best of the expansions it contains.
+
+    Searches run lock-free against an immutable snapshot. Each term's
+    postings in the base segment are ordered by impact (its BM25
+    contribution), so a top-k search only scores the heads of the
+    postings, deep enough that no post past them can beat the k-th result
+    (see _top_k), instead of scoring every match. Writes hold a lock only
+    among themselves: they record new versions in a small delta and mark
+    the old ones stale, which searches score and skip directly. Once the
+    delta holds ``max_delta`` posts, or the average length drifts by more
+    than ``rerank_drift`` from the one the base was ranked with, a
+    background thread merges it into a new base segment; writes made
+    while it runs carry over as the next delta.
+
+    Facets are indexed as terms of frequency zero (see facet_term), so
+    they follow the same delta and merge path as words without counting
+    towards lengths or scores. A filtered search intersects their postings
+    into a candidate set: a small one is scored directly, a large one
+    filters the heads.
+
+    A rebuild does not hold the write lock while it builds: writes made
+    meanwhile go to the current index and are replayed on the new one.
+    Until the first rebuild finishes ``ready`` is False.
+    """
+
+    def __init__(self, k1=1.2, b=0.75, title_weight=3, max_prefix_terms=50, min_prefix_length=3, max_delta=256, rerank_drift=0.25):
+        self.k1 = k1
+        self.b = b
+        self.title_weight = title_weight
+        self.max_prefix_terms = max_prefix_terms
+        self.min_prefix_length = min_prefix_length
+        self.max_delta = max_delta
+        self.rerank_drift = rerank_drift
+        self.ready = False
+        self._snapshot = _Snapshot(_Segment({}, {}, {}, {}, 0, 1.0, []))
+        self._write_lock = threading.Lock()
+        self._rebuild_lock = threading.Lock()
+        self._pending = None  # writes made during a rebuild, replayed on its result
+        self._merging = None  # the running merge thread, if any
+
+    def __len__(self):
+        return self._snapshot.doc_count
+
+    def _terms_for(self, title, content, facets):
+        terms = Counter(tokenize(content))
+        for term in tokenize(title):
+            terms[term] += self.title_weight
+        for field, value in (facets or {}).items():
+            if value is not None:
+                terms[facet_term(field, value)] = 0
+        return terms
+
+    def _norm(self, length, avg_len):
+        return self.k1 * (1 - self.b + self.b * length / avg_len)
+
+    def _segment(self, frequencies, doc_len, doc_terms, total_len, pause=False):
+        """Segment with every term's postings ranked for the current average length"""
+        avg_len = total_len / len(doc_len) if doc_len else 1.0
+        norms = {post_id: self._norm(length, avg_len) for post_id, length in doc_len.items()}
+        norm_of = norms.__getitem__
+        postings = {}
+        for count, (term, tf) in enumerate(frequencies.items(), 1):
+            post_ids = list(tf)
+            counts = list(tf.values())
+            impacts = list(map(truediv, counts, map(add, counts, map(norm_of, post_ids))))
+            order = sorted(range(len(post_ids)), key=impacts.__getitem__, reverse=True)
+            postings[term] = _Postings(tf, list(map(post_ids.__getitem__, order)))
+            if pause and count % 2048 == 0:
+                time.sleep(0)
+        vocabulary = sorted(term for term in postings if not term.startswith(_FACET))
+        return _Segment(postings, doc_len, doc_terms, norms, total_len, avg_len, vocabulary)
+
+    def rebuild(self, posts):
+        """Replace the index with posts.
+
+        It yields (time.sleep(0)) every few hundred posts, so a rebuild in
+        a background thread, a greenlet under gevent, does not hold up
+        requests for its whole duration.
+        """
+        with self._rebuild_lock:
+            with self._write_lock:
+                self._pending = []
+            try:
+                segment = self._build(posts)
+            except BaseException:
+                with self._write_lock:
+                    self._pending = None
+                raise
+            with self._write_lock:
+                pending, self._pending = self._pending, None
+                self._snapshot = _Snapshot(segment)
+                for upserts, removals in pending:
+                    self._apply(upserts, removals)
+                self.ready = True
+
+    def _build(self, posts):
+        frequencies = defaultdict(dict)
+        doc_len = {}
+        doc_terms = {}
+        total_len = 0
+        for count, (post_id, title, content, facets) in enumerate(posts, 1):
+            post_id = str(post_id)
+            terms = self._terms_for(title, content, facets)
+            length = sum(terms.values())
+            doc_terms[post_id] = tuple(terms)
+            doc_len[post_id] = length
+            total_len += length
+            for term, frequency in terms.items():
+                frequencies[term][post_id] = frequency
+            if count % 256 == 0:
+                time.sleep(0)
+        return self._segment(frequencies, doc_len, doc_terms, total_len, pause=True)
+
+    def wait_ready(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not self.ready:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def index_post(self, post_id, title, content, facets=None):
+        self.update(upserts=[(post_id, title, content, facets)])
+
+    def remove_post(self, post_id):
+        self.update(removals=[post_id])
+
+    def update(self, upserts=(), removals=()):
+        upserts, removals = list(upserts), list(removals)
+        with self._write_lock:
+            if self._pending is not None:
+                self._pending.append((upserts, removals))
+            self._apply(upserts, removals)
+
+    def _apply(self, upserts, removals):
+        snapshot = self._snapshot
+        base = snapshot.base
+        delta = dict(snapshot.delta)
+        stale = set(snapshot.stale)
+        df_delta = dict(snapshot.df_delta)
+        doc_count = snapshot.doc_count
+        total_len = snapshot.total_len
+
+        def drop(post_id):
+            # Remove whichever version of the post searches currently see
+            nonlocal doc_count, total_len
+            if post_id in delta:
+                terms, length = delta.pop(post_id)
+            elif post_id in base.doc_len and post_id not in stale:
+                terms, length = base.doc_terms[post_id], base.doc_len[post_id]
+                stale.add(post_id)
+            else:
+                return
+            doc_count -= 1
+            total_len -= length
+            for term in terms:
+                df_delta[term] = df_delta.get(term, 0) - 1
+
+        new_terms = set()
+        for post_id in removals:
+            drop(str(post_id))
+        for post_id, title, content, facets in upserts:
+            post_id = str(post_id)
+            drop(post_id)
+            terms = self._terms_for(title, content, facets)
+            length = sum(terms.values())
+            delta[post_id] = (terms, length)
+            doc_count += 1
+            total_len += length
+            for term in terms:
+                df_delta[term] = df_delta.get(term, 0) + 1
+                if term not in base.postings and not term.startswith(_FACET):
+                    new_terms.add(term)
+
+        delta_vocabulary = snapshot.delta_vocabulary
+        new_terms.difference_update(delta_vocabulary)
+        if new_terms:
+            delta_vocabulary = sorted([*delta_vocabulary, *new_terms])
+        self._snapshot = _Snapshot(base, delta, frozenset(stale), df_delta, delta_vocabulary, doc_count, total_len)
+
+        avg_len = total_len / doc_count if doc_count else 1.0
+        # A merge thread from before a fork does not exist in the child, hence is_alive
+        if (self._merging is None or not self._merging.is_alive()) and (
+            len(delta) + len(stale) > self.max_delta or abs(avg_len - base.avg_len) > self.rerank_drift * base.avg_len
+        ):
+            # An OS thread even under gevent, where a merging greenlet would stall every request
+            self._merging = start_thread(self._merge_delta, self._snapshot, name='search-merge')
+
+    def _merge_delta(self, merged):
+        """Replace the base with one that includes merged's delta, then carry newer writes over"""
+        try:
+            base = self._merge(merged.base, merged.delta, merged.stale)
+            with self._write_lock:
+                current = self._snapshot
+                if current.base is merged.base:  # Otherwise a rebuild replaced everything meanwhile
+                    self._snapshot = self._rebase(base, merged, current)
+        finally:
+            with self._write_lock:
+                self._merging = None
+
+    @staticmethod
+    def _rebase(base, merged, current):
+        """current's view of the index, on top of the base built from merged"""
+        # Delta entries are never mutated, so identity tells which ones the base now holds
+        delta = {post_id: entry for post_id, entry in current.delta.items() if merged.delta.get(post_id) is not entry}
+        stale = set(current.stale - merged.stale)
+        stale.update(post_id for post_id, entry in merged.delta.items() if current.delta.get(post_id) is not entry)
+        df_delta = {}
+        for terms, _ in delta.values():
+            for term in terms:
+                df_delta[term] = df_delta.get(term, 0) + 1
+        for post_id in stale:
+            for term in base.doc_terms[post_id]:
+                df_delta[term] = df_delta.get(term, 0) - 1
+        delta_vocabulary = sorted({term for terms, _ in delta.values() for term in terms if term not in base.postings and not term.startswith(_FACET)})
+        return _Snapshot(base, delta, frozenset(stale), df_delta, delta_vocabulary, current.doc_count, current.total_len)
+
+    def _merge(self, base, delta, stale):
+        """New base segment with the stale posts removed and the delta added"""
+        doc_len = dict(base.doc_len)
+        doc_terms = dict(base.doc_terms)
+        total_len = base.total_len
+        removed = {}  # term -> stale post ids
+        added = {}    # term -> {post_id: frequency}
+        for post_id in stale:
+            total_len -= doc_len.pop(post_id)
+            for term in doc_terms.pop(post_id):
+                removed.setdefault(term, set()).add(post_id)
+        for post_id, (terms, length) in delta.items():
+            doc_terms[post_id] = tuple(terms)
+            doc_len[post_id] = length
+            total_len += length
+            for term, frequency in terms.items():
+                added.setdefault(term, {})[post_id] = frequency
+
+        # Only the terms the changed posts contain get new postings
+        frequencies = {}
+        for term in removed.keys() | added.keys():
+            old = base.postings.get(term)
+            tf = dict(old.tf) if old else {}
+            for post_id in removed.get(term, ()):
+                del tf[post_id]
+            tf.update(added.get(term, {}))
+            frequencies[term] = tf
+
+        avg_len = total_len / len(doc_len) if doc_len else 1.0
+        if abs(avg_len - base.avg_len) > self.rerank_drift * base.avg_len:
+            unchanged = {term: term_postings.tf for term, term_postings in base.postings.items() if term not in frequencies}
+            changed = {term: tf for term, tf in frequencies.items() if tf}
+            return self._segment({**unchanged, **changed}, doc_len, doc_terms, total_len)
+
+        avg_len = base.avg_len
+        norms = dict(base.norms)
+        for post_id in stale:
+            del norms[post_id]
+        for post_id, (_, length) in delta.items():
+            norms[post_id] = self._norm(length, avg_len)
+
+        postings = dict(base.postings)
+        for term, tf in frequencies.items():
+            if not tf:
+                del postings[term]
+                continue
+            old = base.postings.get(term)
+            gone = removed.get(term)
+            if old is None:
+                ranked = []
+            elif gone:
+                ranked = [post_id for post_id in old.ranked if post_id not in gone]
+            else:
+                ranked = list(old.ranked)
+            for post_id in added.get(term, ()):
+                # ranked is in descending impact, so bisect on the negated impact
+                bisect.insort(ranked, post_id, key=lambda other: -tf[other] / (tf[other] + norms[other]))
+            postings[term] = _Postings(tf, ranked)
+
+        vocabulary = base.vocabulary
+        if len(postings) != len(base.postings) or any(term not in base.postings for term in added):
+            vocabulary = sorted(term for term in postings if not term.startswith(_FACET))
+        return _Segment(postings, doc_len, doc_terms, norms, total_len, avg_len, vocabulary)
+
+    @staticmethod
+    def _document_frequency(snapshot, term):
+        term_postings = snapshot.base.postings.get(term)
+        return (len(term_postings.tf) if term_postings else 0) + snapshot.df_delta.get(term, 0)
+
+    def _expand_prefix(self, snapshot, prefix):
+        expanded = []
+        for vocabulary in (snapshot.base.vocabulary, snapshot.delta_vocabulary):
+            found = 0
+            for position in range(bisect.bisect_left(vocabulary, prefix), len(vocabulary)):
+                term = vocabulary[position]
+                if not term.startswith(prefix) or found == self.max_prefix_terms:
+                    break
+                # Terms whose posts were all removed since the base was built
+                if self._document_frequency(snapshot, term) > 0:
+                    expanded.append(term)
+                    found += 1
+        return sorted(expanded)[:self.max_prefix_terms]
+
+    def _clauses(self, snapshot, query_terms):
+        """Query as a list of clauses, each a list of (idf, term, base postings or None).
+
+        A document's score is the sum over clauses of its best term in each.
+        """
+        base = snapshot.base
+        terms = list(dict.fromkeys(query_terms[:-1]))
+        last = query_terms[-1]
+        expanded = self._expand_prefix(snapshot, last) if len(last) >= self.min_prefix_length else []
+        last_clause = [term for term in expanded or [last] if term not in terms]
+
+        clauses = []
+        for clause_terms in [[term] for term in terms] + [last_clause]:
+            clause = []
+            for term in clause_terms:
+                df = self._document_frequency(snapshot, term)
+                if df > 0:
+                    term_postings = base.postings.get(term)
+                    idf = math.log(1 + (snapshot.doc_count - df + 0.5) / (df + 0.5))
+                    clause.append((idf, term, term_postings))
+            if clause:
+                clauses.append(clause)
+        return clauses
+
+    def search(self, query, limit=None, filters=None, allowed=None):
+        query_terms = tokenize(query)
+        if not query_terms:
+            return []
+        snapshot = self._snapshot
+        if not snapshot.doc_count:
+            return []
+        clauses = self._clauses(snapshot, query_terms)
+        if not clauses:
+            return []
+        candidates = self._candidates(snapshot, filters, allowed)
+        if candidates is not None and not candidates:
+            return []
+        if limit is None:
+            scores = self._score_all(snapshot, clauses, candidates)
+            return sorted(scores, key=scores.get, reverse=True)
+        return self._top_k(snapshot, clauses, limit, candidates)
+
+    def matches(self, query, filters=None):
+        query_terms = tokenize(query)
+        snapshot = self._snapshot
+        clauses = self._clauses(snapshot, query_terms) if query_terms and snapshot.doc_count else []
+        terms = frozenset(term for clause in clauses for _, term, _ in clause)
+        return _Matches(snapshot, terms, self._candidates(snapshot, filters, None) if terms else None)
+
+    @staticmethod
+    def _facet_ids(snapshot, term):
+        """Live posts having a facet term"""
+        term_postings = snapshot.base.postings.get(term)
+        post_ids = set(term_postings.tf) if term_postings else set()
+        # Base versions replaced by a delta one are stale, so the delta has the final say
+        post_ids.difference_update(snapshot.stale)
+        post_ids.update(post_id for post_id, (terms, _) in snapshot.delta.items() if term in terms)
+        return post_ids
+
+    def _candidates(self, snapshot, filters, allowed):
+        """Ids of the live posts passing filters and allowed, or None when nothing is filtered"""
+        terms = [facet_term(field, value) for field, value in (filters or {}).items()]
+        if not terms:
+            if allowed is None:
+                return None
+            base = snapshot.base
+            return {
+                post_id for post_id in map(str, allowed)
+                if post_id in snapshot.delta or (post_id in base.doc_len and post_id not in snapshot.stale)
+            }
+        terms.sort(key=lambda term: self._document_frequency(snapshot, term))
+        candidates = self._facet_ids(snapshot, terms[0])
+        for term in terms[1:]:
+            if not candidates:
+                break
+            candidates.intersection_update(self._facet_ids(snapshot, term))
+        if allowed is not None:
+            candidates.intersection_update(map(str, allowed))
+        return candidates
+
+    def _delta_scores(self, snapshot, clauses, candidates=None):
+        """Scores of the delta posts that match, computed directly"""
+        k1, avg_len = self.k1, snapshot.base.avg_len
+        query_terms = {term for clause in clauses for _, term, _ in clause}
+        scores = {}
+        for post_id, (terms, length) in snapshot.delta.items():
+            if query_terms.isdisjoint(terms) or (candidates is not None and post_id not in candidates):
+                continue
+            norm = self._norm(length, avg_len)
+            score = 0.0
+            for clause in clauses:
+                best = 0.0
+                for idf, term, _ in clause:
+                    frequency = terms.get(term)
+                    if frequency:
+                        best = max(best, idf * frequency * (k1 + 1) / (frequency + norm))
+                score += best
+            scores[post_id] = score
+        return scores
+
+    def _score_all(self, snapshot, clauses, candidates=None):
+        """Exhaustive scoring, for callers that want every match"""
+        scores = self._delta_scores(snapshot, clauses, candidates)
+        pool = None
+        if candidates is not None:
+            pool = candidates.difference(snapshot.delta)
+        for clause in clauses:
+            for post_id, score in _Clause(self.k1, snapshot, clause).scores(pool).items():
+                scores[post_id] = scores.get(post_id, 0.0) + score
+        return scores
+
+    def _top_k(self, snapshot, clauses, limit, candidates=None):
+        """Best limit posts, scoring only the heads of the impact-ordered postings.
+
+        Each clause's head holds the posts scoring above its threshold in
+        one of its terms, so a post outside every head scores at most the
+        sum of the thresholds. Once the limit-th best post of the heads
+        reaches that sum the result is exact; otherwise the heads go twice
+        as deep and only the posts new to them are scored. Scoring is set
+        intersections with the postings, which keeps most per-post work
+        out of Python.
+        """
+        top = [(score, post_id) for post_id, score in self._delta_scores(snapshot, clauses, candidates).items()]
+        base_clauses = [_Clause(self.k1, snapshot, clause) for clause in clauses]
+        base_clauses = [clause for clause in base_clauses if clause.terms]
+        if len(base_clauses) == 1 and candidates is None:
+            # A post's first posting is its score, so the first limit posts are the best
+            found = []
+            seen = set(snapshot.delta)  # scored above
+            for score, post_id in base_clauses[0].ranked():
+                if post_id in seen or post_id in snapshot.stale:
+                    continue
+                seen.add(post_id)
+                found.append((score, post_id))
+                if len(found) == limit:
+                    break
+            return [post_id for _, post_id in heapq.nlargest(limit, top + found)]
+        scores = {}  # base posts scored so far
+        depth = max(2 * limit, 32)
+        # Only one in doc_count / len(candidates) posts of the heads passes the filters,
+        # so with few candidates scoring them all is cheaper than deep enough heads
+        if candidates is not None and len(candidates) ** 2 <= depth * snapshot.doc_count:
+            pool = candidates.difference(snapshot.delta)
+            for clause in base_clauses:
+                for post_id, score in clause.scores(pool).items():
+                    scores[post_id] = scores.get(post_id, 0.0) + score
+            return [post_id for _, post_id in heapq.nlargest(limit, top + [(score, post_id) for post_id, score in scores.items()])]
+        while True:
+            thresholds = [clause.threshold(depth) for clause in base_clauses]
+            heads = [clause.head(threshold) for clause, threshold in zip(base_clauses, thresholds)]
+            bound = sum(thresholds)
+            pool = set().union(*heads)
+            if candidates is not None:
+                if len(candidates) <= len(pool):
+                    # Scoring every candidate is no more work than going deeper
+                    pool = set(candidates)
+                    bound = 0.0
+                else:
+                    pool.intersection_update(candidates)
+            pool.difference_update(scores)
+            pool.difference_update(snapshot.stale)
+            pool.difference_update(snapshot.delta)
+            for post_id in pool:
+                scores[post_id] = 0.0
+            for clause, head in zip(base_clauses, heads):
+                for post_id in head.keys() & pool:
+                    scores[post_id] += head[post_id]
+                # Only the posts outside the clause's head need looking up
+                for post_id, score in clause.scores(pool.difference(head)).items():
+                    scores[post_id] += score
+            best = heapq.nlargest(limit, top + [(score, post_id) for post_id, score in scores.items()])
+            if bound == 0.0 or (len(best) == limit and best[-1][0] >= bound):
+                return [post_id for _, post_id in best]
+            depth *= 2
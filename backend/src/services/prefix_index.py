@@ -0,0 +1,71 @@
+import bisect
+import threading
+
+class PrefixIndex:
+    """Case-insensitive prefix lookup over a sorted array, for autocomplete.
+
+    Each entry is keyed by a document id so renames and deletes can find the
+    old key. Keys are truncated to ``max_key_length`` and at most
+    ``max_entries`` are held, which bounds memory.
+    """
+
+    def __init__(self, max_entries=200000, max_key_length=100):
+        self.max_entries = max_entries
+        self.max_key_length = max_key_length
+        self._entries = []     # sorted (lowercased key, id)
+        self._by_id = {}       # id -> (lowercased key, payload)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _normalize(self, text):
+        return (text or '').strip().lower()[:self.max_key_length]
+
+    def rebuild(self, items):
+        """Replace the index with items, an iterable of (id, text, payload)"""
+        by_id = {}
+        for item_id, text, payload in items:
+            if len(by_id) >= self.max_entries:
+                break
+            by_id[str(item_id)] = (self._normalize(text), payload)
+        entries = sorted((key, item_id) for item_id, (key, _payload) in by_id.items())
+        with self._lock:
+            self._by_id = by_id
+            self._entries = entries
+
+    def _remove(self, item_id):
+        existing = self._by_id.pop(item_id, None)
+        if existing is None:
+            return
+        position = bisect.bisect_left(self._entries, (existing[0], item_id))
+        if position < len(self._entries) and self._entries[position] == (existing[0], item_id):
+            del self._entries[position]
+
+    def add(self, item_id, text, payload):
+        item_id = str(item_id)
+        key = self._normalize(text)
+        with self._lock:
+            self._remove(item_id)
+            if len(self._entries) >= self.max_entries:
+                return
+            self._by_id[item_id] = (key, payload)
+            bisect.insort(self._entries, (key, item_id))
+
+    def remove(self, item_id):
+        with self._lock:
+            self._remove(str(item_id))
+
+    def suggest(self, prefix, limit=10):
+        """Payloads of the first ``limit`` entries whose key starts with prefix"""
+        prefix = self._normalize(prefix)
+        if not prefix:
+            return []
+        with self._lock:
+            position = bisect.bisect_left(self._entries, (prefix,))
+            matches = []
+            for key, item_id in self._entries[position:position + limit]:
+                if not key.startswith(prefix):
+                    break
+                matches.append(self._by_id[item_id][1])
+            return matches
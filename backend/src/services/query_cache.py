@@ -0,0 +1,109 @@
+from collections import OrderedDict
+import json
+import threading
+import time
+
+LIST_SCOPE = ('list',)
+
+class QueryResultCache:
+    """LRU cache of getposts results with a byte budget and write-driven invalidation.
+
+    Every entry belongs to a scope: queries pinned to one post by slug or id
+    are scoped to that post, everything else to the shared list scope. A
+    write to a post drops the list scope plus that post's slug and id
+    scopes; a change that only moves a post's counters drops just the
+    latter, and lists show it once they expire. A write generation counter
+    stops a result computed before a write from being stored after it.
+    Entries also expire after ``ttl`` seconds, which bounds staleness
+    caused by writes in other workers.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=30):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size, scope, expires_at)
+        self._scopes = {}              # scope -> set of keys
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def scope_for(slug=None, post_id=None):
+        if slug:
+            return ('slug', slug)
+        if post_id:
+            return ('id', post_id)
+        return LIST_SCOPE
+
+    def get(self, key):
+        """Return (value, generation); value is None on a miss"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[3] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], self.generation
+            if entry is not None:
+                self._drop(key)
+            self.misses += 1
+            return None, self.generation
+
+    def set(self, key, value, scope, generation):
+        """Store value unless a write happened since generation was read"""
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, size, scope, time.monotonic() + self.ttl)
+            self._scopes.setdefault(scope, set()).add(key)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        _value, size, scope, _expires_at = self._entries.pop(key)
+        self._bytes -= size
+        keys = self._scopes.get(scope)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._scopes[scope]
+
+    def invalidate(self, post_id=None, slug=None, lists=True):
+        """Drop everything a write to the given post can affect; lists=False keeps the list scope"""
+        scopes = [LIST_SCOPE] if lists else []
+        if slug:
+            scopes.append(('slug', slug))
+        if post_id:
+            scopes.append(('id', str(post_id)))
+        with self._lock:
+            self.generation += 1
+            for scope in scopes:
+                for key in list(self._scopes.get(scope, ())):
+                    self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._scopes.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': (self.hits / lookups) if lookups else 0.0
+            }
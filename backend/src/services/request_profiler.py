@@ -0,0 +1,236 @@
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, request
+import cProfile
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+
+class StackSampler:
+    """Samples the calling thread's stack every ``interval`` seconds from an OS thread.
+
+    Only the profiled request is recorded, so the other requests a worker
+    serves at the same time (and the background threads) stay out of the
+    profile. Under gevent the request is a greenlet sharing its OS thread
+    with the others: it is told apart by the bottom frame of its stack,
+    and while it is switched out the sample shows where it waits. Times
+    are estimates: each sample stands for an equal share of the wall
+    time, and there are no call counts.
+    """
+
+    def __init__(self, interval=0.001):
+        from ..utils.native_threads import get_ident, gevent_patched
+        self.interval = interval
+        self.samples = 0
+        self.elapsed = 0.0
+        self.thread_id = get_ident()
+        self._greenlet = None
+        if gevent_patched():
+            import greenlet
+            self._greenlet = greenlet.getcurrent()
+        frame = sys._getframe()
+        while frame.f_back is not None:
+            frame = frame.f_back
+        self._base = frame  # Bottom of the request's stack, the same in every sample
+        self._self = Counter()  # (filename, line, name) -> samples on top of the stack
+        self._cumulative = Counter()  # (filename, line, name) -> samples anywhere in the stack
+        self._started = None
+        self._stopped = False
+        self._thread = None
+
+    def enable(self):
+        from ..utils.native_threads import start_thread
+        self._started = time.perf_counter()
+        self._thread = start_thread(self._run, name='profile-sampler')
+
+    def disable(self):
+        self._stopped = True
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+
+    def _stack(self, frame):
+        """Keys of frame's stack, top first, or None when it is not the request's"""
+        keys = []
+        while frame is not None:
+            code = frame.f_code
+            keys.append((code.co_filename, code.co_firstlineno, code.co_name))
+            bottom, frame = frame, frame.f_back
+        return keys if keys and bottom is self._base else None
+
+    def _run(self):
+        from ..utils.native_threads import sleep
+        while not self._stopped:
+            sleep(self.interval)
+            stack = self._stack(sys._current_frames().get(self.thread_id))
+            if stack is None and self._greenlet is not None:
+                stack = self._stack(self._greenlet.gr_frame)  # Switched out, e.g. waiting on MongoDB
+            if stack is None:
+                continue
+            self.samples += 1
+            self._self[stack[0]] += 1
+            for key in set(stack):  # Recursion counts once per sample
+                self._cumulative[key] += 1
+
+    def stats(self):
+        """(filename, line, name) -> (samples, self seconds, cumulative seconds)"""
+        per_sample = self.elapsed / self.samples if self.samples else 0.0
+        return {
+            key: (self._self[key], self._self[key] * per_sample, samples * per_sample)
+            for key, samples in self._cumulative.items()
+        }
+
+class RequestProfiler:
+    """Profiles a sample of requests and keeps their hottest frames per endpoint.
+
+    A request is profiled when a valid admin token sends the ``header``
+    (e.g. ``X-Profile: 1``), or at random with probability
+    ``sample_rate``. At most one request per process is profiled at a
+    time and the others run untouched. Each endpoint keeps its last
+    ``buffer_size`` profiles. Like every other cache here, the buffers are
+    per worker process.
+
+    Only the request's own thread is profiled. cProfile does that up to
+    Python 3.11, but from 3.12 it hooks sys.monitoring and records every
+    thread of the process, and under gevent it records every greenlet
+    sharing the thread, so ``mode='auto'`` switches to a StackSampler
+    there; ``mode`` can also be forced to ``'cprofile'`` or ``'sampling'``.
+
+    Nothing is registered on the app unless PROFILER_ENABLED is set, so a
+    disabled profiler costs nothing.
+    """
+
+    def __init__(self, sample_rate=0.0, header='X-Profile', buffer_size=20, top=25, mode='auto', interval=0.001):
+        if mode == 'auto':
+            from ..utils.native_threads import gevent_patched
+            mode = 'sampling' if sys.version_info >= (3, 12) or gevent_patched() else 'cprofile'
+        if mode not in ('cprofile', 'sampling'):
+            raise ValueError(f"Unknown profiler mode {mode!r}")
+        self.mode = mode
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.header = header
+        self.buffer_size = buffer_size
+        self.top = top
+        self.profiled = 0
+        self.skipped_busy = 0
+        self._buffers = {}  # endpoint -> deque of profiles, newest last
+        self._active = threading.Lock()
+        self._lock = threading.Lock()
+
+    def _trigger(self):
+        if request.blueprint == 'profiler':
+            return None  # Reading the profiles should not evict them
+        if self.header and request.headers.get(self.header):
+            from ..utils.utils import is_admin_request
+            if is_admin_request():
+                return 'header'
+        if self.sample_rate and random.random() < self.sample_rate:
+            return 'sample'
+        return None
+
+    def start(self):
+        trigger = self._trigger()
+        if trigger is None:
+            return
+        if not self._active.acquire(blocking=False):
+            with self._lock:
+                self.skipped_busy += 1
+            return
+        if self.mode == 'sampling':
+            profile = StackSampler(self.interval)
+        else:
+            profile = cProfile.Profile()
+        g.profile = (profile, trigger, time.perf_counter())
+        profile.enable()
+
+    def stop(self, response=None):
+        state = g.pop('profile', None)
+        if state is None:
+            return
+        profile, trigger, started = state
+        profile.disable()
+        self._active.release()
+        if response is None:
+            return  # The request failed before a response; nothing worth keeping
+        entry = {
+            'at': datetime.utcnow().isoformat(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'status': response.status_code,
+            'trigger': trigger,
+            'mode': self.mode,
+            'durationMs': round((time.perf_counter() - started) * 1000, 2),
+            'frames': self.top_frames(profile)
+        }
+        if isinstance(profile, StackSampler):
+            # The sampler waits for the GIL like any thread, so short requests get few samples
+            entry['samples'] = profile.samples
+        self._record(request.endpoint or 'none', entry)
+
+    def top_frames(self, profile):
+        """The ``top`` functions by self time, pstats style"""
+        if isinstance(profile, StackSampler):
+            # Samples on top of the stack instead of calls
+            stats = profile.stats()
+            count_key = 'samples'
+        else:
+            stats = {key: (calls, self_time, cumulative) for key, (_, calls, self_time, cumulative, _) in pstats.Stats(profile).stats.items()}
+            count_key = 'calls'
+        hottest = sorted(stats.items(), key=lambda item: item[1][1], reverse=True)[:self.top]
+        return [
+            {
+                'function': f'{os.path.basename(filename)}:{line}({name})' if line else name,
+                count_key: count,
+                'selfMs': round(self_time * 1000, 3),
+                'cumulativeMs': round(cumulative * 1000, 3)
+            }
+            for (filename, line, name), (count, self_time, cumulative) in hottest
+        ]
+
+    def _record(self, endpoint, entry):
+        with self._lock:
+            buffer = self._buffers.get(endpoint)
+            if buffer is None:
+                buffer = self._buffers[endpoint] = deque(maxlen=self.buffer_size)
+            buffer.append(entry)
+            self.profiled += 1
+
+    def snapshot(self, endpoint=None):
+        with self._lock:
+            buffers = {
+                name: list(buffer)
+                for name, buffer in self._buffers.items()
+                if endpoint is None or name == endpoint
+            }
+            return {
+                'mode': self.mode,
+                'scope': 'request thread',
+                'sampleRate': self.sample_rate,
+                'header': self.header,
+                'profiled': self.profiled,
+                'skippedBusy': self.skipped_busy,
+                'endpoints': buffers
+            }
+
+    def clear(self):
+        with self._lock:
+            self._buffers.clear()
+
+    def register(self, app):
+        """Profile from the last before_request hook to the first after_request hook"""
+
+        @app.before_request
+        def start_profile():
+            self.start()
+
+        @app.after_request
+        def stop_profile(response):
+            self.stop(response)
+            return response
+
+        @app.teardown_request
+        def abandon_profile(_error):
+            self.stop()
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+# Bump whenever db-init gains an index or a data migration
+SCHEMA_VERSION = 3
+
+class SchemaOutdatedError(RuntimeError):
+    """Raised at startup when the database has not been initialized for this release"""
+
+def schema_version(db):
+    """Version stamped by the last db-init, or 0 for a database that never had one"""
+    doc = db.meta.find_one({'_id': 'schema'}, {'version': 1})
+    return doc.get('version', 0) if doc else 0
+
+def check_schema(db):
+    """One indexed read; raises SchemaOutdatedError if db-init has to run first"""
+    version = schema_version(db)
+    if version < SCHEMA_VERSION:
+        raise SchemaOutdatedError(
+            f"Database schema is at version {version}, this release needs {SCHEMA_VERSION}; run `flask db-init`"
+        )
+    return version
+
+def init_db(db, user_model, post_model, comment_model, job_queue, change_feed):
+    """Create every index and run the data migrations, then stamp SCHEMA_VERSION.
+
+    Each step is idempotent, so running it again (or on a database that
+    is already current) only costs the time it takes to find nothing to do.
+    """
+    user_model.create_indexes()
+    post_model.create_indexes()
+    comment_model.create_indexes()
+    job_queue.create_indexes()
+    change_feed.create_indexes()
+
+    # Precomputed excerpts for posts created before summary views existed
+    post_model.backfill_excerpts()
+
+    # Materialized paths for comments created before threading
+    comment_model.backfill_paths()
+
+    # Comment counters for posts created before they were maintained
+    post_model.backfill_comment_counters()
+
+    # Likes left in embedded arrays when switching to the collection store
+    comment_model.migrate_embedded_likes()
+
+    db.meta.update_one(
+        {'_id': 'schema'},
+        {'$set': {'version': SCHEMA_VERSION, 'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+    return SCHEMA_VERSION
@@ -0,0 +1,107 @@
+from bson import ObjectId
+from datetime import date, datetime, timedelta
+import threading
+import time
+
+class CollectionCounter:
+    """Incrementally maintained total and last-30-days counts for one collection.
+
+    Writes adjust the counts in memory: a total and one count per day of
+    the window, so the memory used does not grow with the write rate. The
+    last-month figure includes the whole of the oldest day until the next
+    recount. Every ``reconcile_interval`` seconds the next read recounts
+    from Mongo, which also corrects drift caused by writes made in other
+    worker processes; one read recounts while the others keep serving the
+    previous counts.
+    """
+
+    def __init__(self, collection, reconcile_interval=300, window_days=30):
+        self.collection = collection
+        self.reconcile_interval = reconcile_interval
+        self.window = timedelta(days=window_days)
+        self._total = 0
+        self._days = {}  # date -> documents created that day
+        self._reconciled_at = None
+        self._lock = threading.Lock()
+        self._reconcile_lock = threading.Lock()
+
+    def reconcile(self):
+        """Recount from Mongo"""
+        cutoff = datetime.utcnow() - self.window
+        total = self.collection.count_documents({})
+        per_day = self.collection.aggregate([
+            {'$match': {'created_at': {'$gte': cutoff}}},
+            {'$group': {'_id': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$created_at'}}, 'count': {'$sum': 1}}}
+        ])
+        days = {date.fromisoformat(row['_id']): row['count'] for row in per_day}
+        with self._lock:
+            self._total = total
+            self._days = days
+            self._reconciled_at = time.monotonic()
+
+    def record_create(self, created_at):
+        with self._lock:
+            if self._reconciled_at is None:
+                return
+            self._total += 1
+            day = created_at.date()
+            self._days[day] = self._days.get(day, 0) + 1
+
+    def record_delete(self, object_id):
+        """Count a deleted document, dated by its id (ids are made when the document is created)"""
+        with self._lock:
+            if self._reconciled_at is None:
+                return
+            self._total = max(self._total - 1, 0)
+            if ObjectId.is_valid(object_id):
+                day = ObjectId(object_id).generation_time.date()
+                if self._days.get(day):
+                    self._days[day] -= 1
+
+    def expire(self):
+        """Recount on the next read, e.g. after deletes that could not be counted one by one"""
+        with self._lock:
+            if self._reconciled_at is not None:
+                self._reconciled_at = float('-inf')
+
+    def _stale(self):
+        return self._reconciled_at is None or time.monotonic() - self._reconciled_at > self.reconcile_interval
+
+    def snapshot(self):
+        """Return (total, last_month), reconciling first when the counts are stale"""
+        if self._stale():
+            # Only the very first read has nothing to serve meanwhile and waits
+            if self._reconcile_lock.acquire(blocking=self._reconciled_at is None):
+                try:
+                    if self._stale():
+                        self.reconcile()
+                finally:
+                    self._reconcile_lock.release()
+        cutoff = (datetime.utcnow() - self.window).date()
+        with self._lock:
+            for day in [day for day in self._days if day < cutoff]:
+                del self._days[day]
+            return self._total, sum(self._days.values())
+
+class StatsService:
+    """Materialized total/last-month counters for posts, comments and users"""
+
+    def __init__(self, db, reconcile_interval=300):
+        self.counters = {
+            'posts': CollectionCounter(db.posts, reconcile_interval),
+            'comments': CollectionCounter(db.comments, reconcile_interval),
+            'users': CollectionCounter(db.users, reconcile_interval)
+        }
+
+    def record_create(self, name, created_at):
+        self.counters[name].record_create(created_at)
+
+    def record_delete(self, name, object_id):
+        self.counters[name].record_delete(object_id)
+
+    def expire(self, name):
+        self.counters[name].expire()
+
+    def get(self, name):
+        total, last_month = self.counters[name].snapshot()
+        return {'total': total, 'lastMonth': last_month}
@@ -0,0 +1,24 @@
+def summary_pipeline(sort_field, limit, since):
+    """Single $facet pipeline returning the latest documents, the total and the count since a date"""
+    return [
+        {'$facet': {
+            'latest': [
+                {'$sort': {sort_field: -1, '_id': -1}},
+                {'$limit': limit}
+            ],
+            'total': [
+                {'$count': 'count'}
+            ],
+            'recent': [
+                {'$match': {'created_at': {'$gte': since}}},
+                {'$count': 'count'}
+            ]
+        }}
+    ]
+
+def unpack_summary(result):
+    """Turn the $facet output of summary_pipeline into (latest_docs, total, recent)"""
+    facets = next(iter(result), None) or {}
+    total = facets.get('total') or [{'count': 0}]
+    recent = facets.get('recent') or [{'count': 0}]
+    return facets.get('latest', []), total[0]['count'], recent[0]['count']
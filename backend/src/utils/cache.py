@@ -0,0 +1,93 @@
+from collections import OrderedDict
+import threading
+import time
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    The cache is per process. Callers that must drop an entry everywhere
+    (UserModel.invalidate_cached_user) invalidate it locally and publish
+    the change, and every other worker invalidates its copy when it applies
+    that change, within CHANGE_FEED_INTERVAL; the TTL is the backstop for
+    a change that never arrives.
+
+    An entry loaded from the database can be outdated by the time it is
+    stored: read generation(key) before the read and pass it to set(),
+    which skips the store if the key was invalidated (or the cache
+    cleared) in between.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._generations = OrderedDict()  # key -> invalidations, for the most recently invalidated keys
+        self._epoch = 0  # bumped by clear() and when a key's count is forgotten
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self, key):
+        """Token for set(), changed by every invalidation of key"""
+        with self._lock:
+            return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key, value, ttl=None, generation=None):
+        """Store value, unless generation is given and key was invalidated since; True when stored"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if generation is not None and generation != (self._epoch, self._generations.get(key, 0)):
+                return False
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._generations.move_to_end(key)
+            if len(self._generations) > self.maxsize:
+                # A forgotten count could match an older token again, so every token goes stale
+                self._generations.popitem(last=False)
+                self._epoch += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return hit/miss counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRatio': (self.hits / lookups) if lookups else 0.0
+            }
@@ -0,0 +1,48 @@
+from flask import request, current_app, make_response
+from datetime import datetime, timezone
+import hashlib
+
+def make_etag(*parts):
+    """Strong ETag built from the parts that determine a response body"""
+    raw = '|'.join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def timestamp_ms(value):
+    """Millisecond timestamp of a naive UTC datetime, as stored by Mongo"""
+    if not isinstance(value, datetime):
+        return value
+    return int(value.replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+def _last_modified(updated_at):
+    if not isinstance(updated_at, datetime):
+        return None
+    return updated_at.replace(tzinfo=timezone.utc, microsecond=0)
+
+def is_not_modified(etag, updated_at=None):
+    """True when the request's If-None-Match / If-Modified-Since show the client copy is current"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    last_modified = _last_modified(updated_at)
+    if request.if_modified_since and last_modified:
+        return last_modified <= request.if_modified_since
+    return False
+
+def _cache_control():
+    policies = current_app.config.get('CACHE_CONTROL', {})
+    return policies.get(request.blueprint)
+
+def add_validators(response, etag, updated_at=None):
+    """Attach ETag, Last-Modified and the blueprint's Cache-Control policy to a response"""
+    response.set_etag(etag)
+    last_modified = _last_modified(updated_at)
+    if last_modified:
+        response.last_modified = last_modified
+    policy = _cache_control()
+    if policy:
+        response.headers['Cache-Control'] = policy
+    return response
+
+def not_modified_response(etag, updated_at=None):
+    """Empty 304 response carrying the same validators"""
+    response = make_response('', 304)
+    return add_validators(response, etag, updated_at)
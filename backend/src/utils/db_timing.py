@@ -0,0 +1,126 @@
+from flask import g, has_request_context, request
+from pymongo import monitoring
+import json
+import logging
+import sys
+import time
+
+slow_query_log = logging.getLogger('blog.slow_query')
+
+# Where each command keeps the filter worth logging
+FILTER_FIELDS = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+    'aggregate': 'pipeline',
+    'update': 'updates',
+    'delete': 'deletes'
+}
+
+def query_shape(value):
+    """The filter with every value replaced by '?', so logs group by shape and leak no data"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        shapes = [query_shape(item) for item in value]
+        # $and / $or clauses and pipeline stages keep their structure; $in lists collapse
+        if any(isinstance(shape, (dict, list)) for shape in shapes):
+            return shapes
+        return ['?']
+    return '?'
+
+def command_filter(command_name, command):
+    field = FILTER_FIELDS.get(command_name)
+    if field is None:
+        return None
+    value = command.get(field)
+    if command_name in ('update', 'delete'):
+        value = [statement.get('q') for statement in value or ()]
+    return query_shape(value)
+
+class CommandMonitor(monitoring.CommandListener):
+    """Attributes every MongoDB command to the Flask request that issued it.
+
+    pymongo calls the listener synchronously on the thread running the
+    command, so the per-request totals live on ``g``; commands from
+    background threads (jobs, executors) only reach the slow-query log.
+    """
+
+    def __init__(self, slow_ms=100):
+        self.slow_ms = slow_ms
+        self.commands = 0
+        self.slow_commands = 0
+        self._started = {}  # (connection_id, request_id) -> (command, database)
+
+    def started(self, event):
+        self._started[(event.connection_id, event.request_id)] = (event.command, event.database_name)
+
+    def succeeded(self, event):
+        self._finished(event, None)
+
+    def failed(self, event):
+        self._finished(event, event.failure)
+
+    def _finished(self, event, failure):
+        command, database = self._started.pop((event.connection_id, event.request_id), (None, None))
+        duration_ms = event.duration_micros / 1000
+        self.commands += 1
+        if has_request_context():
+            g.db_commands = g.get('db_commands', 0) + 1
+            g.db_time_ms = g.get('db_time_ms', 0.0) + duration_ms
+        if command is not None and duration_ms >= self.slow_ms:
+            self.slow_commands += 1
+            self._log_slow(event.command_name, command, database, duration_ms, failure)
+
+    def _log_slow(self, command_name, command, database, duration_ms, failure):
+        collection = command.get('collection') if command_name == 'getMore' else command.get(command_name)
+        entry = {
+            'event': 'slow_query',
+            'command': command_name,
+            'database': database,
+            'collection': collection if isinstance(collection, str) else None,
+            'filter': command_filter(command_name, command),
+            'sort': query_shape(command['sort']) if 'sort' in command else None,
+            'durationMs': round(duration_ms, 2),
+            'error': str(failure) if failure else None
+        }
+        if has_request_context():
+            entry.update(method=request.method, path=request.path, endpoint=request.endpoint)
+        slow_query_log.warning(json.dumps(entry, default=str))
+
+def register_db_timing(app):
+    """Server-Timing header with each request's DB command count and time"""
+    if not slow_query_log.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        slow_query_log.addHandler(handler)
+        slow_query_log.propagate = False
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        commands = g.get('db_commands', 0)
+        db_ms = g.get('db_time_ms', 0.0)
+        app_ms = (time.perf_counter() - started) * 1000
+        response.headers.add('Server-Timing', f'db;dur={db_ms:.1f};desc="{commands} commands", app;dur={app_ms:.1f}')
+
+        # Many commands for one request is usually a query inside a loop
+        budget = app.config['DB_COMMAND_BUDGET']
+        if budget and commands > budget:
+            slow_query_log.warning(json.dumps({
+                'event': 'db_command_budget',
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'commands': commands,
+                'budget': budget,
+                'dbMs': round(db_ms, 2)
+            }))
+        return response
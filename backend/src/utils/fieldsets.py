@@ -0,0 +1,32 @@
+def parse_fields(args, field_map, summary_fields):
+    """API field names requested through ?fields= or ?view=summary, or None for everything.
+
+    Raises ValueError for field names the resource does not have.
+    """
+    fields = args.get('fields')
+    if fields:
+        requested = [field.strip() for field in fields.split(',') if field.strip()]
+        unknown = [field for field in requested if field not in field_map]
+        if unknown:
+            raise ValueError(f"Unknown field(s): {', '.join(unknown)}")
+        if '_id' not in requested:
+            requested.insert(0, '_id')
+        return requested
+    if args.get('view') == 'summary':
+        return list(summary_fields)
+    return None
+
+def projection_for(fields, field_map, always=()):
+    """Mongo projection for the requested API fields plus the document fields in always"""
+    if fields is None:
+        return None
+    projection = {field_map[field]: 1 for field in fields}
+    for field in always:
+        projection[field] = 1
+    return projection
+
+def select_fields(data, fields):
+    """Keep only the requested keys of a serialized document"""
+    if fields is None:
+        return data
+    return {field: data[field] for field in fields if field in data}
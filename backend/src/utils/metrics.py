@@ -0,0 +1,144 @@
+from flask import g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from pymongo import monitoring
+import os
+import threading
+import time
+
+# Metrics are module level so that building several apps in one process
+# does not register them twice. Under gunicorn, PROMETHEUS_MULTIPROC_DIR
+# (set by gunicorn.conf.py) makes every process write its values to
+# mmap'ed files there, and /metrics sums them across workers.
+
+REQUESTS = Counter(
+    'http_requests_total', 'HTTP requests by endpoint and status',
+    ['blueprint', 'endpoint', 'method', 'status']
+)
+ERRORS = Counter(
+    'http_request_errors_total', 'Requests answered with a 5xx status',
+    ['blueprint', 'endpoint']
+)
+LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint',
+    ['blueprint', 'endpoint'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+HASHER_QUEUE = Gauge(
+    'password_hasher_queue_depth', 'bcrypt jobs running or waiting, as of each worker\'s last request',
+    multiprocess_mode='livesum'
+)
+HASHER_REJECTED = Counter('password_hasher_rejected_total', 'bcrypt jobs rejected because the queue was full')
+POOL_WAIT = Histogram(
+    'mongo_pool_checkout_wait_seconds', 'Time spent waiting for a MongoDB connection from the pool',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+POOL_CHECKOUT_FAILURES = Counter(
+    'mongo_pool_checkout_failures_total', 'Pool checkouts that failed, e.g. on waitQueueTimeoutMS',
+    ['reason']
+)
+# hit ratio: rate(cache_lookups_total{result="hit"}[5m]) / rate(cache_lookups_total[5m])
+CACHE_LOOKUPS = Counter('cache_lookups_total', 'Cache lookups by cache and result', ['cache', 'result'])
+STARTUP = Gauge('app_startup_seconds', 'Time create_app took', multiprocess_mode='max')
+
+class PoolWaitMonitor(monitoring.ConnectionPoolListener):
+    """Times every connection checkout; pymongo emits both events on the checking-out thread"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        if started is not None:
+            POOL_WAIT.observe(time.perf_counter() - started)
+            self._local.started = None
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        POOL_CHECKOUT_FAILURES.labels(reason=str(event.reason)).inc()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+class ProcessStats:
+    """Copies this process's hasher and cache counters into the shared metrics.
+
+    The caches and the hasher keep plain counters; only the increase since
+    the last sync is added, so the totals stay correct when summed over
+    workers. Runs after every request, which costs a few subtractions.
+    """
+
+    def __init__(self, password_hasher, caches):
+        self.password_hasher = password_hasher
+        self.caches = caches  # name -> object with hits / misses
+        self._reported = {}
+        self._lock = threading.Lock()
+
+    def _add(self, key, value, counter):
+        previous = self._reported.get(key, 0)
+        if value > previous:
+            counter.inc(value - previous)
+            self._reported[key] = value
+
+    def sync(self):
+        with self._lock:
+            HASHER_QUEUE.set(self.password_hasher.queue_depth)
+            self._add('hasher_rejected', self.password_hasher.rejected, HASHER_REJECTED)
+            for name, cache in self.caches.items():
+                if cache is None:
+                    continue
+                self._add((name, 'hit'), cache.hits, CACHE_LOOKUPS.labels(cache=name, result='hit'))
+                self._add((name, 'miss'), cache.misses, CACHE_LOOKUPS.labels(cache=name, result='miss'))
+
+def register_request_metrics(app, process_stats):
+    """Count and time every request per blueprint endpoint"""
+
+    @app.before_request
+    def start_metrics_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        started = g.get('metrics_started')
+        if started is None:
+            return response
+        blueprint = request.blueprint or 'none'
+        endpoint = request.endpoint or 'none'
+        LATENCY.labels(blueprint=blueprint, endpoint=endpoint).observe(time.perf_counter() - started)
+        REQUESTS.labels(blueprint=blueprint, endpoint=endpoint, method=request.method, status=str(response.status_code)).inc()
+        if response.status_code >= 500:
+            ERRORS.labels(blueprint=blueprint, endpoint=endpoint).inc()
+        process_stats.sync()
+        return response
+
+def render_metrics():
+    """Prometheus text format, summed over every worker in multiprocess mode"""
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
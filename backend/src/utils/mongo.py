@@ -0,0 +1,67 @@
+import os
+import threading
+
+class MongoConnection:
+    """Creates the MongoClient lazily, once per process.
+
+    A MongoClient must not be used across fork. With gunicorn's preload_app
+    the app is built in the master, so the master closes its client before
+    workers are forked (see gunicorn.conf.py) and each worker opens its own
+    on first use; the pid check also covers forks that skip that hook.
+    """
+
+    def __init__(self, uri, **options):
+        self.uri = uri
+        self.options = options  # maxPoolSize, minPoolSize, waitQueueTimeoutMS, ...
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    from pymongo import MongoClient
+                    self._client = MongoClient(self.uri, **self.options)
+                    self._pid = os.getpid()
+        return self._client
+
+    def close(self):
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                self._client.close()
+            self._client = None
+            self._pid = None
+
+    def database(self):
+        """Database handle that resolves to this process's client on every use"""
+        return LazyDatabase(self)
+
+class LazyDatabase:
+    def __init__(self, connection):
+        self._connection = connection
+
+    def get(self):
+        return self._connection.client.get_database()
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return LazyCollection(self._connection, name)
+
+    def __getitem__(self, name):
+        return LazyCollection(self._connection, name)
+
+class LazyCollection:
+    def __init__(self, connection, name):
+        self._connection = connection
+        self.name = name
+
+    def get(self):
+        return self._connection.client.get_database()[self.name]
+
+    def __getattr__(self, attr):
+        if attr.startswith('_'):
+            raise AttributeError(attr)
+        return getattr(self.get(), attr)
@@ -0,0 +1,65 @@
+"""OS threads for CPU-bound work, also under gunicorn's gevent worker.
+
+gunicorn.conf.py monkey-patches the standard library in gevent workers, so
+threading.Thread then starts a greenlet, and a CPU-bound loop in one
+(bcrypt, a search index merge or rebuild) stops every request of the
+worker until it finishes. Such work goes through these helpers, which use
+gevent's native thread pool when threading is patched and the plain
+threading module otherwise.
+"""
+import os
+import threading
+import time
+
+def gevent_patched():
+    """True when gevent has replaced threads with greenlets in this process"""
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('threading')
+
+def thread_pool_executor(max_workers, thread_name_prefix=''):
+    """concurrent.futures executor whose workers are OS threads"""
+    if gevent_patched():
+        from gevent.threadpool import ThreadPoolExecutor
+        return ThreadPoolExecutor(max_workers=max_workers)
+    from concurrent.futures import ThreadPoolExecutor
+    return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+class _PoolThread:
+    """is_alive() and join() of a task running on gevent's native thread pool"""
+
+    def __init__(self, result):
+        self._result = result
+        self._pid = os.getpid()
+
+    def is_alive(self):
+        # Like a thread, the task does not exist in a forked child
+        return self._pid == os.getpid() and not self._result.ready()
+
+    def join(self, timeout=None):
+        self._result.wait(timeout)
+
+def start_thread(target, *args, name=None):
+    """Run target(*args) on an OS thread; returns a handle with is_alive() and join()"""
+    if gevent_patched():
+        import gevent
+        return _PoolThread(gevent.get_hub().threadpool.spawn(target, *args))
+    thread = threading.Thread(target=target, args=args, name=name, daemon=True)
+    thread.start()
+    return thread
+
+def get_ident():
+    """The OS thread id, where threading.get_ident() would give the greenlet's under gevent"""
+    if gevent_patched():
+        from gevent.monkey import get_original
+        return get_original('_thread', 'get_ident')()
+    return threading.get_ident()
+
+def sleep(seconds):
+    """Sleep on an OS thread other than the hub's without starting a hub there"""
+    if gevent_patched():
+        from gevent.monkey import get_original
+        return get_original('time', 'sleep')(seconds)
+    return time.sleep(seconds)
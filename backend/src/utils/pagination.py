@@ -0,0 +1,47 @@
+from datetime import datetime
+from bson import ObjectId
+import base64
+import json
+
+def encode_cursor(sort_value, object_id):
+    """Encode the (sort value, _id) of the last item on a page as an opaque cursor"""
+    if isinstance(sort_value, datetime):
+        sort_value = sort_value.isoformat()
+    raw = json.dumps([sort_value, str(object_id)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor):
+    """Decode a cursor produced by encode_cursor, raising ValueError if it is malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        sort_value, object_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if isinstance(sort_value, str):
+            sort_value = datetime.fromisoformat(sort_value)
+        elif not isinstance(sort_value, (int, float)):
+            raise ValueError
+        return sort_value, ObjectId(object_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+def keyset_filter(sort_field, sort_direction, cursor):
+    """Range filter selecting the items that sort after the cursor position"""
+    sort_value, object_id = decode_cursor(cursor)
+    op = '$lt' if sort_direction == -1 else '$gt'
+    return {'$or': [
+        {sort_field: {op: sort_value}},
+        {sort_field: sort_value, '_id': {op: object_id}}
+    ]}
+
+def apply_cursor(query_filter, sort_field, sort_direction, cursor):
+    """Combine an existing query filter with the keyset range for cursor"""
+    range_filter = keyset_filter(sort_field, sort_direction, cursor)
+    if not query_filter:
+        return range_filter
+    return {'$and': [query_filter, range_filter]}
+
+def next_cursor(items, limit, sort_attr):
+    """Cursor for the page after items, or None when this was the last page"""
+    if limit <= 0 or len(items) < limit:
+        return None
+    last = items[-1]
+    return encode_cursor(getattr(last, sort_attr), last._id)
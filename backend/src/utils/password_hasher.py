@@ -0,0 +1,87 @@
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import os
+import threading
+import bcrypt
+from .native_threads import thread_pool_executor
+
+class HasherBusyError(Exception):
+    """Raised when the password hasher is saturated or a job timed out"""
+    pass
+
+class PasswordHasher:
+    """Runs bcrypt hashing and checking on a dedicated, bounded thread pool.
+
+    bcrypt releases the GIL while it works, so moving it off the request
+    thread keeps other routes responsive during a login burst. The pool
+    threads are OS threads under gevent too, where a greenlet running
+    bcrypt would stall the whole worker. At most
+    ``max_workers + max_queue`` jobs may be in flight; anything beyond that
+    is rejected straight away with HasherBusyError so callers can answer 503.
+    """
+
+    def __init__(self, rounds=12, max_workers=2, max_queue=32, timeout=5.0):
+        self.rounds = rounds
+        self.timeout = timeout
+        self.max_in_flight = max_workers + max_queue
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+
+    @property
+    def executor(self):
+        # Threads do not survive fork, so every process starts its own pool
+        if self._executor_pid != os.getpid():
+            with self._lock:
+                if self._executor_pid != os.getpid():
+                    self._executor = thread_pool_executor(self.max_workers, thread_name_prefix='bcrypt')
+                    self._executor_pid = os.getpid()
+        return self._executor
+
+    @property
+    def queue_depth(self):
+        """Number of hashing jobs currently running or waiting"""
+        return self._in_flight
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusyError('Password hasher queue is full')
+        with self._lock:
+            self._in_flight += 1
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise HasherBusyError('Password hashing timed out')
+
+    def hash_password(self, password):
+        """Hash a password with the configured cost factor"""
+        hashed = self._run(bcrypt.hashpw, password.encode('utf-8'), bcrypt.gensalt(self.rounds))
+        return hashed.decode('utf-8')
+
+    def check_password(self, hashed_password, password):
+        """Check a password against a stored bcrypt hash"""
+        return self._run(bcrypt.checkpw, password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+    def needs_rehash(self, hashed_password):
+        """True when the stored hash was made with a different cost factor"""
+        try:
+            return int(hashed_password.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return False
@@ -0,0 +1,30 @@
+from contextlib import contextmanager
+import time
+
+class StartupTimer:
+    """Wall-clock time of each create_app phase, so cold-start regressions show up in the logs"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # name -> milliseconds, in the order they ran
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = (time.perf_counter() - started) * 1000
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def to_dict(self):
+        return {
+            'totalMs': round(self.total_ms(), 1),
+            'phases': {name: round(ms, 1) for name, ms in self.phases.items()}
+        }
+
+    def summary(self):
+        phases = ', '.join(f'{name} {ms:.0f}' for name, ms in self.phases.items())
+        return f'App started in {self.total_ms():.0f} ms ({phases})'
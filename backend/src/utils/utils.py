@@ -1,5 +1,11 @@
 from flask import jsonify
+from .cache import TTLCache
 import functools
+import hashlib
+import time
+
+# Verified token claims keyed by a digest of the token, each kept until the token's own exp
+_verified_tokens = TTLCache(maxsize=4096)
 
 def error_handler(status_code, message):
     response = jsonify({
@@ -12,7 +18,7 @@ def error_handler(status_code, message):
     response.status_code = status_code
     return response
 
-def generate_token(user_id, is_admin=False):
+def generate_token(user_id, is_admin=False, token_version=0):
     import jwt
     from datetime import datetime, timedelta
     from flask import current_app
@@ -20,38 +26,13 @@ def generate_token(user_id, is_admin=False):
     payload = {
         'id': str(user_id),
         'isAdmin': is_admin,
+        'ver': token_version,
         'exp': datetime.utcnow() + timedelta(days=7)
     }
     
     token = jwt.encode(payload, current_app.config['JWT_SECRET'], algorithm='HS256')
     return token
 
-def token_required(f):
-    @functools.wraps(f)
-    def decorated(*args, **kwargs):
-        from flask import request, current_app
-        import jwt
-        from bson import ObjectId
-        
-        token = request.cookies.get('access_token')
-        
-        if not token:
-            return error_handler(401, 'Token is missing')
-        
-        try:
-            data = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=['HS256'])
-            current_user = current_app.user_model.find_by_id(data['id'])
-            if not current_user:
-                return error_handler(401, 'Invalid token')
-        except jwt.ExpiredSignatureError:
-            return error_handler(401, 'Token has expired')
-        except jwt.InvalidTokenError:
-            return error_handler(401, 'Invalid token')
-        
-        return f(current_user, *args, **kwargs)
-    
-    return decorated
-
 def admin_required(f):
     @functools.wraps(f)
     def decorated(current_user, *args, **kwargs):
@@ -60,97 +41,151 @@ def admin_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+def _load_current_user(user_id):
+    """Return the authenticated user, served from the per-process user cache when possible"""
+    from flask import current_app
+
+    user_cache = current_app.user_cache
+    token_versions = current_app.token_versions
+    # Read before the user, so that an invalidation racing with this load keeps its result out
+    versions_generation = token_versions.generation(user_id)
+    current_user = user_cache.get(user_id)
+    if current_user is not None:
+        token_versions.set(user_id, current_user.token_version, generation=versions_generation)
+        return current_user
+
+    from ..models.user_model import AUTH_PROJECTION
+    
+    users_generation = user_cache.generation(user_id)
+    current_user = current_app.user_model.find_by_id(user_id, AUTH_PROJECTION)
+    if not current_user:
+        return None
+
+    # Add model references to current_user for database operations
+    current_user._user_model = current_app.user_model
+    current_user._post_model = current_app.post_model
+    current_user._comment_model = current_app.comment_model
+
+    user_cache.set(user_id, current_user, generation=users_generation)
+    token_versions.set(user_id, current_user.token_version, generation=versions_generation)
+    return current_user
+
+class ClaimsUser:
+    """Lightweight current_user built from verified token claims, without a DB fetch"""
+
+    def __init__(self, user_id, is_admin):
+        from flask import current_app
+        
+        self._id = user_id
+        self.is_admin = is_admin
+        self._user_model = current_app.user_model
+        self._post_model = current_app.post_model
+        self._comment_model = current_app.comment_model
+    
+    @property
+    def id(self):
+        return self._id
+
+def _decode_token():
+    """Decode the access_token cookie, returning (claims, error_response)"""
+    from flask import request, current_app
+    
+    token = request.cookies.get('access_token')
+    
+    if not token:
+        return None, error_handler(401, 'Token is missing')
+    
+    token_key = hashlib.sha256(token.encode('utf-8')).digest()
+    data = _verified_tokens.get(token_key)
+    if data is not None:
+        return data, None
+    
+    import jwt
+    
+    try:
+        data = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, error_handler(401, 'Token has expired')
+    except jwt.InvalidTokenError:
+        return None, error_handler(401, 'Invalid token')
+    
+    remaining = data.get('exp', 0) - time.time()
+    if remaining > 0:
+        _verified_tokens.set(token_key, data, ttl=remaining)
+    
+    return data, None
+
 def token_required(f):
     @functools.wraps(f)
     def decorated(*args, **kwargs):
-        from flask import request, current_app
-        import jwt
-        from bson import ObjectId
-        
-        token = request.cookies.get('access_token')
+        data, error = _decode_token()
+        if error:
+            return error
         
-        if not token:
-            return error_handler(401, 'Token is missing')
-        
-        try:
-            data = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=['HS256'])
-            current_user = current_app.user_model.find_by_id(data['id'])
-            if not current_user:
-                return error_handler(401, 'Invalid token')
-            
-            # Add user_model reference to current_user for database operations
-            current_user._user_model = current_app.user_model
-            
-        except jwt.ExpiredSignatureError:
-            return error_handler(401, 'Token has expired')
-        except jwt.InvalidTokenError:
+        current_user = _load_current_user(data['id'])
+        if not current_user or data.get('ver', 0) != current_user.token_version:
             return error_handler(401, 'Invalid token')
         
         return f(current_user, *args, **kwargs)
     
     return decorated
 
-# Update the token_required decorator to include post_model
-def token_required(f):
+def token_claims_required(f):
+    """Like token_required, but trusts the signed claims instead of loading the user.
+
+    Only the token version is checked against a per-process map, so tokens
+    issued before a password or role change are still rejected. Use it on
+    read-mostly endpoints that only need current_user.id and is_admin.
+    """
     @functools.wraps(f)
     def decorated(*args, **kwargs):
-        from flask import request, current_app
-        import jwt
-        from bson import ObjectId
-        
-        token = request.cookies.get('access_token')
-        
-        if not token:
-            return error_handler(401, 'Token is missing')
-        
-        try:
-            data = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=['HS256'])
-            current_user = current_app.user_model.find_by_id(data['id'])
-            if not current_user:
-                return error_handler(401, 'Invalid token')
-            
-            # Add model references to current_user for database operations
-            current_user._user_model = current_app.user_model
-            current_user._post_model = current_app.post_model  # ADD THIS
-            
-        except jwt.ExpiredSignatureError:
-            return error_handler(401, 'Token has expired')
-        except jwt.InvalidTokenError:
-            return error_handler(401, 'Invalid token')
+        data, error = _verify_claims()
+        if error:
+            return error
         
+        current_user = ClaimsUser(data['id'], data.get('isAdmin', False))
         return f(current_user, *args, **kwargs)
     
     return decorated
 
-# Update the token_required decorator to include all models
-def token_required(f):
-    @functools.wraps(f)
-    def decorated(*args, **kwargs):
-        from flask import request, current_app
-        import jwt
-        from bson import ObjectId
-        
-        token = request.cookies.get('access_token')
-        
-        if not token:
-            return error_handler(401, 'Token is missing')
-        
-        try:
-            data = jwt.decode(token, current_app.config['JWT_SECRET'], algorithms=['HS256'])
-            current_user = current_app.user_model.find_by_id(data['id'])
-            if not current_user:
-                return error_handler(401, 'Invalid token')
-            
-            # Add model references to current_user for database operations
-            current_user._user_model = current_app.user_model
-            current_user._post_model = current_app.post_model
-            current_user._comment_model = current_app.comment_model  # ADD THIS
-            
-        except jwt.ExpiredSignatureError:
-            return error_handler(401, 'Token has expired')
-        except jwt.InvalidTokenError:
-            return error_handler(401, 'Invalid token')
-        
-        return f(current_user, *args, **kwargs)
+def _verify_claims():
+    """Decoded token claims whose token version is still current, as (claims, error_response)"""
+    from flask import current_app
+    
+    data, error = _decode_token()
+    if error:
+        return None, error
+    
+    user_id = data['id']
+    current_version = current_app.token_versions.get(user_id)
+    if current_version is None:
+        # Unknown or expired entry: resolve it once from the database
+        user = _load_current_user(user_id)
+        if not user:
+            return None, error_handler(401, 'Invalid token')
+        current_version = user.token_version
+    
+    if data.get('ver', 0) != current_version:
+        return None, error_handler(401, 'Invalid token')
+    
+    return data, None
+
+def optional_user_id():
+    """Id from a valid access_token cookie, or None, for public endpoints that personalize"""
+    from flask import request
+    
+    if not request.cookies.get('access_token'):
+        return None
+    data, error = _decode_token()
+    if error:
+        return None
+    return data['id']
+
+def is_admin_request():
+    """True when the request carries a valid, current admin token; never raises or responds"""
+    from flask import request
     
-    return decorated
\ No newline at end of file
+    if not request.cookies.get('access_token'):
+        return False
+    data, error = _verify_claims()
+    return error is None and bool(data.get('isAdmin'))
@@ -1,29 +1,16 @@
 //import moment from 'moment';
-import { useEffect, useState } from 'react';
+import { useState } from 'react';
 import { FaThumbsUp } from 'react-icons/fa';
 import { useSelector } from 'react-redux';
 import { Button, Textarea } from 'flowbite-react';
 // import { set } from 'mongoose';
 
 export default function Comment({ comment, onLike, onEdit, onDelete }) {
-  const [user, setUser] = useState({});
   const [isEditing, setIsEditing] = useState(false);
   const [editedContent, setEditedContent] = useState(comment.content);
   const { currentUser } = useSelector((state) => state.user);
-  useEffect(() => {
-    const getUser = async () => {
-      try {
-        const res = await fetch(`/api/user/${comment.userId}`);
-        const data = await res.json();
-        if (res.ok) {
-          setUser(data);
-        }
-      } catch (error) {
-        console.log(error.message);
-      }
-    };
-    getUser();
-  }, [comment]);
+  // Author profile comes inline with the comment
+  const user = comment.author;
 
   const handleEdit = () => {
     setIsEditing(true);
@@ -54,8 +41,8 @@ export default function Comment({ comment, onLike, onEdit, onDelete }) {
       <div className='flex-shrink-0 mr-3'>
         <img
           className='w-10 h-10 rounded-full bg-gray-200'
-          src={user.profilePicture}
-          alt={user.username}
+          src={user?.profilePicture}
+          alt={user?.username}
         />
       </div>
       <div className='flex-1'>
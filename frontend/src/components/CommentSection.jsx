@@ -1,16 +1,30 @@
 import { Alert, Button, Textarea } from 'flowbite-react';
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import { useSelector } from 'react-redux';
 import { Link, useNavigate } from 'react-router';
 import Comment from './Comment';
 import DeleteConfirmationModal from './DeleteConfirmationModal';
 
+// How often to refetch comments when live updates are unavailable
+const POLL_INTERVAL_MS = 15000;
 
 export default function CommentSection({ postId }) {
   const { currentUser } = useSelector((state) => state.user);
   const [comment, setComment] = useState('');
   const [commentError, setCommentError] = useState(null);
   const [comments, setComments] = useState([]);
+  const [totalComments, setTotalComments] = useState(0);
+  const [nextCursor, setNextCursor] = useState(null);
+  // Latest comments for the live-update handlers, which outlive a render
+  const commentsRef = useRef(comments);
+  commentsRef.current = comments;
+  const hasComment = (id) => commentsRef.current.some((c) => c._id === id);
+  // A deleted comment takes its replies with it: drop them all and count the whole subtree
+  const removeComments = ({ _id, deletedIds = [_id], deleted = deletedIds.length }) => {
+    const removed = new Set(deletedIds);
+    setComments((prev) => prev.filter((c) => !removed.has(c._id)));
+    setTotalComments((total) => total - deleted);
+  };
   const [showModal, setShowModal] = useState(false);
   const [commentToDelete, setCommentToDelete] = useState(null);
   const navigate = useNavigate();
@@ -39,7 +53,11 @@ export default function CommentSection({ postId }) {
       if (res.ok) {
         setComment('');
         setCommentError(null);
-        setComments([data, ...comments]);
+        // The live stream may already have delivered it
+        if (!hasComment(data._id)) {
+          setComments((prev) => [data, ...prev]);
+          setTotalComments((total) => total + 1);
+        }
       }
     } catch (error) {
       setCommentError('Something went wrong');
@@ -47,20 +65,88 @@ export default function CommentSection({ postId }) {
   };
 
   useEffect(() => {
-    const getComments = async () => {
+    // refresh keeps the older comments loaded with "Show more" and the cursor
+    // after them, replacing only the first page
+    const getComments = async (refresh) => {
       try {
         const res = await fetch(`/api/comment/getPostComments/${postId}`);
         if (res.ok) {
           const data = await res.json();
-          setComments(data);
+          setTotalComments(data.totalComments);
+          const oldest = data.comments[data.comments.length - 1]?.createdAt;
+          const older =
+            refresh && data.nextCursor
+              ? commentsRef.current.filter((c) => c.createdAt < oldest)
+              : [];
+          setComments([...data.comments, ...older]);
+          if (older.length === 0) setNextCursor(data.nextCursor);
         }
       } catch (error) {
         console.log(error.message);
       }
     };
-    getComments();
+    const refreshComments = () => getComments(true);
+    getComments(false);
+
+    // Live updates from other readers, instead of refetching the list
+    const events = new EventSource(`/api/comment/stream/${postId}`);
+    events.addEventListener('comment.created', (e) => {
+      const data = JSON.parse(e.data);
+      if (hasComment(data._id)) return;
+      setComments((prev) => [data, ...prev]);
+      setTotalComments((total) => total + 1);
+    });
+    events.addEventListener('comment.updated', (e) => {
+      const data = JSON.parse(e.data);
+      setComments((prev) =>
+        prev.map((c) => (c._id === data._id ? { ...c, content: data.content } : c))
+      );
+    });
+    events.addEventListener('comment.deleted', (e) => {
+      const data = JSON.parse(e.data);
+      if (!hasComment(data._id)) return;
+      removeComments(data);
+    });
+    events.addEventListener('comment.liked', (e) => {
+      const data = JSON.parse(e.data);
+      setComments((prev) =>
+        prev.map((c) =>
+          c._id === data._id ? { ...c, numberOfLikes: data.numberOfLikes } : c
+        )
+      );
+    });
+    // Fell too far behind: the stream is closed, so reload what was missed
+    events.addEventListener('evicted', refreshComments);
+
+    // A refused stream (503 when the server is at its live connection limit)
+    // closes for good, unlike a dropped one; poll the first page instead
+    let poll = null;
+    events.onerror = () => {
+      if (events.readyState === EventSource.CLOSED && !poll) {
+        poll = setInterval(refreshComments, POLL_INTERVAL_MS);
+      }
+    };
+    return () => {
+      events.close();
+      clearInterval(poll);
+    };
   }, [postId]);
 
+  const handleShowMore = async () => {
+    try {
+      const res = await fetch(
+        `/api/comment/getPostComments/${postId}?cursor=${nextCursor}`
+      );
+      if (res.ok) {
+        const data = await res.json();
+        setComments([...comments, ...data.comments]);
+        setNextCursor(data.nextCursor);
+      }
+    } catch (error) {
+      console.log(error.message);
+    }
+  };
+
   const handleLike = async (commentId) => {
     if (!currentUser) {
       navigate('/sign-in');
@@ -104,7 +190,9 @@ export default function CommentSection({ postId }) {
         method: 'DELETE',
       });
       if (res.ok) {
-        setComments(comments.filter((comment) => comment._id !== commentId));
+        const data = await res.json();
+        // The live stream may already have removed it
+        if (hasComment(commentId)) removeComments(data);
       }
     } catch (error) {
       console.log(error.message);
@@ -170,7 +258,7 @@ export default function CommentSection({ postId }) {
           <div className='text-sm my-5 flex items-center gap-1'>
             <p>Comments</p>
             <div className='border border-gray-400 py-1 px-2 rounded-sm'>
-              <p>{comments.length}</p>
+              <p>{totalComments}</p>
             </div>
           </div>
 
@@ -186,7 +274,15 @@ export default function CommentSection({ postId }) {
               }}
             />
           ))}
-          
+          {nextCursor && (
+            <button
+              type='button'
+              onClick={handleShowMore}
+              className='w-full text-teal-500 self-center text-sm py-5'
+            >
+              Show more
+            </button>
+          )}
         </>
       )}
 
@@ -31,32 +31,19 @@ export default function DashBoardMonitor() {
       try {
         setLoading(true);
         
-        const [usersRes, postsRes, commentsRes] = await Promise.all([
-          fetch('/api/user/getusers?limit=5'),
-          fetch('/api/post/getposts?limit=5'),
-          fetch('/api/comment/getcomments?limit=5')
-        ]);
+        const res = await fetch('/api/dashboard/summary');
+        const data = await res.json();
 
-        const usersData = await usersRes.json();
-        const postsData = await postsRes.json();
-        const commentsData = await commentsRes.json();
-
-        if (usersRes.ok) {
-          setUsers(usersData.users);
-          setTotalUsers(usersData.totalUsers);
-          setLastMonthUsers(usersData.lastMonthUsers);
-        }
-
-        if (postsRes.ok) {
-          setPosts(postsData.posts);
-          setTotalPosts(postsData.totalPosts);
-          setLastMonthPosts(postsData.lastMonthPosts);
-        }
-
-        if (commentsRes.ok) {
-          setComments(commentsData.comments);
-          setTotalComments(commentsData.totalComments);
-          setLastMonthComments(commentsData.lastMonthComments);
+        if (res.ok) {
+          setUsers(data.users);
+          setTotalUsers(data.totalUsers);
+          setLastMonthUsers(data.lastMonthUsers);
+          setPosts(data.posts);
+          setTotalPosts(data.totalPosts);
+          setLastMonthPosts(data.lastMonthPosts);
+          setComments(data.comments);
+          setTotalComments(data.totalComments);
+          setLastMonthComments(data.lastMonthComments);
         }
       } catch (error) {
         console.log(error.message);
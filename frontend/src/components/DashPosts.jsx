@@ -37,6 +37,7 @@ export default function DashPosts() {
         userId: currentUser._id,
         startIndex: startIndex.toString(),
         limit: '8',
+        view: 'summary',
         ...(searchTerm && { searchTerm }),
         ...(filterCategory && { category: filterCategory }),
       });
@@ -229,7 +230,7 @@ export default function DashPosts() {
                           {post.title}
                         </Link>
                         <p className="text-sm text-gray-600 dark:text-gray-400 line-clamp-2 mt-1">
-                          {post.content?.replace(/<[^>]*>/g, '').substring(0, 100)}...
+                          {(post.excerpt ?? post.content?.replace(/<[^>]*>/g, ''))?.substring(0, 100)}...
                         </p>
                       </div>
                     </td>
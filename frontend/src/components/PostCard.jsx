@@ -99,14 +99,20 @@ export default function PostCard({ post, loading = false }) {
 
         {/* Excerpt */}
         <p className="text-gray-600 text-xs line-clamp-2 leading-relaxed mb-3">
-          {getExcerpt(post.content)}
+          {post.excerpt !== undefined ? getExcerpt(post.excerpt) : getExcerpt(post.content)}
         </p>
 
         {/* Meta Information */}
         <div className="flex justify-between items-center text-xs text-gray-500 border-t border-gray-100 pt-3">
           <span className="font-medium">{formatDate(post.createdAt)}</span>
           <div className="flex items-center gap-2">
-            <span>{calculateReadingTime(post.content)}</span>
+            {post.commentCount > 0 && (
+              <>
+                <span>{post.commentCount} {post.commentCount === 1 ? 'comment' : 'comments'}</span>
+                <span className="w-1 h-1 bg-gray-300 rounded-full"></span>
+              </>
+            )}
+            <span>{post.wordCount !== undefined ? `${Math.max(1, Math.ceil(post.wordCount / 200))} min` : calculateReadingTime(post.content)}</span>
             <span className="w-1 h-1 bg-gray-300 rounded-full"></span>
             <Link 
               to={`/post/${post.slug}`}
@@ -34,7 +34,7 @@ export default function PostPage() {
           
           // Fetch recent posts
           try {
-            const recentRes = await fetch('/api/post/getposts?limit=4&sortDirection=desc');
+            const recentRes = await fetch('/api/post/getposts?limit=4&sortDirection=desc&view=summary');
             const recentData = await recentRes.json();
             if (recentRes.ok && recentData.posts) {
               // Filter out the current post from recent posts and take first 3
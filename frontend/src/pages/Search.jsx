@@ -39,6 +39,7 @@ export default function Search() {
 
     const fetchPosts = async () => {
       setLoading(true);
+      urlParams.set('view', 'summary');
       const searchQuery = urlParams.toString();
       const res = await fetch(`/api/post/getposts?${searchQuery}`);
       if (!res.ok) {
@@ -92,6 +93,7 @@ export default function Search() {
     const startIndex = numberOfPosts;
     const urlParams = new URLSearchParams(location.search);
     urlParams.set('startIndex', startIndex);
+    urlParams.set('view', 'summary');
     
     const res = await fetch(`/api/post/getposts?${urlParams.toString()}`);
     if (res.ok) {